@@ -5,21 +5,147 @@ AGENTE 1: Busqueda y Listado de Comparativos
 - Identifica si las personas clave estan en CC/TO
 """
 import base64
+import json
+import os
 import re
+import threading
+import time
 from email.utils import parseaddr
 from datetime import datetime
 
-from config import GMAIL_SEARCH_QUERY, PERSONAS_CLAVE
+from googleapiclient.errors import HttpError
 
+from config import (
+    GMAIL_SEARCH_QUERY, GMAIL_BATCH_SIZE, DIAS_BUSQUEDA, PERSONAS_CLAVE,
+    SYNC_CHECKPOINT_FILE,
+)
+from drive_reader import extraer_contenido_mensaje
+from cuota_api import ejecutar_batch, control, PeticionConCuota
+from reintentos import politica, es_reintentable, es_limite_de_cuota
 
-def buscar_comparativos(service, max_results=50):
+# Mensajes que no se pudieron descargar en esta ejecucion (se muestran en el resumen)
+_perdidos = {}
+_lock_perdidos = threading.Lock()
+
+
+def buscar_comparativos(service, max_results=50, batch_size=GMAIL_BATCH_SIZE, almacen=None,
+                        query=GMAIL_SEARCH_QUERY, excluir=None, incremental=False, plazo=None):
     """
     Busca correos que mencionen comparativos en Gmail.
     Retorna lista de diccionarios con la informacion de cada correo.
+
+    Atajo de las dos fases: listar_candidatos + completar_comparativos
+    (ver sus docstrings para los argumentos).
+    """
+    candidatos, _excluidos = listar_candidatos(
+        service, max_results=max_results, batch_size=batch_size, almacen=almacen,
+        query=query, excluir=excluir, incremental=incremental, plazo=plazo,
+    )
+    return completar_comparativos(service, candidatos, batch_size=batch_size, almacen=almacen, plazo=plazo)
+
+
+def listar_candidatos(service, max_results=50, batch_size=GMAIL_BATCH_SIZE, almacen=None,
+                      query=GMAIL_SEARCH_QUERY, excluir=None, metadata=True, incremental=False,
+                      plazo=None):
+    """
+    FASE 1: lista los correos de la busqueda y aplica los filtros baratos.
+
+    Solo se usan datos livianos (Subject/From): del almacen local, del checkpoint
+    incremental o de messages.get(format=metadata). Nada de cuerpos ni adjuntos.
+
+    Args:
+        batch_size: Mensajes por peticion batch de Gmail. Con 1 (o menos)
+            se usa el modo serial: un messages.get por mensaje.
+        almacen: AlmacenMensajes opcional; los mensajes ya guardados no se descargan.
+        query: Query de Gmail (por defecto GMAIL_SEARCH_QUERY, puede incluir exclusiones).
+        excluir: Funcion opcional excluir(asunto, de_email) -> bool.
+        metadata: Si False, no se descarga metadata solo para aplicar excluir
+            (util cuando la query de Gmail ya contiene todas las exclusiones).
+        incremental: Usar el checkpoint de history.list (solo lista correos nuevos).
+        plazo: Plazo opcional de la ejecucion. Agotado, no se piden mas paginas
+            ni metadata: los candidatos sin metadata pasan sin filtrar.
+
+    Retorna (candidatos, excluidos): dicts con id, thread_id, asunto, de_email, ...
+    """
+    print(f"\n[AGENTE 1] Buscando correos con: '{query}'")
+
+    history_id_actual = None
+    if incremental:
+        candidatos, history_id_actual = _listar_incremental(service, query, max_results, plazo)
+    else:
+        candidatos = [{"id": i} for i in _listar_ids(service, query, max_results, plazo)]
+
+    # Metadata de lo que ya esta en el almacen local (sin llamar a Gmail)
+    if almacen:
+        for cand in candidatos:
+            registro = almacen.obtener(cand["id"])
+            if registro:
+                cand["comparativo"] = registro["comparativo"]
+                cand.update(_metadata_de_comparativo(registro["comparativo"]))
+
+    # En modo incremental siempre: el checkpoint necesita internal_date de los nuevos
+    if (excluir and metadata) or incremental:
+        por_id = {c["id"]: c for c in candidatos}
+        sin_metadata = [c["id"] for c in candidatos if c.get("asunto") is None]
+        for msg in _descargar_mensajes(service, sin_metadata, batch_size, formato="metadata", plazo=plazo):
+            por_id[msg["id"]].update(_metadata_de_mensaje(msg))
+
+    conservados = []
+    excluidos = []
+    for cand in candidatos:
+        if excluir and cand.get("asunto") is not None and excluir(cand["asunto"], cand.get("de_email", "")):
+            excluidos.append(cand)
+        else:
+            conservados.append(cand)
+
+    if excluidos:
+        print(f"[AGENTE 1] {len(excluidos)} correos descartados por metadata (remitente/asunto excluido).")
+
+    # El checkpoint guarda id + metadata de TODOS los listados (tambien los excluidos):
+    # en la proxima ejecucion no se vuelven a consultar. Con el plazo agotado el
+    # listado o la metadata pueden estar incompletos: no se guarda.
+    if history_id_actual and not (plazo and plazo.agotado()):
+        _guardar_checkpoint(history_id_actual, query, candidatos)
+    return conservados, excluidos
+
+
+def completar_comparativos(service, candidatos, batch_size=GMAIL_BATCH_SIZE, almacen=None, plazo=None):
     """
-    print(f"\n[AGENTE 1] Buscando correos con: '{GMAIL_SEARCH_QUERY}'")
+    FASE 2: obtiene el mensaje completo (format=full) solo de los candidatos
+    que sobrevivieron a la fase 1 y lo parsea (monto, resumen, cuerpo_preview...).
+    Los que ya estan en el almacen local se toman de ahi sin llamar a Gmail.
 
-    resultados = []
+    Cada comparativo descargado queda tambien en su candidato (cand["comparativo"]):
+    si la descarga se corta por un error, lo ya obtenido sigue en los candidatos.
+    Con el plazo agotado no se piden mas batches.
+    """
+    comparativos = {c["id"]: c["comparativo"] for c in candidatos if "comparativo" in c}
+    faltantes = [c["id"] for c in candidatos if "comparativo" not in c]
+    if comparativos:
+        print(f"[AGENTE 1] {len(comparativos)} correos desde almacen local, {len(faltantes)} por descargar.")
+
+    por_id = {c["id"]: c for c in candidatos}
+    for msg in _descargar_mensajes(service, faltantes, batch_size, formato="full", plazo=plazo):
+        comparativo = _parsear_mensaje(msg)
+        comparativos[msg["id"]] = comparativo
+        por_id[msg["id"]]["comparativo"] = comparativo
+        if almacen:
+            almacen.guardar(msg["id"], {
+                "comparativo": comparativo,
+                **extraer_contenido_mensaje(msg.get("payload", {})),
+            })
+
+    resultados = [comparativos[c["id"]] for c in candidatos if c["id"] in comparativos]
+    print(f"[AGENTE 1] Se encontraron {len(resultados)} correos de comparativos.")
+    return resultados
+
+
+def _listar_ids(service, query, max_results, plazo=None):
+    """
+    Lista los IDs de mensajes que cumplen la query (paginando messages.list).
+    Con el plazo agotado se queda con las paginas ya leidas.
+    """
+    message_ids = []
     page_token = None
 
     while True:
@@ -28,8 +154,8 @@ def buscar_comparativos(service, max_results=50):
             .messages()
             .list(
                 userId="me",
-                q=GMAIL_SEARCH_QUERY,
-                maxResults=min(max_results - len(resultados), 100),
+                q=query,
+                maxResults=min(max_results - len(message_ids), 100),
                 pageToken=page_token,
             )
             .execute()
@@ -40,29 +166,303 @@ def buscar_comparativos(service, max_results=50):
             break
 
         for msg_ref in messages:
-            if len(resultados) >= max_results:
+            if len(message_ids) >= max_results:
                 break
-            msg_data = _procesar_mensaje(service, msg_ref["id"])
-            if msg_data:
-                resultados.append(msg_data)
+            message_ids.append(msg_ref["id"])
 
         page_token = response.get("nextPageToken")
-        if not page_token or len(resultados) >= max_results:
+        if not page_token or len(message_ids) >= max_results:
+            break
+        if plazo and plazo.agotado():
+            print(f"[AGENTE 1] [WARN] Plazo agotado: listado cortado en {len(message_ids)} correos.")
+            plazo.omitir("paginas de messages.list")
             break
 
-    print(f"[AGENTE 1] Se encontraron {len(resultados)} correos de comparativos.")
-    return resultados
+    return message_ids
 
 
-def _procesar_mensaje(service, message_id):
-    """Procesa un mensaje individual y extrae informacion relevante."""
-    msg = (
-        service.users()
-        .messages()
-        .get(userId="me", id=message_id, format="full")
-        .execute()
-    )
+def _metadata_de_mensaje(msg):
+    """Datos livianos de un mensaje (format=metadata o full)."""
+    headers = {h["name"].lower(): h["value"] for h in msg.get("payload", {}).get("headers", [])}
+    de = headers.get("from", "")
+    return {
+        "thread_id": msg.get("threadId", ""),
+        "internal_date": int(msg.get("internalDate", 0)),
+        "asunto": headers.get("subject", "(Sin asunto)"),
+        "de": de,
+        "de_email": parseaddr(de)[1],
+    }
+
+
+def _metadata_de_comparativo(comparativo):
+    """Mismos datos livianos, desde un comparativo ya parseado."""
+    return {k: comparativo.get(k) for k in ("thread_id", "internal_date", "asunto", "de", "de_email")}
+
+
+def _descargar_mensajes(service, message_ids, batch_size=GMAIL_BATCH_SIZE, formato="full", plazo=None):
+    """
+    Descarga mensajes en batch o uno por uno (segun batch_size).
+
+    Generador: entrega cada batch apenas llega, asi lo recibido no se pierde si
+    un batch posterior falla. Con el plazo agotado no se empiezan mas batches.
+    """
+    paso = batch_size if batch_size and batch_size > 1 else 1
+    for inicio in range(0, len(message_ids), paso):
+        if plazo and plazo.agotado():
+            faltan = len(message_ids) - inicio
+            print(f"[AGENTE 1] [WARN] Plazo agotado: {faltan} mensajes sin descargar ({formato}).")
+            plazo.omitir("mensajes de Gmail", faltan)
+            return
+        parte = message_ids[inicio:inicio + paso]
+        if paso > 1:
+            yield from _obtener_mensajes_batch(service, parte, batch_size, formato=formato)
+        else:
+            msg = _obtener_mensaje_o_registrar(service, parte[0], formato)
+            if msg is not None:
+                yield msg
+
+
+# ============================================================================
+# SINCRONIZACION INCREMENTAL (history.list + checkpoint)
+# ============================================================================
+
+def _listar_incremental(service, query, max_results, plazo=None):
+    """
+    Lista los candidatos reutilizando el checkpoint de la ejecucion anterior.
+
+    1. Lee el historial de Gmail (history.list) desde el ultimo historyId
+    2. Descarta del checkpoint los correos eliminados o fuera del rango de dias
+    3. Agrega solo los correos nuevos que cumplen la query
+    Si no hay checkpoint o es demasiado antiguo, hace el listado completo.
+
+    Solo ahorra la fase 1 (listado y metadata). El checkpoint no guarda nada del
+    cuerpo: completar_comparativos descarga igual los candidatos que no estan en
+    el almacen local (en GitHub Actions, todos en cada ejecucion).
+
+    Retorna (candidatos, history_id_actual); el checkpoint nuevo se guarda con
+    _guardar_checkpoint al terminar la fase 1 (cuando ya se conoce la metadata).
+    """
+    # historyId ANTES de buscar: lo que llegue durante la ejecucion se vera la proxima vez
+    history_id_actual = service.users().getProfile(userId="me").execute().get("historyId")
+
+    checkpoint = _leer_checkpoint(query)
+    cambios = None
+    if checkpoint:
+        cambios = _leer_historial(service, checkpoint["history_id"])
+
+    if cambios is None:
+        print("[AGENTE 1] Sin checkpoint de sincronizacion valido. Listado completo.")
+        candidatos = [{"id": i} for i in _listar_ids(service, query, max_results, plazo)]
+    else:
+        agregados, eliminados = cambios
+        print(f"[AGENTE 1] Sincronizacion incremental desde historyId {checkpoint['history_id']} "
+              f"({len(agregados)} agregados, {len(eliminados)} eliminados)")
+
+        limite_ms = (time.time() - DIAS_BUSQUEDA * 86400) * 1000
+        previos = [
+            dict(c) for c in checkpoint["mensajes"]
+            if c["id"] not in eliminados and c.get("internal_date", 0) >= limite_ms
+        ]
+        ids_previos = {c["id"] for c in previos}
+
+        nuevos = []
+        if agregados:
+            # Solo los agregados que cumplen la query (busqueda acotada a la fecha del checkpoint)
+            desde = int(checkpoint["fecha"]) - 86400
+            candidatos_query = _listar_ids(service, f"{query} after:{desde}", max_results, plazo)
+            nuevos = [{"id": i} for i in candidatos_query if i in agregados and i not in ids_previos]
+
+        # Mismo orden que messages.list: mas recientes primero (los nuevos van arriba)
+        previos.sort(key=lambda c: c.get("internal_date", 0), reverse=True)
+        candidatos = (nuevos + previos)[:max_results]
+        print(f"[AGENTE 1] {len(nuevos)} correos nuevos, {len(candidatos) - len(nuevos)} del checkpoint.")
+
+    return candidatos, history_id_actual
+
+
+def _leer_historial(service, start_history_id):
+    """
+    Lee los cambios del buzon desde start_history_id.
+    Retorna (ids_agregados, ids_eliminados) o None si el historyId ya expiro.
+    """
+    agregados = set()
+    eliminados = set()
+    page_token = None
+
+    try:
+        while True:
+            response = (
+                service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded", "messageDeleted", "labelAdded"],
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+
+            for registro in response.get("history", []):
+                for item in registro.get("messagesAdded", []):
+                    agregados.add(item["message"]["id"])
+                for item in registro.get("messagesDeleted", []):
+                    eliminados.add(item["message"]["id"])
+                for item in registro.get("labelsAdded", []):
+                    # Enviados a papelera o spam: la busqueda normal ya no los incluye
+                    if {"TRASH", "SPAM"} & set(item.get("labelIds", [])):
+                        eliminados.add(item["message"]["id"])
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+    except HttpError as e:
+        # 404: el historyId es demasiado antiguo (Gmail solo guarda historial reciente)
+        if e.resp.status == 404:
+            print("[AGENTE 1] Checkpoint de sincronizacion expirado.")
+            return None
+        raise
+
+    return agregados - eliminados, eliminados
+
+
+def _leer_checkpoint(query):
+    """Lee el checkpoint de la ultima sincronizacion (None si no existe o no aplica)."""
+    if not os.path.exists(SYNC_CHECKPOINT_FILE):
+        return None
+    try:
+        with open(SYNC_CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[AGENTE 1] [WARN] Checkpoint ilegible, se ignora: {e}")
+        return None
+
+    # Si la query cambio, los resultados guardados ya no son comparables
+    if checkpoint.get("query") != query or not checkpoint.get("history_id"):
+        return None
+    return checkpoint
+
+
+def _guardar_checkpoint(history_id, query, candidatos):
+    """Guarda el historyId actual y los correos listados (id + metadata, sin cuerpo)."""
+    os.makedirs(os.path.dirname(SYNC_CHECKPOINT_FILE), exist_ok=True)
+    checkpoint = {
+        "history_id": history_id,
+        "fecha": int(time.time()),
+        "query": query,
+        "mensajes": [
+            {k: v for k, v in c.items() if k != "comparativo"} for c in candidatos
+        ],
+    }
+    tmp = SYNC_CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp, SYNC_CHECKPOINT_FILE)
+
+
+def _obtener_mensajes_batch(service, message_ids, batch_size=GMAIL_BATCH_SIZE, formato="full"):
+    """
+    Descarga mensajes (format=full o metadata) agrupados en peticiones batch de Gmail.
+    Retorna los mensajes en el mismo orden de message_ids.
+
+    Cada parte del batch responde por separado: las que fallan con un error
+    transitorio (429, 403 rateLimitExceeded, 5xx) se vuelven a pedir en otro batch
+    con el backoff de la politica de reintentos, y un limite de cuota frena al
+    control AIMD igual que si la peticion hubiera ido sola. Las que fallan de forma
+    definitiva quedan en mensajes_perdidos() (igual que en el modo serial).
+    """
+    # Gmail acepta hasta 100 llamadas por batch
+    batch_size = max(1, min(batch_size, 100))
+    mensajes = {}
+    pendientes = list(message_ids)
+    intento = 0
+
+    while pendientes:
+        fallidos = {}
+
+        def _callback(request_id, response, exception):
+            if exception is None:
+                mensajes[request_id] = response
+                fallidos.pop(request_id, None)
+            else:
+                fallidos[request_id] = exception
+
+        for inicio in range(0, len(pendientes), batch_size):
+            batch = service.new_batch_http_request(callback=_callback)
+            peticiones = []
+            lote = pendientes[inicio:inicio + batch_size]
+            for message_id in lote:
+                peticion = _peticion_mensaje(service, message_id, formato)
+                batch.add(peticion, request_id=message_id)
+                peticiones.append(peticion)
+            ejecutar_batch(batch, peticiones)
+            # Un batch es una sola peticion HTTP: a lo mas un decremento por batch
+            if any(es_limite_de_cuota(fallidos[m]) for m in lote if m in fallidos):
+                control.registrar_limite(peticiones[0].methodId)
+
+        pendientes = [m for m in pendientes if m in fallidos and es_reintentable(fallidos[m])]
+        for message_id, error in fallidos.items():
+            if message_id not in pendientes:
+                _registrar_perdido(message_id, error)
+        if not pendientes:
+            break
+        intento += 1
+        # Un limite de cuota manda en la espera (respeta su Retry-After)
+        errores = [fallidos[m] for m in pendientes]
+        error = next((e for e in errores if es_limite_de_cuota(e)), errores[0])
+        if not politica.reintentar(intento, error, cantidad=len(pendientes)):
+            for message_id in pendientes:
+                _registrar_perdido(message_id, fallidos[message_id])
+            break
+        print(f"  [INFO] Reintentando {len(pendientes)} mensajes del batch (intento {intento + 1})")
+
+    return [mensajes[message_id] for message_id in message_ids if message_id in mensajes]
+
+
+def _obtener_mensaje_o_registrar(service, message_id, formato="full"):
+    """
+    Modo serial: descarga un mensaje con la misma politica de reintentos que el
+    batch. Si falla de forma definitiva queda en mensajes_perdidos() y retorna None.
+    """
+    peticion = _peticion_mensaje(service, message_id, formato)
+    try:
+        # PeticionConCuota ya reintenta (y avisa al control de cuota): no se reintenta dos veces
+        if isinstance(peticion, PeticionConCuota):
+            return peticion.execute()
+        return politica.ejecutar(peticion.execute)
+    except HttpError as e:
+        _registrar_perdido(message_id, e)
+        return None
+
+
+def _registrar_perdido(message_id, error):
+    print(f"  [WARN] Error obteniendo mensaje {message_id}: {error}")
+    with _lock_perdidos:
+        _perdidos[message_id] = error
+
+
+def mensajes_perdidos():
+    """{message_id: error} de los mensajes que no se pudieron descargar en esta ejecucion."""
+    with _lock_perdidos:
+        return dict(_perdidos)
+
+
+def _obtener_mensaje(service, message_id, formato="full"):
+    """Descarga un mensaje individual (format=full o metadata)."""
+    return _peticion_mensaje(service, message_id, formato).execute()
+
+
+def _peticion_mensaje(service, message_id, formato="full"):
+    """Construye la peticion messages.get; con formato metadata solo pide Subject/From."""
+    if formato == "metadata":
+        return service.users().messages().get(
+            userId="me", id=message_id, format="metadata", metadataHeaders=["Subject", "From"]
+        )
+    return service.users().messages().get(userId="me", id=message_id, format="full")
+
 
+def _parsear_mensaje(msg):
+    """Extrae la informacion relevante de un mensaje de Gmail (format=full)."""
     headers = msg.get("payload", {}).get("headers", [])
     header_dict = {h["name"].lower(): h["value"] for h in headers}
 
@@ -102,6 +502,7 @@ def _procesar_mensaje(service, message_id):
     return {
         "id": msg["id"],
         "thread_id": thread_id,
+        "internal_date": int(msg.get("internalDate", 0)),
         "asunto": asunto,
         "de": de,
         "de_email": parseaddr(de)[1],
@@ -7,32 +7,52 @@ AGENTE 3: Seguimiento de Comparativos
 """
 import base64
 import re
+from collections import namedtuple
 from email.utils import parseaddr
 
 from config import PERSONAS_CLAVE, PALABRAS_NO_REQUIERE_RESPUESTA, USUARIO_NOMBRE
+from repositorio_hilos import HEADERS_METADATA, FIELDS_METADATA
 
 
-# Emails conocidos de personas tracked
-_EMAILS_TRACKED = set()
+# Datos fijos de una ejecucion de seguimiento (inmutable: se comparte entre workers)
+ContextoSeguimiento = namedtuple("ContextoSeguimiento", ["mi_email"])
 
 
-def realizar_seguimiento(service, comparativos, mi_email):
-    """Revisa el estado de respuesta de cada comparativo."""
+def crear_contexto(mi_email):
+    """Contexto de una ejecucion de seguimiento."""
+    return ContextoSeguimiento(mi_email=mi_email.lower())
+
+
+def realizar_seguimiento(service, comparativos, mi_email, hilos=None):
+    """
+    Revisa el estado de respuesta de cada comparativo (en serie).
+
+    main.py no usa esta funcion: ejecuta analizar_comparativo por comparativo
+    como tareas del Planificador, en paralelo con la extraccion de Drive.
+
+    Args:
+        hilos: RepositorioHilos opcional; reutiliza los hilos ya descargados
+            por drive_reader en lugar de pedirlos de nuevo a Gmail.
+    """
     print("\n[AGENTE 3] Realizando seguimiento de comparativos...")
 
-    _EMAILS_TRACKED.add(mi_email.lower())
-    for _key, _persona in PERSONAS_CLAVE.items():
-        _email = _persona.get("email", "")
-        if _email:
-            _EMAILS_TRACKED.add(_email.lower())
+    contexto = crear_contexto(mi_email)
+    seguimiento = [
+        _analizar_thread(service, comp["thread_id"], comp, contexto, hilos)
+        for comp in comparativos
+    ]
 
-    seguimiento = []
+    imprimir_resumen(seguimiento)
+    return seguimiento
+
+
+def analizar_comparativo(service, comparativo, contexto, hilos=None):
+    """Estado de respuesta de un solo comparativo (para el planificador de main.py)."""
+    return _analizar_thread(service, comparativo["thread_id"], comparativo, contexto, hilos)
 
-    for comp in comparativos:
-        thread_id = comp["thread_id"]
-        estado = _analizar_thread(service, thread_id, comp, mi_email)
-        seguimiento.append(estado)
 
+def imprimir_resumen(seguimiento):
+    """Imprime el conteo de respondidos/pendientes."""
     respondidos = sum(1 for s in seguimiento if s["estado_general"] == "RESPONDIDO")
     pendientes = sum(1 for s in seguimiento if s["estado_general"] == "PENDIENTE")
 
@@ -41,10 +61,8 @@ def realizar_seguimiento(service, comparativos, mi_email):
     print(f"  Pendiente (requiere respuesta): {pendientes}")
     print(f"  Total: {len(seguimiento)}")
 
-    return seguimiento
-
 
-def _analizar_thread(service, thread_id, comparativo, mi_email):
+def _analizar_thread(service, thread_id, comparativo, contexto, hilos=None):
     """
     Analiza un thread completo.
 
@@ -57,13 +75,21 @@ def _analizar_thread(service, thread_id, comparativo, mi_email):
     3. Si el ultimo mensaje que REQUIERE respuesta ya fue respondido -> RESPONDIDO
     4. Si no fue respondido -> PENDIENTE
     """
+    # Solo se usan From/Date/Subject + snippet: basta con format=metadata.
+    # Ningun clasificador lee el cuerpo (_mensaje_requiere_respuesta usa snippet + asunto)
     try:
-        thread = (
-            service.users()
-            .threads()
-            .get(userId="me", id=thread_id, format="full")
-            .execute()
-        )
+        if hilos:
+            thread = hilos.obtener(service, thread_id, formato="metadata")
+        else:
+            thread = (
+                service.users()
+                .threads()
+                .get(
+                    userId="me", id=thread_id, format="metadata",
+                    metadataHeaders=HEADERS_METADATA, fields=FIELDS_METADATA,
+                )
+                .execute()
+            )
     except Exception as e:
         return {
             "id": comparativo["id"],
@@ -111,7 +137,7 @@ def _analizar_thread(service, thread_id, comparativo, mi_email):
         es_tracked = False
 
         # Verificar si es del usuario
-        if from_email == mi_email.lower():
+        if from_email == contexto.mi_email:
             es_tracked = True
             respuestas["yo"]["respondio"] = True
             respuestas["yo"]["fecha_respuesta"] = fecha
@@ -141,7 +167,7 @@ def _analizar_thread(service, thread_id, comparativo, mi_email):
             first_headers = {h["name"].lower(): h["value"] for h in mensajes[0].get("payload", {}).get("headers", [])}
             first_from = parseaddr(first_headers.get("from", ""))[1].lower()
 
-        if first_from == mi_email.lower():
+        if first_from == contexto.mi_email:
             estado_general = "RESPONDIDO"
         else:
             estado_general = "PENDIENTE"
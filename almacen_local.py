@@ -0,0 +1,206 @@
+"""
+Almacen local (SQLite) para datos que no cambian entre ejecuciones.
+
+Los mensajes de Gmail son inmutables: una vez parseados no hace falta volver
+a descargarlos (messages.get format=full) en las siguientes ejecuciones.
+Los hilos si cambian, por eso se guardan junto con su historyId.
+
+Cada tabla tiene:
+- Version de esquema: si cambia (p.ej. cambio la logica de parseo), la tabla
+  se recrea vacia en lugar de devolver datos con formato viejo.
+- Limite de tamano: al superarlo se eliminan los registros usados hace mas tiempo.
+
+Mensajes e hilos (cuerpos de correos) van en ALMACEN_CORREOS_DB, que nunca
+se sube a la cache de GitHub Actions; en ALMACEN_DB (CACHE_DIR, si se sube)
+solo quedan los resultados de Excel.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config import ALMACEN_DB, ALMACEN_CORREOS_DB, ALMACEN_MAX_MB_MENSAJES, ALMACEN_MAX_MB_HILOS, ALMACEN_MAX_MB_EXCEL
+
+
+class _TablaSQLite:
+    """Tabla clave -> JSON con version de esquema y desalojo por tamano (LRU)."""
+
+    TABLA = None
+    VERSION = 1
+
+    def __init__(self, ruta=ALMACEN_DB, max_mb=100):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self._max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self._crear_esquema()
+
+    def _crear_esquema(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS esquema (tabla TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            fila = self._conn.execute(
+                "SELECT version FROM esquema WHERE tabla = ?", (self.TABLA,)
+            ).fetchone()
+            if fila is None or fila[0] != self.VERSION:
+                if fila is not None:
+                    print(f"[ALMACEN] Esquema de '{self.TABLA}' cambio (v{fila[0]} -> v{self.VERSION}). Se recrea.")
+                self._conn.execute(f"DROP TABLE IF EXISTS {self.TABLA}")
+                self._conn.execute(
+                    f"CREATE TABLE {self.TABLA} ("
+                    "clave TEXT PRIMARY KEY, datos TEXT NOT NULL, "
+                    "tamano INTEGER NOT NULL, ultimo_acceso REAL NOT NULL)"
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO esquema (tabla, version) VALUES (?, ?)",
+                    (self.TABLA, self.VERSION),
+                )
+
+    def _obtener(self, clave):
+        """Retorna el dict guardado para la clave, o None."""
+        with self._lock, self._conn:
+            fila = self._conn.execute(
+                f"SELECT datos FROM {self.TABLA} WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            self._conn.execute(
+                f"UPDATE {self.TABLA} SET ultimo_acceso = ? WHERE clave = ?", (time.time(), clave)
+            )
+        return json.loads(fila[0])
+
+    def _guardar(self, clave, datos):
+        """Guarda (o reemplaza) el dict de la clave y aplica el limite de tamano."""
+        texto = json.dumps(datos, ensure_ascii=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.TABLA} (clave, datos, tamano, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                (clave, texto, len(texto.encode("utf-8")), time.time()),
+            )
+            self._desalojar()
+
+    def _eliminar(self, clave):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.TABLA} WHERE clave = ?", (clave,))
+
+    def _desalojar(self):
+        """Elimina los registros menos usados hasta quedar bajo el limite (llamar con lock)."""
+        total = self._conn.execute(f"SELECT COALESCE(SUM(tamano), 0) FROM {self.TABLA}").fetchone()[0]
+        if total <= self._max_bytes:
+            return
+        filas = self._conn.execute(
+            f"SELECT clave, tamano FROM {self.TABLA} ORDER BY ultimo_acceso ASC"
+        ).fetchall()
+        eliminar = []
+        for clave, tamano in filas:
+            if total <= self._max_bytes:
+                break
+            eliminar.append((clave,))
+            total -= tamano
+        self._conn.executemany(f"DELETE FROM {self.TABLA} WHERE clave = ?", eliminar)
+        self.desalojos += len(eliminar)
+
+    def resumen(self):
+        """Texto corto con aciertos/fallos/desalojos (para logs)."""
+        return f"{self.TABLA}: {self.aciertos} aciertos, {self.fallos} fallos, {self.desalojos} desalojos"
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AlmacenMensajes(_TablaSQLite):
+    """
+    Mensajes de Gmail ya parseados, por message id.
+
+    Cada registro contiene:
+    - comparativo: dict de agente_busqueda (asunto, de, fecha, monto, resumen, ...)
+    - adjuntos: manifiesto de adjuntos (filename, attachmentId, mimeType)
+    - texto / html: cuerpo completo (para buscar links de Drive)
+
+    Subir VERSION cuando cambie la logica de parseo (montos, resumen, etc.)
+    """
+
+    TABLA = "mensajes"
+    VERSION = 1
+
+    def __init__(self, ruta=ALMACEN_CORREOS_DB, max_mb=ALMACEN_MAX_MB_MENSAJES):
+        super().__init__(ruta, max_mb)
+
+    def obtener(self, message_id):
+        return self._obtener(message_id)
+
+    def guardar(self, message_id, registro):
+        self._guardar(message_id, registro)
+
+
+class AlmacenHilos(_TablaSQLite):
+    """
+    Hilos de Gmail (format=full) por thread id, junto con su historyId.
+    Un hilo guardado solo es valido mientras su historyId no cambie
+    (cualquier respuesta nueva o cambio de etiquetas lo incrementa).
+    """
+
+    TABLA = "hilos"
+    VERSION = 1
+
+    def __init__(self, ruta=ALMACEN_CORREOS_DB, max_mb=ALMACEN_MAX_MB_HILOS):
+        super().__init__(ruta, max_mb)
+
+    def obtener(self, thread_id):
+        """Retorna {"history_id", "hilo"} o None. Validar el historyId antes de usarlo."""
+        return self._obtener(thread_id)
+
+    def guardar(self, thread_id, hilo):
+        self._guardar(thread_id, {"history_id": hilo.get("historyId"), "hilo": hilo})
+
+
+class AlmacenExcel(_TablaSQLite):
+    """
+    Resultados de extraccion de archivos Excel ({"monto_cc", "ppto_meta_hg", "expediente"}).
+
+    Claves:
+    - "sha256:<hash>": hash del contenido del archivo (mismo Excel reenviado o
+      adjuntado en varios mensajes del hilo -> un solo parseo)
+    - "gmail:<message_id>:<filename>:<size>": adjunto de Gmail (inmutable), evita la descarga
+    - "drive:<file_id>:<md5Checksum>:<modifiedTime>": archivo de Drive, evita la descarga
+
+    Subir VERSION cuando cambie la logica de hoja_vs (los resultados guardados quedan viejos).
+    """
+
+    TABLA = "excel"
+    VERSION = 1
+
+    def __init__(self, ruta=ALMACEN_DB, max_mb=ALMACEN_MAX_MB_EXCEL):
+        super().__init__(ruta, max_mb)
+        self._eliminar_correos()
+
+    def _eliminar_correos(self):
+        """Borra mensajes/hilos que versiones anteriores guardaban en este archivo (cache de Actions)."""
+        with self._lock:
+            tablas = {fila[0] for fila in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            viejas = tablas & {AlmacenMensajes.TABLA, AlmacenHilos.TABLA}
+            if not viejas:
+                return
+            with self._conn:
+                for tabla in viejas:
+                    self._conn.execute(f"DROP TABLE {tabla}")
+                    self._conn.execute("DELETE FROM esquema WHERE tabla = ?", (tabla,))
+            # Sin VACUUM el contenido borrado sigue en las paginas libres del archivo
+            self._conn.execute("VACUUM")
+        print(f"[ALMACEN] Tablas de correos eliminadas del almacen de Excel: {', '.join(sorted(viejas))}")
+
+    def obtener(self, clave):
+        return self._obtener(clave)
+
+    def guardar(self, claves, resultado):
+        """Guarda el mismo resultado bajo varias claves (hash + identificador de origen)."""
+        for clave in claves:
+            self._guardar(clave, resultado)
@@ -2,30 +2,55 @@
 Modulo de autenticacion OAuth2 con Gmail, Drive y Sheets API.
 Maneja el flujo de autorizacion y almacenamiento de tokens.
 """
+import json
 import os
+import threading
+import time
 import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.version import __version__ as VERSION_GOOGLEAPICLIENT
 from google_auth_httplib2 import AuthorizedHttp
 
-from config import CREDENTIALS_FILE, TOKEN_FILE, SCOPES
+from config import CREDENTIALS_FILE, TOKEN_FILE, SCOPES, HTTP_POOL_SIZE, DISCOVERY_CACHE_DIR, DISCOVERY_MAX_DIAS
+from transporte_http import HttpCompartido
+from cuota_api import PeticionConCuota
 
 # Timeout HTTP para llamadas a Google APIs (segundos)
 HTTP_TIMEOUT = 30
 
 
 _creds = None
+_creds_lock = threading.Lock()
+
+# Transporte con pool de conexiones compartido por todos los servicios del proceso
+_http_compartido = None
+
+# Documentos discovery ya parseados, por (api, version): se leen una vez por proceso
+_documentos = {}
+_documentos_lock = threading.Lock()
+
+# Servicios por hilo de ejecucion: los objetos de servicio se construyen por
+# hilo; con HTTP_POOL_SIZE > 0 todos comparten el mismo pool de conexiones
+_locales = threading.local()
 
 
 def _obtener_credenciales():
     """Obtiene credenciales OAuth2, reutilizando si ya existen."""
     global _creds
 
-    if _creds and _creds.valid:
+    with _creds_lock:
+        if _creds and _creds.valid:
+            return _creds
+        _creds = _cargar_credenciales()
         return _creds
 
+
+def _cargar_credenciales():
+    """Lee token.json, lo refresca o inicia el flujo OAuth2."""
     creds = None
 
     if os.path.exists(TOKEN_FILE):
@@ -57,39 +82,149 @@ def _obtener_credenciales():
             token.write(creds.to_json())
         print("[AUTH] Token guardado exitosamente.")
 
-    _creds = creds
     return creds
 
 
 def _build_service(api, version):
     """Construye un servicio de Google API con timeout HTTP."""
     creds = _obtener_credenciales()
-    http = httplib2.Http(timeout=HTTP_TIMEOUT)
-    authorized_http = AuthorizedHttp(creds, http=http)
-    return build(api, version, http=authorized_http)
+    if HTTP_POOL_SIZE > 0:
+        http = _obtener_http_compartido(creds)
+    else:
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    documento = _documento_discovery(api, version, http)
+    # Todas las peticiones del servicio pasan por el control de cuota (cuota_api)
+    if documento is None:
+        return build(api, version, http=http, requestBuilder=PeticionConCuota)
+    return build_from_document(documento, http=http, requestBuilder=PeticionConCuota)
+
+
+def _documento_discovery(api, version, http):
+    """
+    Documento discovery de la API ya parseado (memorizado por proceso).
+    Orden: el incluido en google-api-python-client, el guardado en
+    DISCOVERY_CACHE_DIR (misma version de la libreria y menos de
+    DISCOVERY_MAX_DIAS) y por ultimo la red (se guarda en disco).
+    Retorna None si no se pudo obtener (build() lo intentara por su cuenta).
+    """
+    with _documentos_lock:
+        if (api, version) in _documentos:
+            return _documentos[(api, version)]
+
+        texto = discovery_cache.get_static_doc(api, version)
+        if texto is None:
+            texto = _leer_discovery_en_disco(api, version)
+        if texto is None:
+            texto = _descargar_discovery(api, version, http)
+
+        documento = json.loads(texto) if texto else None
+        _documentos[(api, version)] = documento
+        return documento
+
+
+def _ruta_discovery(api, version):
+    return os.path.join(DISCOVERY_CACHE_DIR, f"{api}.{version}.json")
+
+
+def _leer_discovery_en_disco(api, version):
+    try:
+        with open(_ruta_discovery(api, version), "r", encoding="utf-8") as f:
+            guardado = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if guardado.get("libreria") != VERSION_GOOGLEAPICLIENT:
+        return None
+    if time.time() - guardado.get("guardado", 0) > DISCOVERY_MAX_DIAS * 86400:
+        return None
+    return guardado.get("documento")
+
+
+def _descargar_discovery(api, version, http):
+    url = f"https://{api}.googleapis.com/$discovery/rest?version={version}"
+    try:
+        resp, contenido = http.request(url)
+    except Exception as e:
+        print(f"[AUTH] No se pudo descargar discovery de {api} {version}: {e}")
+        return None
+    if resp.status != 200:
+        return None
+    texto = contenido.decode("utf-8") if isinstance(contenido, bytes) else contenido
+    try:
+        os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+        ruta = _ruta_discovery(api, version)
+        with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"libreria": VERSION_GOOGLEAPICLIENT, "guardado": time.time(),
+                       "documento": texto}, f)
+        os.replace(ruta + ".tmp", ruta)
+    except OSError as e:
+        print(f"[AUTH] No se pudo guardar discovery de {api} {version}: {e}")
+    return texto
+
+
+def _obtener_http_compartido(creds):
+    """Crea (una vez por proceso) el transporte con pool de conexiones keep-alive."""
+    global _http_compartido
+
+    with _creds_lock:
+        if _http_compartido is None:
+            _http_compartido = HttpCompartido(creds, HTTP_POOL_SIZE, HTTP_TIMEOUT)
+        return _http_compartido
+
+
+def resumen_transporte():
+    """Estadisticas de reutilizacion de conexiones (None sin transporte compartido)."""
+    if _http_compartido is None:
+        return None
+    return _http_compartido.resumen()
 
 
 def autenticar_gmail():
     """Retorna el servicio de Gmail API."""
+    inicio = time.monotonic()
     service = _build_service("gmail", "v1")
-    print("[AUTH] Conectado a Gmail API correctamente.")
+    print(f"[AUTH] Conectado a Gmail API correctamente ({time.monotonic() - inicio:.2f}s).")
     return service
 
 
 def autenticar_drive():
     """Retorna el servicio de Google Drive API."""
+    inicio = time.monotonic()
     service = _build_service("drive", "v3")
-    print("[AUTH] Conectado a Drive API correctamente.")
+    print(f"[AUTH] Conectado a Drive API correctamente ({time.monotonic() - inicio:.2f}s).")
     return service
 
 
 def autenticar_sheets():
     """Retorna el servicio de Google Sheets API."""
+    inicio = time.monotonic()
     service = _build_service("sheets", "v4")
-    print("[AUTH] Conectado a Sheets API correctamente.")
+    print(f"[AUTH] Conectado a Sheets API correctamente ({time.monotonic() - inicio:.2f}s).")
     return service
 
 
+def servicio_del_hilo(api, version):
+    """
+    Retorna el servicio (api, version) propio del hilo actual.
+    Se construye la primera vez que el hilo lo pide y se reutiliza despues.
+    Usar desde workers de un ThreadPoolExecutor en lugar de compartir servicios.
+    """
+    servicios = getattr(_locales, "servicios", None)
+    if servicios is None:
+        servicios = _locales.servicios = {}
+    if (api, version) not in servicios:
+        servicios[(api, version)] = _build_service(api, version)
+    return servicios[(api, version)]
+
+
+def servicios_del_hilo():
+    """Retorna (gmail, drive, sheets) propios del hilo actual."""
+    return (
+        servicio_del_hilo("gmail", "v1"),
+        servicio_del_hilo("drive", "v3"),
+        servicio_del_hilo("sheets", "v4"),
+    )
+
+
 def obtener_perfil(service):
     """Obtiene el perfil del usuario autenticado."""
     profile = service.users().getProfile(userId="me").execute()
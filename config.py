@@ -46,6 +46,11 @@ SCOPES = [
 # Directorio temporal para descargar archivos
 TEMP_DIR = os.path.join(BASE_DIR, "temp_files")
 
+# Procesos para parsear Excel (openpyxl) sin frenar las descargas; 0 = en el mismo proceso
+EXCEL_PROCESOS = 2
+# Segundos maximos por archivo Excel; si se superan, el archivo se descarta
+EXCEL_TIMEOUT = 60
+
 # ============================================================
 # DATOS SENSIBLES (desde variables de entorno / GitHub Secrets)
 # ============================================================
@@ -86,11 +91,88 @@ DIAS_BUSQUEDA = 7
 # Query de busqueda en Gmail (combinacion OR + filtro de fecha)
 GMAIL_SEARCH_QUERY = f"({' OR '.join(SEARCH_KEYWORDS)}) newer_than:{DIAS_BUSQUEDA}d"
 
+# Largo maximo de la query de Gmail al agregar exclusiones (-from:/-subject:)
+# Las exclusiones que no entran se aplican localmente (ver enviar_reporte.py)
+GMAIL_QUERY_MAX_LEN = 1500
+
+# Mensajes por peticion batch de Gmail (max 100; Google recomienda <= 50)
+# Con 1 se desactiva el batch y se hace un messages.get por mensaje
+GMAIL_BATCH_SIZE = 50
+
+# Conexiones keep-alive por host del transporte HTTP compartido por Gmail,
+# Drive y Sheets (>= workers para que ninguno espere conexion). Con 0 se usa
+# un httplib2.Http por servicio (sin pool)
+HTTP_POOL_SIZE = 10
+
+# Cuota por API para el control de cuota (ver cuota_api.py):
+# (unidades por segundo, rafaga, peticiones simultaneas maximas)
+# Gmail: 250 unidades/s por usuario; Drive: ~200 peticiones/s por usuario;
+# Sheets: 60 lecturas/min por usuario
+CUOTAS_API = {
+    "gmail": (200, 250, 10),
+    "drive": (150, 200, 10),
+    "sheets": (1, 5, 4),
+}
+
+# Reintentos de errores transitorios (429, 5xx, timeouts), ver reintentos.py:
+# intentos maximos, espera base/tope del backoff (segundos) y presupuesto global
+# (reintentos <= minimo + fraccion * peticiones)
+REINTENTOS_MAX = 4
+REINTENTO_BASE_SEG = 0.5
+REINTENTO_TOPE_SEG = 20
+PRESUPUESTO_REINTENTOS = 0.2
+PRESUPUESTO_REINTENTOS_MINIMO = 10
+# Descargas mas lentas que este percentil (de las ultimas del mismo tipo) se
+# duplican y se usa la primera respuesta; requiere un minimo de muestras
+COBERTURA_PERCENTIL = 95
+COBERTURA_MIN_MUESTRAS = 20
+
+# Plazo de ejecucion (main.py --deadline, ver plazo.py): segundos antes del fin
+# en que se deja de empezar trabajo opcional (carpetas de Drive, adjuntos del
+# hilo) y en que ya no se empiezan tareas nuevas para guardar caches y reporte
+PLAZO_RESERVA_OPCIONAL = 120
+PLAZO_RESERVA_GUARDAR = 45
+
+# Comparativos que se procesan en paralelo al extraer datos de adjuntos/Drive
+# y al analizar los hilos en el seguimiento. Con 1 se procesan en serie
+EXTRACCION_WORKERS = 4
+
 # Archivo de salida para reportes
 REPORT_DIR = os.path.join(BASE_DIR, "reportes")
 REPORT_FILE = os.path.join(REPORT_DIR, "reporte_comparativos.txt")
 REPORT_JSON = os.path.join(REPORT_DIR, "comparativos_data.json")
 
+# Estado persistente entre ejecuciones (checkpoints de sincronizacion)
+# En GitHub Actions se conserva con actions/cache
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+# Checkpoint de --incremental: historyId + id y metadata (Subject/From/fecha) de los
+# listados, sin nada del cuerpo. Ahorra messages.list y la metadata de los ya listados,
+# pero el mensaje completo (monto, filtro REQ, adjuntos, links de Drive) sale del
+# almacen de correos: donde este no se conserva (GitHub Actions) cada candidato se
+# descarga completo en cada ejecucion, sea nuevo o no.
+SYNC_CHECKPOINT_FILE = os.path.join(CACHE_DIR, "sync_checkpoint.json")
+
+# Almacen local SQLite de resultados de Excel (por hash / version, ver almacen_local.py)
+ALMACEN_DB = os.path.join(CACHE_DIR, "almacen.sqlite3")
+# Almacen de mensajes y hilos de Gmail (cuerpos completos de correos de proveedores).
+# Queda FUERA de CACHE_DIR: actions/cache es legible desde cualquier ejecucion del
+# repositorio, asi que en GitHub Actions no se conserva entre ejecuciones
+ALMACEN_CORREOS_DB = os.path.join(BASE_DIR, "datos_locales", "correos.sqlite3")
+# Layouts de hoja VS aprendidos por plantilla (ver hoja_vs.LayoutsVS)
+LAYOUTS_VS_FILE = os.path.join(CACHE_DIR, "layouts_vs.json")
+# Listados de carpetas de Drive + token de la Changes API (ver indice_carpetas.py)
+CARPETAS_DRIVE_FILE = os.path.join(CACHE_DIR, "carpetas_drive.json")
+# Documentos discovery de APIs que no vienen incluidos en google-api-python-client
+# (los de Gmail, Drive y Sheets si vienen); se descargan de nuevo pasados N dias
+DISCOVERY_CACHE_DIR = os.path.join(CACHE_DIR, "discovery")
+DISCOVERY_MAX_DIAS = 7
+# Tamano maximo de la tabla de mensajes (MB); al superarlo se eliminan los menos usados
+ALMACEN_MAX_MB_MENSAJES = 100
+# Tamano maximo de la tabla de hilos completos (threads.get format=full)
+ALMACEN_MAX_MB_HILOS = 200
+# Tamano maximo de la tabla de resultados de Excel (por hash de contenido)
+ALMACEN_MAX_MB_EXCEL = 10
+
 
 # ============================================================
 # OBRAS / PROYECTOS
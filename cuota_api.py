@@ -0,0 +1,226 @@
+"""
+Control de cuota para las llamadas a Google APIs (Gmail, Drive, Sheets).
+
+Todas las peticiones pasan por PeticionConCuota (requestBuilder de los
+servicios, ver auth_gmail._build_service), que antes de ejecutarse pide
+permiso al ControlCuota del proceso:
+
+- Token bucket por API, en unidades de cuota: en Gmail cada metodo cuesta
+  distinto (messages.get = 5, threads.get = 10, ...); en Drive/Sheets 1.
+- Limite de concurrencia AIMD por API: baja a la mitad con cada 429 /
+  403 rateLimitExceeded y sube de a poco con cada respuesta correcta.
+- Carriles de prioridad: cuando hay que esperar, pasa primero el
+  seguimiento (lo que se muestra en el reporte), luego el resto y al final
+  la extraccion de Drive/Sheets (especulativa: puede no encontrar nada).
+
+El carril se fija con el context manager carril() (por hilo; las copias
+de reintentos.CoberturaLatencia heredan el carril de quien las pide).
+
+Alrededor del control de cuota, PeticionConCuota aplica los reintentos y
+las peticiones duplicadas de reintentos.py: cada intento pide cuota de nuevo.
+"""
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from config import CUOTAS_API
+from reintentos import politica, cobertura, es_limite_de_cuota, NO_REINTENTAR, METODOS_CUBIERTOS
+from transporte_http import HttpCompartido
+
+# Costo en unidades de cuota de Gmail por metodo (el resto de Gmail: COSTO_GMAIL_DEFECTO)
+COSTOS_GMAIL = {
+    "gmail.users.getProfile": 1,
+    "gmail.users.history.list": 2,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.attachments.get": 5,
+    "gmail.users.threads.get": 10,
+    "gmail.users.threads.list": 10,
+    "gmail.users.messages.send": 100,
+}
+COSTO_GMAIL_DEFECTO = 5
+
+# Carriles de prioridad (menor = pasa antes)
+CARRILES = {"seguimiento": 0, "normal": 1, "extraccion": 2}
+
+_carril = ContextVar("carril", default="normal")
+
+
+@contextmanager
+def carril(nombre):
+    """Las peticiones de este hilo dentro del bloque usan el carril indicado."""
+    token = _carril.set(nombre)
+    try:
+        yield
+    finally:
+        _carril.reset(token)
+
+
+def costo(method_id):
+    """(api, unidades) de un methodId de discovery (p.ej. "gmail.users.threads.get")."""
+    api = (method_id or "").split(".", 1)[0]
+    if api == "gmail":
+        return api, COSTOS_GMAIL.get(method_id, COSTO_GMAIL_DEFECTO)
+    return api, 1
+
+
+class _EstadoApi:
+    def __init__(self, unidades_por_segundo, rafaga, concurrencia, ahora):
+        self.tasa = float(unidades_por_segundo)
+        self.capacidad = float(rafaga)
+        self.tokens = float(rafaga)
+        self.actualizado = ahora
+        self.concurrencia_max = concurrencia
+        self.limite = float(concurrencia)
+        self.en_curso = 0
+        self.espera = []  # heap de (prioridad, orden)
+        self.peticiones = 0
+        self.limitadas = 0
+        self.segundos_espera = 0.0
+        self.limite_minimo = concurrencia
+
+    def recargar(self, ahora):
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.tasa)
+        self.actualizado = ahora
+
+
+class ControlCuota:
+    """Token buckets + concurrencia AIMD + carriles de prioridad (seguro entre hilos)."""
+
+    def __init__(self, cuotas, reloj=time.monotonic):
+        """
+        Args:
+            cuotas: {api: (unidades_por_segundo, rafaga, concurrencia_max)}.
+                Las APIs que no estan pasan sin control.
+            reloj: funcion que retorna segundos (monotonicos); reemplazable en pruebas.
+        """
+        self._reloj = reloj
+        self._apis = {api: _EstadoApi(*valores, reloj()) for api, valores in cuotas.items()}
+        self._cond = threading.Condition()
+        self._orden = itertools.count()
+
+    def ejecutar(self, method_id, funcion, unidades=None):
+        """Ejecuta funcion() cuando hay cuota y concurrencia disponibles para la API del metodo."""
+        api, costo_metodo = costo(method_id)
+        estado = self._apis.get(api)
+        if estado is None:
+            return funcion()
+        self._adquirir(estado, costo_metodo if unidades is None else unidades)
+        limitada = False
+        try:
+            return funcion()
+        except HttpError as e:
+            limitada = es_limite_de_cuota(e)
+            raise
+        finally:
+            self._liberar(estado, limitada)
+
+    def _adquirir(self, estado, unidades):
+        prioridad = CARRILES.get(_carril.get(), CARRILES["normal"])
+        turno = (prioridad, next(self._orden))
+        inicio = self._reloj()
+        # Un pedido mayor que la rafaga espera a tener el bucket lleno (y lo deja en negativo)
+        necesario = min(unidades, estado.capacidad)
+        with self._cond:
+            heapq.heappush(estado.espera, turno)
+            while True:
+                espera = None
+                if estado.espera[0] == turno and estado.en_curso < max(1, int(estado.limite)):
+                    ahora = self._reloj()
+                    estado.recargar(ahora)
+                    if estado.tokens >= necesario:
+                        heapq.heappop(estado.espera)
+                        estado.tokens -= unidades
+                        estado.en_curso += 1
+                        estado.peticiones += 1
+                        estado.segundos_espera += ahora - inicio
+                        self._cond.notify_all()
+                        return
+                    espera = (necesario - estado.tokens) / estado.tasa
+                self._cond.wait(espera)
+
+    def registrar_limite(self, method_id):
+        """
+        Registra un 429 / 403 rateLimitExceeded que no paso por ejecutar()
+        (p.ej. una parte de un batch: el batch en si respondio 200).
+        """
+        estado = self._apis.get(costo(method_id)[0])
+        if estado is None:
+            return
+        with self._cond:
+            self._limitar(estado)
+            self._cond.notify_all()
+
+    def _limitar(self, estado):
+        """Decremento multiplicativo; el bucket se vacia para frenar de inmediato (llamar con lock)."""
+        estado.limitadas += 1
+        estado.limite = max(1.0, estado.limite / 2)
+        estado.limite_minimo = min(estado.limite_minimo, int(estado.limite))
+        estado.tokens = min(estado.tokens, 0.0)
+
+    def _liberar(self, estado, limitada):
+        with self._cond:
+            estado.en_curso -= 1
+            if limitada:
+                self._limitar(estado)
+            else:
+                # Incremento aditivo: +1 por cada "ventana" de limite peticiones correctas
+                estado.limite = min(float(estado.concurrencia_max), estado.limite + 1.0 / estado.limite)
+            self._cond.notify_all()
+
+    def resumen(self):
+        """Lineas de texto por API (solo las que se usaron)."""
+        lineas = []
+        with self._cond:
+            for api, e in self._apis.items():
+                if not e.peticiones:
+                    continue
+                lineas.append(
+                    f"{api}: {e.peticiones} peticiones, {e.limitadas} limitadas (429/403), "
+                    f"{e.segundos_espera:.1f}s de espera, concurrencia {int(e.limite)}/{e.concurrencia_max} "
+                    f"(minima {e.limite_minimo})"
+                )
+        return lineas
+
+
+control = ControlCuota(CUOTAS_API)
+
+
+class PeticionConCuota(HttpRequest):
+    """
+    HttpRequest que pasa por el ControlCuota del proceso antes de ejecutarse,
+    con reintentos (si es idempotente) y duplicado por latencia (descargas).
+    """
+
+    def execute(self, http=None, num_retries=0):
+        padre = super().execute
+
+        def _intento():
+            return control.ejecutar(self.methodId, lambda: padre(http=http, num_retries=num_retries))
+
+        idempotente = self.method == "GET" and self.methodId not in NO_REINTENTAR
+        # Duplicar solo con el transporte compartido (httplib2.Http no es thread-safe)
+        if (idempotente and self.methodId in METODOS_CUBIERTOS
+                and isinstance(http or self.http, HttpCompartido)):
+            clave = self.methodId + (":media" if "alt=media" in self.uri else "")
+            return politica.ejecutar(lambda: cobertura.ejecutar(clave, _intento), idempotente)
+        return politica.ejecutar(_intento, idempotente)
+
+
+def ejecutar_batch(batch, peticiones):
+    """
+    Ejecuta un BatchHttpRequest cobrando la suma de las peticiones que contiene
+    (el batch no pasa por PeticionConCuota.execute). Solo lleva GETs: se puede reintentar.
+    """
+    if not peticiones:
+        return batch.execute()
+    unidades = sum(costo(p.methodId)[1] for p in peticiones)
+    return politica.ejecutar(
+        lambda: control.ejecutar(peticiones[0].methodId, batch.execute, unidades=unidades)
+    )
@@ -18,13 +18,34 @@ import os
 import re
 import io
 import base64
+import hashlib
+import signal
 import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, CancelledError, wait
+from concurrent.futures.process import BrokenProcessPool
 from openpyxl import load_workbook
 
 from config import TEMP_DIR
-
-
-def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mensaje_id, cuerpo_fallback="", asunto="", thread_id=""):
+from plazo import plazo
+from indice_carpetas import listar_carpeta, IndiceNombres
+from hoja_vs import (
+    analizar_hoja_vs, grilla_desde_openpyxl, grilla_desde_values, grilla_desde_csv, grilla_desde_bloques,
+    ubicar_secciones, LayoutsVS, MAX_FILAS,
+)
+
+# Pestañas candidatas que se piden en el batchGet de un Google Sheet
+MAX_PESTANAS_SHEET = 3
+# Columnas que se leen de un Google Sheet: hasta AZ, como la lectura original
+# (los comparativos anchos tienen proveedores en AY:AZ; hoja_vs.MAX_COLUMNAS llega a AX)
+COLUMNAS_SHEET = 52
+# Pestañas cuyo TOTAL (CON IGV) queda despues de la fila MAX_FILAS se completan
+# por partes (ver _grilla_por_partes): filas previas a TOTAL (CON IGV) que se leen
+FILAS_ANTES_TOTAL = 15
+
+
+def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mensaje_id, cuerpo_fallback="", asunto="", thread_id="", almacen=None, hilos=None):
     """
     Extrae Monto CC y PPTO META HG de un comparativo.
     1. Obtiene el mensaje completo (para adjuntos Y cuerpo completo)
@@ -36,6 +57,8 @@ def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mens
     Args:
         asunto: Asunto del correo, usado para matchear archivos en carpetas de Drive
         thread_id: ID del thread para buscar links en todas las respuestas
+        almacen: AlmacenMensajes opcional; si ya tiene el mensaje no se descarga de nuevo
+        hilos: RepositorioHilos opcional, compartido con agente_seguimiento
     """
     resultado = {
         "monto_cc": "No especificado",
@@ -43,30 +66,27 @@ def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mens
         "expediente": "No especificado",
     }
 
-    # Obtener mensaje completo UNA sola vez
-    try:
-        msg = gmail_service.users().messages().get(
-            userId="me", id=mensaje_id, format="full"
-        ).execute()
-    except Exception as e:
-        print(f"    [WARN] Error obteniendo mensaje: {e}")
-        return resultado
-
-    payload = msg.get("payload", {})
+    # Obtener mensaje completo UNA sola vez (o reutilizar el del almacen local)
+    contenido = almacen.obtener(mensaje_id) if almacen else None
+    if contenido is None:
+        try:
+            msg = gmail_service.users().messages().get(
+                userId="me", id=mensaje_id, format="full"
+            ).execute()
+        except Exception as e:
+            print(f"    [WARN] Error obteniendo mensaje: {e}")
+            return resultado
+        contenido = extraer_contenido_mensaje(msg.get("payload", {}))
 
     # 1. Intentar desde adjuntos Excel del mensaje original
-    adjuntos = _buscar_adjuntos_recursivo(payload)
+    adjuntos = contenido["adjuntos"]
     for adj in adjuntos:
         filename = adj["filename"]
         if not any(filename.lower().endswith(ext) for ext in [".xlsx", ".xls", ".xlsm"]):
             continue
 
         try:
-            attachment = gmail_service.users().messages().attachments().get(
-                userId="me", messageId=mensaje_id, id=adj["attachmentId"]
-            ).execute()
-            file_data = base64.urlsafe_b64decode(attachment["data"])
-            datos = _procesar_excel(file_data, filename)
+            datos = _leer_adjunto_excel(gmail_service, mensaje_id, adj)
             if datos:
                 if datos.get("monto_cc") != "No especificado":
                     resultado["monto_cc"] = datos["monto_cc"]
@@ -85,9 +105,12 @@ def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mens
 
     if thread_id:
         try:
-            thread = gmail_service.users().threads().get(
-                userId="me", id=thread_id, format="full"
-            ).execute()
+            if hilos:
+                thread = hilos.obtener(gmail_service, thread_id)
+            else:
+                thread = gmail_service.users().threads().get(
+                    userId="me", id=thread_id, format="full"
+                ).execute()
             for thread_msg in thread.get("messages", []):
                 thread_payload = thread_msg.get("payload", {})
                 # Extraer texto y HTML de cada mensaje del hilo
@@ -96,18 +119,18 @@ def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mens
                 texto_completo_thread += (txt or "") + " " + (html or "") + " "
 
                 # Tambien buscar adjuntos Excel en otros mensajes del hilo
+                # (opcional: no se empieza si queda poco plazo)
                 if resultado["ppto_meta_hg"] == "No especificado":
+                    if plazo.en_reserva():
+                        plazo.omitir("adjuntos del hilo")
+                        continue
                     thread_adjuntos = _buscar_adjuntos_recursivo(thread_payload)
                     for adj in thread_adjuntos:
                         fname = adj["filename"]
                         if not any(fname.lower().endswith(ext) for ext in [".xlsx", ".xls", ".xlsm"]):
                             continue
                         try:
-                            att = gmail_service.users().messages().attachments().get(
-                                userId="me", messageId=thread_msg["id"], id=adj["attachmentId"]
-                            ).execute()
-                            fdata = base64.urlsafe_b64decode(att["data"])
-                            datos = _procesar_excel(fdata, fname)
+                            datos = _leer_adjunto_excel(gmail_service, thread_msg["id"], adj)
                             if datos and datos.get("ppto_meta_hg") != "No especificado":
                                 resultado["ppto_meta_hg"] = datos["ppto_meta_hg"]
                                 if resultado["monto_cc"] == "No especificado" and datos.get("monto_cc") != "No especificado":
@@ -122,13 +145,17 @@ def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mens
 
     # Fallback: usar cuerpo del mensaje original si no hay thread
     if not texto_completo_thread:
-        cuerpo_texto = _extraer_texto_de_payload(payload)
-        cuerpo_html = _extraer_html_de_payload(payload)
+        cuerpo_texto = contenido["texto"]
+        cuerpo_html = contenido["html"]
         texto_completo_thread = (cuerpo_texto or "") + " " + (cuerpo_html or "") + " " + (cuerpo_fallback or "")
 
     # Buscar links de Drive en todo el texto recopilado
     drive_links = _extraer_drive_links(texto_completo_thread)
     for link in drive_links:
+        # Las carpetas se recorren archivo por archivo: es lo primero que se omite sin plazo
+        if link["type"] == "folder" and plazo.en_reserva():
+            plazo.omitir("carpetas de Drive")
+            continue
         try:
             datos_drive = _leer_desde_drive(drive_service, sheets_service, link, asunto=asunto)
             if datos_drive:
@@ -146,6 +173,18 @@ def extraer_datos_comparativo(gmail_service, drive_service, sheets_service, mens
     return resultado
 
 
+def extraer_contenido_mensaje(payload):
+    """
+    Extrae del payload de un mensaje lo que necesita la extraccion de datos:
+    manifiesto de adjuntos, texto plano y HTML completos.
+    """
+    return {
+        "adjuntos": _buscar_adjuntos_recursivo(payload),
+        "texto": _extraer_texto_de_payload(payload),
+        "html": _extraer_html_de_payload(payload),
+    }
+
+
 # ============================================================================
 # BUSQUEDA DE ADJUNTOS (recursivo para multipart anidado)
 # ============================================================================
@@ -163,6 +202,7 @@ def _buscar_adjuntos_recursivo(payload, adjuntos=None):
             "filename": filename,
             "attachmentId": attachment_id,
             "mimeType": payload.get("mimeType", ""),
+            "size": payload.get("body", {}).get("size", 0),
         })
 
     for part in payload.get("parts", []):
@@ -202,18 +242,255 @@ def _extraer_html_de_payload(payload):
 
 
 # ============================================================================
-# PROCESAMIENTO DE EXCEL (openpyxl)
+# PARSEO DE EXCEL EN PROCESOS SEPARADOS
 # ============================================================================
 
+class _PoolExcel:
+    """
+    ProcessPoolExecutor para parsear Excel fuera del proceso principal.
+    openpyxl es CPU y retiene el GIL: en el mismo proceso frena las descargas
+    de Gmail/Drive de los otros workers.
+
+    Los bytes del archivo se pasan por un archivo temporal en TEMP_DIR (no se
+    copian por pickle). El proceso que toma un archivo deja una marca
+    "<temporal>.inicio" con su pid: el timeout cuenta desde ahi (no desde que
+    el archivo entro a la cola). Si un archivo supera el timeout se termina
+    ese proceso y se crea un pool nuevo; las tareas que estaban en curso en el
+    pool roto se reintentan una vez.
+
+    Los procesos se crean con forkserver (spawn si no existe, p.ej. Windows):
+    el pool se crea desde hilos de trabajo con descargas en curso, y un fork
+    de ese proceso puede heredar locks tomados y quedar bloqueado.
+    """
+
+    def __init__(self, procesos, timeout):
+        self.procesos = procesos
+        self.timeout = timeout
+        metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._contexto = multiprocessing.get_context(metodo)
+        self._lock = threading.Lock()
+        self._pool = None
+        self.procesados = 0
+        self.timeouts = 0
+
+    def _obtener_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.procesos, mp_context=self._contexto)
+            return self._pool
+
+    def _reiniciar(self, pool):
+        """Descarta el pool (si sigue siendo el actual); el siguiente archivo crea uno nuevo."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _esperar(self, futuro, marca):
+        """Resultado del archivo, con el timeout contado desde que un proceso lo empezo."""
+        while not os.path.exists(marca):
+            listas, _ = wait([futuro], timeout=0.2)
+            if listas:
+                return futuro.result()
+        return futuro.result(timeout=plazo.timeout(self.timeout))
+
+    def _terminar(self, marca):
+        """Termina el proceso que quedo colgado con el archivo (pid en la marca de inicio)."""
+        try:
+            with open(marca, "r", encoding="utf-8") as f:
+                pid = int(f.read())
+            os.kill(pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+        except (OSError, ValueError):
+            pass
+
+    def procesar(self, file_data, filename):
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        fd, ruta = tempfile.mkstemp(suffix=os.path.splitext(filename)[1], dir=TEMP_DIR)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(file_data)
+            marca = ruta + ".inicio"
+            for _ in range(2):
+                pool = self._obtener_pool()
+                try:
+                    conocidos = _layouts_vs.exportar() if _layouts_vs else None
+                    futuro = pool.submit(_procesar_excel_desde_archivo, ruta, filename, conocidos)
+                    resultado, cambios = self._esperar(futuro, marca)
+                    if cambios and _layouts_vs:
+                        _layouts_vs.fusionar(cambios)
+                    self.procesados += 1
+                    return resultado
+                except TimeoutError:
+                    self.timeouts += 1
+                    print(f"    [WARN] Excel '{filename}' supero {plazo.timeout(self.timeout):.0f}s, se descarta")
+                    # Los demas archivos en curso del pool fallan con BrokenProcessPool y se reintentan
+                    self._terminar(marca)
+                    self._reiniciar(pool)
+                    return None
+                except (BrokenProcessPool, CancelledError, RuntimeError):
+                    # El pool se reinicio por el timeout de otro archivo (RuntimeError:
+                    # se alcanzo a pedir el pool justo antes de que lo cerraran)
+                    self._reiniciar(pool)
+                    try:
+                        os.remove(marca)
+                    except OSError:
+                        pass
+            return None
+        finally:
+            for archivo in (ruta, ruta + ".inicio", ruta + ".inicio.tmp"):
+                try:
+                    os.remove(archivo)
+                except OSError:
+                    pass
+
+    def cerrar(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+_pool_excel = None
+
+
+def configurar_procesos_excel(procesos, timeout):
+    """
+    Activa el parseo de Excel en un pool de procesos (procesos <= 0 lo desactiva).
+    Llamar cerrar_procesos_excel() al terminar.
+    """
+    global _pool_excel
+    cerrar_procesos_excel()
+    if procesos > 0:
+        _pool_excel = _PoolExcel(procesos, timeout)
+
+
+def cerrar_procesos_excel():
+    global _pool_excel
+    if _pool_excel:
+        _pool_excel.cerrar()
+        if _pool_excel.procesados or _pool_excel.timeouts:
+            print(f"[EXCEL] {_pool_excel.procesados} archivos parseados en procesos, "
+                  f"{_pool_excel.timeouts} por timeout")
+        _pool_excel = None
+
+
+def _procesar_excel_desde_archivo(ruta, filename, conocidos=None):
+    """
+    Se ejecuta en un proceso del pool. Recibe una copia de los layouts VS conocidos
+    y retorna (resultado, cambios) para fusionarlos en el proceso principal.
+    """
+    # Marca de inicio para _PoolExcel: el timeout corre desde aqui y este es el pid a terminar
+    with open(ruta + ".inicio.tmp", "w", encoding="utf-8") as f:
+        f.write(str(os.getpid()))
+    os.replace(ruta + ".inicio.tmp", ruta + ".inicio")
+    layouts = LayoutsVS(conocidos) if conocidos is not None else None
+    with open(ruta, "rb") as f:
+        resultado = _leer_excel(f.read(), filename, layouts)
+    return resultado, (layouts.cambios() if layouts else None)
+
+
 def _procesar_excel(file_data, filename="archivo.xlsx"):
     """
     Procesa un archivo Excel de comparativo.
+    Con configurar_procesos_excel() activo el parseo corre en un proceso aparte
+    y retorna None si el archivo supera el timeout.
+    """
+    if _pool_excel is None:
+        return _leer_excel(file_data, filename, _layouts_vs)
+    # None si el archivo se descarto por timeout
+    return _pool_excel.procesar(file_data, filename)
+
+
+# ============================================================================
+# RESULTADOS DE EXCEL YA PROCESADOS (almacen local por hash de contenido)
+# ============================================================================
+
+_almacen_excel = None
+_layouts_vs = None
+_carpetas_drive = None
+
+
+def configurar_almacen_excel(almacen, layouts=None):
+    """
+    Args:
+        almacen: AlmacenExcel para reutilizar resultados de Excel ya procesados.
+        layouts: LayoutsVS con las plantillas de hoja VS conocidas (Excel y Sheets).
+    None desactiva cada uno.
+    """
+    global _almacen_excel, _layouts_vs
+    _almacen_excel = almacen
+    _layouts_vs = layouts
+
+
+def configurar_carpetas_drive(indice):
+    """
+    Args:
+        indice: IndiceCarpetas para reutilizar listados de carpetas de Drive
+            (None: cada carpeta se lista cada vez que se enlaza).
+    """
+    global _carpetas_drive
+    _carpetas_drive = indice
+
+
+def _procesar_excel_con_cache(descargar, filename, clave_origen=None):
+    """
+    Procesa un Excel reutilizando resultados del almacen:
+    1. clave_origen (adjunto de Gmail / version de un archivo de Drive): evita la descarga
+    2. hash del contenido: evita el parseo (mismo archivo en otro mensaje o carpeta)
+
+    Args:
+        descargar: funcion sin argumentos que retorna los bytes del archivo.
+    """
+    almacen = _almacen_excel
+    if almacen and clave_origen:
+        resultado = almacen.obtener(clave_origen)
+        if resultado is not None:
+            return resultado
+
+    file_data = descargar()
+    if not almacen:
+        return _procesar_excel(file_data, filename)
+
+    clave_hash = "sha256:" + hashlib.sha256(file_data).hexdigest()
+    resultado = almacen.obtener(clave_hash)
+    claves = [clave_origen] if clave_origen else []
+    if resultado is None:
+        resultado = _procesar_excel(file_data, filename)
+        if resultado is None:
+            return None  # timeout: no se guarda
+        claves.append(clave_hash)
+    if claves:
+        almacen.guardar(claves, resultado)
+    return resultado
+
+
+def _leer_adjunto_excel(gmail_service, message_id, adj):
+    """Descarga (si hace falta) y procesa un adjunto Excel de Gmail."""
+    def _descargar():
+        attachment = gmail_service.users().messages().attachments().get(
+            userId="me", messageId=message_id, id=adj["attachmentId"]
+        ).execute()
+        return base64.urlsafe_b64decode(attachment["data"])
+
+    # Los mensajes de Gmail no cambian: mensaje + nombre + tamano identifican el adjunto
+    clave_origen = None
+    if adj.get("size"):
+        clave_origen = f"gmail:{message_id}:{adj['filename']}:{adj['size']}"
+    return _procesar_excel_con_cache(_descargar, adj["filename"], clave_origen)
+
+
+def _leer_excel(file_data, filename="archivo.xlsx", layouts=None):
+    """
+    Lee un archivo Excel de comparativo (en el proceso actual).
     Prioriza la pestaña "VS" para PPTO META HG, EXPEDIENTE y Monto CC.
     """
     resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
 
     try:
-        wb = load_workbook(io.BytesIO(file_data), data_only=True)
+        # read_only: solo lee workbook.xml al abrir; cada hoja se parsea en streaming
+        # recien cuando se recorre (las pestañas de proveedores nunca se cargan)
+        wb = load_workbook(io.BytesIO(file_data), read_only=True, data_only=True)
         sheet_names_lower = [s.lower() for s in wb.sheetnames]
 
         # Buscar pestaña "VS" (prioridad exacta)
@@ -231,7 +508,7 @@ def _procesar_excel(file_data, filename="archivo.xlsx"):
 
         if vs_idx is not None:
             ws = wb.worksheets[vs_idx]
-            datos_vs = _leer_hoja_vs(ws)
+            datos_vs = _leer_hoja_vs(ws, layouts)
             if datos_vs.get("ppto_meta_hg") != "No especificado":
                 resultado["ppto_meta_hg"] = datos_vs["ppto_meta_hg"]
             if datos_vs.get("monto_cc") != "No especificado":
@@ -244,7 +521,7 @@ def _procesar_excel(file_data, filename="archivo.xlsx"):
             for i, name in enumerate(sheet_names_lower):
                 if any(kw in name for kw in ["comparativo", "resumen", "cuadro"]):
                     ws = wb.worksheets[i]
-                    datos_hoja = _leer_hoja_vs(ws)
+                    datos_hoja = _leer_hoja_vs(ws, layouts)
                     if datos_hoja.get("ppto_meta_hg") != "No especificado":
                         resultado["ppto_meta_hg"] = datos_hoja["ppto_meta_hg"]
                     if resultado["monto_cc"] == "No especificado" and datos_hoja.get("monto_cc") != "No especificado":
@@ -262,179 +539,16 @@ def _procesar_excel(file_data, filename="archivo.xlsx"):
     return resultado
 
 
-def _leer_hoja_vs(ws):
+def _leer_hoja_vs(ws, layouts=None):
     """
-    Lee la hoja VS de un comparativo con formato de secciones.
-
-    Estructura esperada:
-    - Fila ~6: Headers de seccion: EXPEDIENTE | PROVEEDOR1 | PROVEEDOR2 | PPTO META HG
-    - Fila ~7: Sub-headers: V.U. | SUB TOTAL | OBS | ... | V.U. | SUB TOTAL | ...
-    - Filas 8+: datos
-    - Filas finales: COSTO DIRECTO (SIN IGV), SUB TOTAL, IGV, TOTAL (CON IGV)
-
-    Extrae:
-    - expediente: TOTAL (CON IGV) de la seccion EXPEDIENTE
-    - ppto_meta_hg: TOTAL (CON IGV) de la seccion PPTO META HG
-    - monto_cc: TOTAL (CON IGV) de un PROVEEDOR (columnas entre EXPEDIENTE y PPTO META HG)
+    Lee la hoja VS (openpyxl) de un comparativo con formato de secciones.
+    La busqueda de PPTO META HG / EXPEDIENTE / Monto CC esta en hoja_vs.
     """
-    resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
-
     try:
-        max_row = min(ws.max_row or 200, 200)
-        max_col = min(ws.max_column or 50, 50)
-
-        # ================================================================
-        # PASO 1: Encontrar headers de seccion (PPTO META HG y EXPEDIENTE)
-        # ================================================================
-        ppto_col_start = None
-        ppto_row = None
-        exp_col_start = None
-        exp_row = None
-
-        for row_idx in range(1, min(20, max_row + 1)):
-            for col_idx in range(1, max_col + 1):
-                cell = ws.cell(row=row_idx, column=col_idx)
-                if cell.value and isinstance(cell.value, str):
-                    val = cell.value.strip().lower()
-                    if ("ppto" in val and "meta" in val) or "meta hg" in val:
-                        ppto_col_start = col_idx
-                        ppto_row = row_idx
-                    elif val == "expediente" or "expediente" in val:
-                        exp_col_start = col_idx
-                        exp_row = row_idx
-
-        if not ppto_col_start:
-            return resultado
-
-        # ================================================================
-        # PASO 2: Encontrar columnas "SUB TOTAL" bajo cada seccion
-        # ================================================================
-        header_row = ppto_row  # Fila de headers de seccion
-
-        def _encontrar_subtotal_col(section_col_start, section_col_end):
-            """Busca columna SUB TOTAL dentro de una seccion."""
-            for r in range(header_row, min(header_row + 5, max_row + 1)):
-                for c in range(section_col_start, min(section_col_end, max_col + 1)):
-                    cell = ws.cell(row=r, column=c)
-                    if cell.value and isinstance(cell.value, str):
-                        v = cell.value.strip().lower()
-                        if "sub total" in v or "subtotal" in v or v == "sub-total":
-                            return c
-            # Fallback: buscar columna numerica
-            for c in range(section_col_start, min(section_col_end, max_col + 1)):
-                for r in range(header_row + 1, min(header_row + 10, max_row + 1)):
-                    val = ws.cell(row=r, column=c).value
-                    if val and isinstance(val, (int, float)) and val >= 100:
-                        return c
-            return None
-
-        ppto_subtotal_col = _encontrar_subtotal_col(ppto_col_start, ppto_col_start + 12)
-
-        exp_subtotal_col = None
-        if exp_col_start:
-            # Limite de columnas de EXPEDIENTE: hasta la siguiente seccion o +12
-            exp_end = ppto_col_start if ppto_col_start > exp_col_start else exp_col_start + 12
-            exp_subtotal_col = _encontrar_subtotal_col(exp_col_start, exp_end)
-
-        # ================================================================
-        # PASO 3: Buscar TOTAL (CON IGV) para cada seccion
-        # ================================================================
-        def _extraer_total_igv(subtotal_col, section_col_start, section_end):
-            """Busca el valor TOTAL (CON IGV) en la columna SUB TOTAL de una seccion."""
-            if not subtotal_col:
-                return None
-            # Buscar desde abajo hacia arriba
-            for row_idx in range(max_row, header_row, -1):
-                fila_tiene_total_igv = False
-                for check_col in range(1, max_col + 1):
-                    cell_val = ws.cell(row=row_idx, column=check_col).value
-                    if cell_val and isinstance(cell_val, str):
-                        txt = cell_val.strip().lower()
-                        if "total" in txt and "igv" in txt:
-                            fila_tiene_total_igv = True
-                            break
-
-                if fila_tiene_total_igv:
-                    val = ws.cell(row=row_idx, column=subtotal_col).value
-                    if val and isinstance(val, (int, float)) and val >= 100:
-                        return val
-                    # Buscar en columnas cercanas de la seccion
-                    for try_col in range(section_col_start, min(section_end, max_col + 1)):
-                        val = ws.cell(row=row_idx, column=try_col).value
-                        if val and isinstance(val, (int, float)) and val >= 100:
-                            return val
-                    break
-
-            # Fallback: buscar SUB TOTAL o COSTO DIRECTO
-            for row_idx in range(max_row, header_row, -1):
-                for check_col in range(1, max_col + 1):
-                    cell_val = ws.cell(row=row_idx, column=check_col).value
-                    if cell_val and isinstance(cell_val, str):
-                        txt = cell_val.strip().lower()
-                        if txt in ["sub total", "subtotal", "costo directo", "costo directo (sin igv)"]:
-                            val = ws.cell(row=row_idx, column=subtotal_col).value
-                            if val and isinstance(val, (int, float)) and val >= 100:
-                                return val
-            # Ultimo fallback: ultimo valor grande
-            last_val = None
-            for row_idx in range(header_row + 2, max_row + 1):
-                val = ws.cell(row=row_idx, column=subtotal_col).value
-                if val and isinstance(val, (int, float)) and val >= 100:
-                    last_val = val
-            return last_val
-
-        # PPTO META HG
-        ppto_val = _extraer_total_igv(ppto_subtotal_col, ppto_col_start, ppto_col_start + 12)
-        if ppto_val:
-            resultado["ppto_meta_hg"] = f"S/ {ppto_val:,.2f}"
-
-        # EXPEDIENTE
-        if exp_subtotal_col:
-            exp_end = ppto_col_start if ppto_col_start > exp_col_start else exp_col_start + 12
-            exp_val = _extraer_total_igv(exp_subtotal_col, exp_col_start, exp_end)
-            if exp_val:
-                resultado["expediente"] = f"S/ {exp_val:,.2f}"
-
-        # ================================================================
-        # PASO 4: Buscar Monto CC (ganador/proveedor)
-        # Columnas ENTRE EXPEDIENTE y PPTO META HG (donde estan los proveedores)
-        # ================================================================
-        if resultado["monto_cc"] == "No especificado":
-            # Determinar rango de columnas de proveedores (excluir EXPEDIENTE y PPTO META HG)
-            if exp_col_start and exp_subtotal_col:
-                # Proveedores empiezan despues de la ultima columna de EXPEDIENTE
-                prov_col_start = exp_subtotal_col + 1
-            elif exp_col_start:
-                prov_col_start = exp_col_start + 5  # estimacion
-            else:
-                prov_col_start = 1
-
-            prov_col_end = ppto_col_start  # Proveedores terminan antes de PPTO META HG
-
-            if prov_col_start < prov_col_end:
-                for row_idx in range(max_row, 0, -1):
-                    fila_tiene_total_igv = False
-                    for check_col in range(1, max_col + 1):
-                        cell_val = ws.cell(row=row_idx, column=check_col).value
-                        if cell_val and isinstance(cell_val, str):
-                            txt = cell_val.strip().lower()
-                            if "total" in txt and "igv" in txt:
-                                fila_tiene_total_igv = True
-                                break
-
-                    if fila_tiene_total_igv:
-                        # Buscar valor en columnas de PROVEEDORES (entre EXPEDIENTE y PPTO)
-                        for col_idx in range(prov_col_start, prov_col_end):
-                            val = ws.cell(row=row_idx, column=col_idx).value
-                            if val and isinstance(val, (int, float)) and val >= 100:
-                                resultado["monto_cc"] = f"S/ {val:,.2f}"
-                                break
-                        break
-
+        return analizar_hoja_vs(grilla_desde_openpyxl(ws), layouts)
     except Exception as e:
         print(f"    [WARN] Error leyendo hoja VS: {e}")
-
-    return resultado
+        return {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
 
 
 # ============================================================================
@@ -488,7 +602,7 @@ def _leer_desde_drive(drive_service, sheets_service, link_info, asunto=""):
         if link_info["type"] == "folder":
             resultado = _leer_carpeta_drive(drive_service, sheets_service, link_info["id"], asunto=asunto)
         elif link_info["type"] == "sheet":
-            resultado = _leer_google_sheet(sheets_service, link_info["id"])
+            resultado = _leer_google_sheet(sheets_service, link_info["id"], drive_service)
         elif link_info["type"] == "file":
             resultado = _leer_archivo_drive(drive_service, sheets_service, link_info["id"])
     except Exception as e:
@@ -557,103 +671,42 @@ def _leer_carpeta_drive(drive_service, sheets_service, folder_id, asunto=""):
     resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
 
     try:
-        response = drive_service.files().list(
-            q=f"'{folder_id}' in parents and trashed = false",
-            fields="files(id, name, mimeType)",
-            pageSize=50,
-            supportsAllDrives=True,
-            includeItemsFromAllDrives=True,
-        ).execute()
-
-        files = response.get("files", [])
-
-        if not files:
-            return resultado
-
-        # Filtrar solo archivos de hojas de calculo
-        spreadsheet_files = []
-        for f in files:
-            mime = f.get("mimeType", "")
-            name_lower = f["name"].lower()
-            es_hoja = (
-                mime == "application/vnd.google-apps.spreadsheet"
-                or any(mime.endswith(ext) for ext in ["spreadsheetml.sheet", "ms-excel", "openxmlformats"])
-                or name_lower.endswith((".xlsx", ".xls", ".xlsm"))
-            )
-            if es_hoja:
-                spreadsheet_files.append(f)
+        # Indice invertido de nombres: se arma una vez por listado de la carpeta
+        if _carpetas_drive is not None:
+            indice = _carpetas_drive.indice_nombres(drive_service, folder_id)
+        else:
+            indice = IndiceNombres(listar_carpeta(drive_service, folder_id))
 
-        if not spreadsheet_files:
+        if not indice.archivos:
             return resultado
 
         # Extraer palabras clave del asunto para matchear
         palabras_clave = _extraer_palabras_clave_asunto(asunto)
 
-        # Calcular cuantos archivos contiene cada keyword (para pesar por discriminacion)
-        keyword_frequency = {}
-        for palabra in palabras_clave:
-            count = sum(1 for f in spreadsheet_files if palabra in f["name"].lower())
-            keyword_frequency[palabra] = max(count, 1)
-
-        # Construir bigrams (pares de palabras consecutivas) para matching de frases
-        bigrams = []
-        for i in range(len(palabras_clave) - 1):
-            bigrams.append(f"{palabras_clave[i]} {palabras_clave[i+1]}")
-            # Tambien sin espacio (para nombres como "UPS-TRANSFORMADOR")
-            bigrams.append(f"{palabras_clave[i]}-{palabras_clave[i+1]}")
-            bigrams.append(f"{palabras_clave[i]}{palabras_clave[i+1]}")
-
-        # Calcular score de match para cada archivo (keywords raras valen mas)
-        archivos_con_score = []
-        for f in spreadsheet_files:
-            score = 0
-            name_lower = f["name"].lower()
-            # Score por keywords individuales
-            for palabra in palabras_clave:
-                if palabra in name_lower:
-                    freq = keyword_frequency.get(palabra, 1)
-                    peso = 3.0 / freq
-                    score += peso
-                    if len(palabra) >= 6:
-                        score += 1.0 / freq
-            # Bonus por bigrams (frases de 2 palabras consecutivas)
-            for bigram in bigrams:
-                if bigram in name_lower:
-                    score += 5.0  # bonus fuerte por frase exacta
-            # Bonus menor si tiene "comparativo" o "cuadro" en el nombre
-            if "comparativo" in name_lower or "cuadro" in name_lower:
-                score += 0.5
-            # Tiebreaker: ratio de keywords matcheadas vs palabras en filename
-            # Archivos con nombre mas corto/especifico ganan empates
-            name_words = re.findall(r"[a-záéíóúñü]{3,}", name_lower)
-            name_sig_words = [w for w in name_words if w not in {"rcos", "cuadro", "comparativo"}]
-            matched_count = sum(1 for p in palabras_clave if p in name_lower)
-            if name_sig_words and matched_count > 0:
-                ratio = matched_count / len(name_sig_words)
-                score += ratio * 2.0  # Bonus proporcional al ratio
-            archivos_con_score.append((score, f))
-
-        # Ordenar por score descendente (mejor match primero)
-        archivos_con_score.sort(key=lambda x: x[0], reverse=True)
+        # Mejores candidatos por score (keywords raras valen mas, bigrams, etc.)
+        archivos_con_score = indice.mejores(palabras_clave, 3)
 
         # Log para debug
         if palabras_clave:
             top = archivos_con_score[0] if archivos_con_score else None
             if top and top[0] > 0:
-                print(f"\n      [DRIVE] Carpeta con {len(files)} archivos, {len(spreadsheet_files)} hojas")
+                print(f"\n      [DRIVE] Carpeta con {indice.total_archivos} archivos, {len(indice.archivos)} hojas")
                 print(f"      [DRIVE] Palabras clave: {palabras_clave[:5]}")
                 print(f"      [DRIVE] Mejor match: '{top[1]['name']}' (score: {top[0]})")
 
         # Procesar archivos en orden de relevancia (max 3 para no tardar mucho)
-        for score, f in archivos_con_score[:3]:
+        for score, f in archivos_con_score:
             mime = f.get("mimeType", "")
             datos = None
 
             try:
                 if mime == "application/vnd.google-apps.spreadsheet":
-                    datos = _leer_google_sheet(sheets_service, f["id"])
+                    datos = _leer_google_sheet(sheets_service, f["id"], drive_service)
                 else:
-                    datos = _descargar_y_leer_excel(drive_service, f["id"], f["name"])
+                    datos = _descargar_y_leer_excel(
+                        drive_service, f["id"], f["name"],
+                        f.get("md5Checksum", ""), f.get("modifiedTime", ""),
+                    )
             except Exception as e:
                 print(f"      [DRIVE] Error con '{f['name']}': {e}")
                 continue
@@ -679,44 +732,54 @@ def _leer_carpeta_drive(drive_service, sheets_service, folder_id, asunto=""):
 # LECTURA DESDE GOOGLE SHEETS API
 # ============================================================================
 
-def _leer_google_sheet(sheets_service, spreadsheet_id):
-    """Lee un Google Sheet buscando PPTO META HG y EXPEDIENTE en la pestaña VS."""
+def _leer_google_sheet(sheets_service, spreadsheet_id, drive_service=None):
+    """
+    Lee un Google Sheet buscando PPTO META HG y EXPEDIENTE en la pestaña VS.
+    Dos llamadas: titulos y filas de las pestañas (con mascara de campos) y un
+    solo values.batchGet de A1:AZ200 para las pestañas candidatas.
+    Solo si esa ventana llega a la fila 200 sin un TOTAL (CON IGV) y la
+    pestaña tiene mas filas, el resto se lee por partes. rowCount no basta
+    para decidirlo: en un Google Sheet nuevo ya vale 1000.
+    Si la Sheets API falla y hay drive_service, usa la exportacion CSV de Drive
+    (solo trae la primera pestaña).
+    """
     resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
 
     try:
         spreadsheet = sheets_service.spreadsheets().get(
-            spreadsheetId=spreadsheet_id
+            spreadsheetId=spreadsheet_id,
+            fields="sheets.properties(title,gridProperties.rowCount)",
         ).execute()
 
-        sheets = spreadsheet.get("sheets", [])
-
-        # Buscar pestaña "VS" primero (prioridad exacta)
-        target_sheets = []
-        for sheet in sheets:
-            title = sheet["properties"]["title"]
-            title_lower = title.lower().strip()
-            if title_lower == "vs":
-                target_sheets.insert(0, title)
-            elif "vs" in title_lower:
-                target_sheets.insert(1 if target_sheets else 0, title)
-            elif any(kw in title_lower for kw in ["comparativo", "resumen", "cuadro"]):
-                target_sheets.append(title)
-
+        filas_por_titulo = {}
+        for sheet in spreadsheet.get("sheets", []):
+            props = sheet["properties"]
+            filas_por_titulo[props["title"]] = props.get("gridProperties", {}).get("rowCount", 0)
+        target_sheets = _pestanas_candidatas(list(filas_por_titulo))
         if not target_sheets:
-            target_sheets = [s["properties"]["title"] for s in sheets[:3]]
+            return resultado
 
-        for sheet_title in target_sheets:
-            try:
-                # Leer rango amplio (hasta columna AZ fila 100)
-                range_name = f"'{sheet_title}'!A1:AZ100"
-                result = sheets_service.spreadsheets().values().get(
-                    spreadsheetId=spreadsheet_id,
-                    range=range_name,
-                    valueRenderOption="UNFORMATTED_VALUE",
-                ).execute()
+        respuesta = sheets_service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=[_rango_hoja(titulo) for titulo in target_sheets],
+            valueRenderOption="UNFORMATTED_VALUE",
+            fields="valueRanges.values",
+        ).execute()
 
-                values = result.get("values", [])
-                datos = _analizar_hoja_vs_sheets(values)
+        # valueRanges viene en el mismo orden que ranges
+        for titulo, rango in zip(target_sheets, respuesta.get("valueRanges", [])):
+            try:
+                ventana = rango.get("values", [])
+                grilla = grilla_desde_values(ventana)
+                # values omite las filas vacias del final: si vinieron MAX_FILAS, la hoja sigue
+                if (not grilla.filas_total_igv and len(ventana) >= MAX_FILAS
+                        and filas_por_titulo[titulo] > MAX_FILAS):
+                    grilla = _grilla_por_partes(
+                        sheets_service, spreadsheet_id, titulo, ventana, filas_por_titulo[titulo],
+                    )
+                    if grilla is None:
+                        continue
+                datos = analizar_hoja_vs(grilla, _layouts_vs)
 
                 if datos.get("ppto_meta_hg") != "No especificado":
                     resultado["ppto_meta_hg"] = datos["ppto_meta_hg"]
@@ -733,179 +796,120 @@ def _leer_google_sheet(sheets_service, spreadsheet_id):
 
     except Exception as e:
         print(f"    [WARN] Error leyendo Google Sheet: {e}")
+        if drive_service is not None:
+            resultado = _leer_google_sheet_csv(drive_service, spreadsheet_id)
 
     return resultado
 
 
-def _analizar_hoja_vs_sheets(values):
+def _pestanas_candidatas(titulos):
     """
-    Analiza datos de la hoja VS (Google Sheets API - lista de listas).
-    Misma logica que _leer_hoja_vs pero para datos del Sheets API.
+    Pestañas a leer, en orden de prioridad: "VS" exacta, las que contienen "vs",
+    luego comparativo/resumen/cuadro. Sin coincidencias, las primeras.
+    Maximo MAX_PESTANAS_SHEET para que el batchGet tenga tamaño acotado.
     """
-    resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
-
-    if not values:
-        return resultado
-
-    num_rows = len(values)
-    max_cols = max(len(r) for r in values) if values else 0
-
-    # ================================================================
-    # PASO 1: Encontrar headers de seccion (PPTO META HG y EXPEDIENTE)
-    # ================================================================
-    ppto_col_start = None
-    ppto_row = None
-    exp_col_start = None
-    exp_row = None
-
-    for row_idx in range(min(20, num_rows)):
-        row = values[row_idx]
-        for col_idx, cell in enumerate(row):
-            if cell and isinstance(cell, str):
-                val = cell.strip().lower()
-                if ("ppto" in val and "meta" in val) or "meta hg" in val:
-                    ppto_col_start = col_idx
-                    ppto_row = row_idx
-                elif val == "expediente" or "expediente" in val:
-                    exp_col_start = col_idx
-                    exp_row = row_idx
-
-    if ppto_col_start is None:
-        return resultado
-
-    header_row = ppto_row
-
-    # ================================================================
-    # PASO 2: Encontrar columnas "SUB TOTAL" bajo cada seccion
-    # ================================================================
-    def _encontrar_subtotal_col_sheets(section_start, section_end):
-        for r_idx in range(header_row, min(header_row + 5, num_rows)):
-            row = values[r_idx]
-            for c_idx in range(section_start, min(section_end, len(row))):
-                cell = row[c_idx]
-                if cell and isinstance(cell, str):
-                    v = cell.strip().lower()
-                    if "sub total" in v or "subtotal" in v or v == "sub-total":
-                        return c_idx
-        # Fallback numerico
-        for c_idx in range(section_start, min(section_end, max_cols)):
-            for r_idx in range(header_row + 1, min(header_row + 10, num_rows)):
-                row = values[r_idx]
-                if c_idx < len(row):
-                    num = _parsear_numero(row[c_idx])
-                    if num and num >= 100:
-                        return c_idx
+    target_sheets = []
+    for title in titulos:
+        title_lower = title.lower().strip()
+        if title_lower == "vs":
+            target_sheets.insert(0, title)
+        elif "vs" in title_lower:
+            target_sheets.insert(1 if target_sheets else 0, title)
+        elif any(kw in title_lower for kw in ["comparativo", "resumen", "cuadro"]):
+            target_sheets.append(title)
+
+    if not target_sheets:
+        target_sheets = titulos
+    return target_sheets[:MAX_PESTANAS_SHEET]
+
+
+def _grilla_por_partes(sheets_service, spreadsheet_id, titulo, ventana, filas_grilla):
+    """
+    Completa una pestaña cuyo TOTAL (CON IGV) queda despues de la ventana
+    A1:AZ200, leyendo solo las celdas que usa hoja_vs:
+    1. Ventana (ya leida): ubica las columnas de PPTO META HG y EXPEDIENTE.
+    2. Columnas de etiquetas (hasta la primera seccion) desde la fila 201 hasta
+       el final de la grilla: ubica la ultima fila TOTAL (CON IGV). rowCount
+       incluye filas vacias al final, por eso no basta con leer las ultimas filas.
+    3. Filas previas a esa fila (COSTO DIRECTO, SUB TOTAL, IGV) hasta el final,
+       solo hasta la ultima columna de PPTO META HG.
+    Retorna None si la ventana no tiene la seccion PPTO META HG.
+    """
+    _, ppto_col, exp_col = ubicar_secciones(grilla_desde_values(ventana))
+    if not ppto_col:
         return None
-
-    ppto_subtotal_col = _encontrar_subtotal_col_sheets(ppto_col_start, ppto_col_start + 12)
-
-    exp_subtotal_col = None
-    if exp_col_start is not None:
-        exp_end = ppto_col_start if ppto_col_start > exp_col_start else exp_col_start + 12
-        exp_subtotal_col = _encontrar_subtotal_col_sheets(exp_col_start, exp_end)
-
-    # ================================================================
-    # PASO 3: Buscar TOTAL (CON IGV) para cada seccion
-    # ================================================================
-    def _extraer_total_igv_sheets(subtotal_col, section_start, section_end):
-        if subtotal_col is None:
-            return None
-        for row_idx in range(num_rows - 1, header_row, -1):
-            row = values[row_idx]
-            fila_tiene_total_igv = False
-            for cell in row:
-                if cell and isinstance(cell, str):
-                    txt = cell.strip().lower()
-                    if "total" in txt and "igv" in txt:
-                        fila_tiene_total_igv = True
-                        break
-            if fila_tiene_total_igv:
-                if subtotal_col < len(row):
-                    num = _parsear_numero(row[subtotal_col])
-                    if num and num >= 100:
-                        return num
-                for try_col in range(section_start, min(section_end, len(row))):
-                    num = _parsear_numero(row[try_col])
-                    if num and num >= 100:
-                        return num
-                break
-        # Fallback: buscar SUB TOTAL / COSTO DIRECTO
-        for row_idx in range(num_rows - 1, header_row, -1):
-            row = values[row_idx]
-            for cell in row:
-                if cell and isinstance(cell, str):
-                    txt = cell.strip().lower()
-                    if txt in ["sub total", "subtotal", "costo directo", "costo directo (sin igv)"]:
-                        if subtotal_col < len(row):
-                            num = _parsear_numero(row[subtotal_col])
-                            if num and num >= 100:
-                                return num
-        # Ultimo fallback
-        last_val = None
-        for row_idx in range(header_row + 2, num_rows):
-            row = values[row_idx]
-            if subtotal_col < len(row):
-                num = _parsear_numero(row[subtotal_col])
-                if num and num >= 100:
-                    last_val = num
-        return last_val
-
-    # PPTO META HG
-    ppto_val = _extraer_total_igv_sheets(ppto_subtotal_col, ppto_col_start, ppto_col_start + 12)
-    if ppto_val:
-        resultado["ppto_meta_hg"] = f"S/ {ppto_val:,.2f}"
-
-    # EXPEDIENTE
-    if exp_subtotal_col is not None:
-        exp_end = ppto_col_start if ppto_col_start > exp_col_start else exp_col_start + 12
-        exp_val = _extraer_total_igv_sheets(exp_subtotal_col, exp_col_start, exp_end)
-        if exp_val:
-            resultado["expediente"] = f"S/ {exp_val:,.2f}"
-
-    # ================================================================
-    # PASO 4: Buscar Monto CC (proveedor - entre EXPEDIENTE y PPTO META HG)
-    # ================================================================
-    if resultado["monto_cc"] == "No especificado" and ppto_col_start is not None:
-        if exp_col_start is not None and exp_subtotal_col is not None:
-            prov_col_start = exp_subtotal_col + 1
-        elif exp_col_start is not None:
-            prov_col_start = exp_col_start + 5
-        else:
-            prov_col_start = 0
-
-        prov_col_end = ppto_col_start
-
-        if prov_col_start < prov_col_end:
-            for row_idx in range(num_rows - 1, 0, -1):
-                row = values[row_idx]
-                fila_tiene_total_igv = False
-                for cell in row:
-                    if cell and isinstance(cell, str):
-                        txt = cell.strip().lower()
-                        if "total" in txt and "igv" in txt:
-                            fila_tiene_total_igv = True
-                            break
-                if fila_tiene_total_igv:
-                    for col_idx in range(prov_col_start, min(prov_col_end, len(row))):
-                        num = _parsear_numero(row[col_idx])
-                        if num and num >= 100:
-                            resultado["monto_cc"] = f"S/ {num:,.2f}"
-                            break
-                    break
-
-    return resultado
+    col_fin = min(ppto_col + 11, COLUMNAS_SHEET)
+    col_etiquetas = min(c for c in (ppto_col, exp_col) if c)
+    fila_datos = MAX_FILAS + 1
+
+    etiquetas = _leer_rango(
+        sheets_service, spreadsheet_id, _rango_hoja(titulo, fila_datos, filas_grilla, col_etiquetas)
+    )
+    fila_total = None
+    for offset, fila in enumerate(etiquetas):
+        if any(isinstance(v, str) and "total" in v.lower() and "igv" in v.lower() for v in fila):
+            fila_total = fila_datos + offset
+
+    # Sin TOTAL (CON IGV) en las etiquetas: se leen todas las filas (hasta PPTO META HG)
+    fila_bloque = max(fila_datos, fila_total - FILAS_ANTES_TOTAL) if fila_total else fila_datos
+    bloque = _leer_rango(
+        sheets_service, spreadsheet_id, _rango_hoja(titulo, fila_bloque, filas_grilla, col_fin)
+    )
+    return grilla_desde_bloques([(1, ventana), (fila_datos, etiquetas), (fila_bloque, bloque)])
+
+
+def _leer_rango(sheets_service, spreadsheet_id, rango):
+    return sheets_service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range=rango,
+        valueRenderOption="UNFORMATTED_VALUE",
+        fields="values",
+    ).execute().get("values", [])
+
+
+def _rango_hoja(titulo, fila_inicio=1, fila_fin=MAX_FILAS, columnas=COLUMNAS_SHEET):
+    """Rango A1 de una pestaña, desde la columna A (p.ej. 'VS'!A1:AZ200)."""
+    titulo = titulo.replace("'", "''")
+    return f"'{titulo}'!A{fila_inicio}:{_columna_a1(columnas)}{fila_fin}"
+
+
+def _columna_a1(numero):
+    """Numero de columna (1 = A) a letras A1."""
+    letras = ""
+    while numero > 0:
+        numero, resto = divmod(numero - 1, 26)
+        letras = chr(ord("A") + resto) + letras
+    return letras
+
+
+def _leer_google_sheet_csv(drive_service, spreadsheet_id):
+    """Exporta un Google Sheet como CSV (primera pestaña) desde Drive y lo analiza."""
+    try:
+        data = drive_service.files().export(
+            fileId=spreadsheet_id, mimeType="text/csv"
+        ).execute()
+        texto = data.decode("utf-8-sig") if isinstance(data, bytes) else data
+        return analizar_hoja_vs(grilla_desde_csv(texto), _layouts_vs)
+    except Exception as e:
+        print(f"    [WARN] Error exportando Google Sheet como CSV: {e}")
+        return {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
 
 
 # ============================================================================
 # LECTURA DE ARCHIVOS DE DRIVE
 # ============================================================================
 
-def _descargar_y_leer_excel(drive_service, file_id, filename):
-    """Descarga un archivo Excel de Drive y lo procesa."""
+def _descargar_y_leer_excel(drive_service, file_id, filename, md5="", modificado=""):
+    """
+    Descarga un archivo Excel de Drive y lo procesa.
+    Con md5Checksum/modifiedTime se puede reutilizar el resultado sin descargarlo.
+    """
+    clave_origen = f"drive:{file_id}:{md5}:{modificado}" if (md5 or modificado) else None
     try:
-        request = drive_service.files().get_media(fileId=file_id, supportsAllDrives=True)
-        file_data = request.execute()
-        return _procesar_excel(file_data, filename)
+        return _procesar_excel_con_cache(
+            lambda: drive_service.files().get_media(fileId=file_id, supportsAllDrives=True).execute(),
+            filename, clave_origen,
+        )
     except Exception as e:
         print(f"    [WARN] Error descargando Excel de Drive: {e}")
         return None
@@ -915,63 +919,19 @@ def _leer_archivo_drive(drive_service, sheets_service, file_id):
     """Lee un archivo individual de Drive."""
     try:
         file_meta = drive_service.files().get(
-            fileId=file_id, fields="id,name,mimeType",
+            fileId=file_id, fields="id,name,mimeType,md5Checksum,modifiedTime",
             supportsAllDrives=True
         ).execute()
 
         mime = file_meta.get("mimeType", "")
         if mime == "application/vnd.google-apps.spreadsheet":
-            return _leer_google_sheet(sheets_service, file_id)
+            return _leer_google_sheet(sheets_service, file_id, drive_service)
         elif "spreadsheet" in mime or "excel" in mime:
-            return _descargar_y_leer_excel(drive_service, file_id, file_meta["name"])
+            return _descargar_y_leer_excel(
+                drive_service, file_id, file_meta["name"],
+                file_meta.get("md5Checksum", ""), file_meta.get("modifiedTime", ""),
+            )
     except Exception as e:
         print(f"    [WARN] Error leyendo archivo Drive: {e}")
 
     return {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
-
-
-# ============================================================================
-# UTILIDADES
-# ============================================================================
-
-def _parsear_numero(valor):
-    """
-    Parsea un valor a numero, manejando formatos:
-    - Español: 39.488,25 (punto=miles, coma=decimal)
-    - Ingles: 39,488.25 (coma=miles, punto=decimal)
-    - Sin separador: 39488.25
-    """
-    if valor is None:
-        return None
-    if isinstance(valor, (int, float)):
-        return float(valor)
-    if isinstance(valor, str):
-        limpio = valor.strip()
-        # Remover simbolo de moneda
-        limpio = re.sub(r"[sS]/\.?\s*", "", limpio)
-        limpio = re.sub(r"(PEN|USD|US\$|\$)\s*", "", limpio)
-        # Remover cualquier caracter que no sea digito, punto, coma o guion
-        limpio = re.sub(r"[^\d.,\-]", "", limpio)
-
-        if not limpio or limpio in ["-", ".", ","]:
-            return None
-
-        # Detectar formato por posicion del ultimo separador
-        last_dot = limpio.rfind(".")
-        last_comma = limpio.rfind(",")
-
-        if last_dot > last_comma:
-            # Punto es decimal (formato ingles): 39,488.25
-            limpio = limpio.replace(",", "")
-        elif last_comma > last_dot:
-            # Coma es decimal (formato español): 39.488,25
-            limpio = limpio.replace(".", "").replace(",", ".")
-        else:
-            # Solo un tipo de separador o ninguno
-            limpio = limpio.replace(",", "")
-
-        try:
-            return float(limpio)
-        except ValueError:
-            return None
-    return None
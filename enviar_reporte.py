@@ -17,8 +17,11 @@ from datetime import datetime, timezone, timedelta
 # Zona horaria Peru (UTC-5)
 PERU_TZ = timezone(timedelta(hours=-5))
 
-from auth_gmail import autenticar_gmail, obtener_perfil
-from config import REPORT_JSON, MODO_PRUEBA, detectar_obra, OBRAS, PERSONAS_CLAVE, USUARIO_NOMBRE
+from auth_gmail import autenticar_gmail, obtener_perfil, resumen_transporte
+from config import (
+    REPORT_JSON, MODO_PRUEBA, detectar_obra, OBRAS, PERSONAS_CLAVE, USUARIO_NOMBRE,
+    GMAIL_SEARCH_QUERY, GMAIL_QUERY_MAX_LEN,
+)
 
 # Remitentes cuyos correos se ignoran completamente en el analisis
 EXCLUIR_REMITENTES = [
@@ -103,6 +106,67 @@ _dest_sf = _os.environ.get("DESTINATARIOS_SIN_FALTANTES", "")
 DESTINATARIOS_SIN_FALTANTES = [e.strip() for e in _dest_sf.split(",") if e.strip()] if _dest_sf else []
 
 
+# Reglas que Gmail puede evaluar en la query (-from: / -subject:)
+_RE_EMAIL_QUERY = re.compile(r"^[\w.+-]+@[\w-]+(\.[\w-]+)+$")
+_RE_TERMINO_QUERY = re.compile(r"^[0-9a-záéíóúñü ]+$")
+
+
+def construir_query_busqueda(query_base=GMAIL_SEARCH_QUERY, max_len=GMAIL_QUERY_MAX_LEN):
+    """Agrega a la query de Gmail las exclusiones que el servidor puede evaluar.
+
+    - EXCLUIR_REMITENTES -> -from:email
+    - EXCLUIR_ASUNTOS    -> -subject:palabra / -subject:"frase"
+    Gmail compara el asunto por palabras completas y la regla local por
+    substring, asi que Gmail excluye un subconjunto de lo que excluye
+    filtrar_comparativos (que se sigue aplicando igual).
+    Terminos con simbolos (ej: "[reporte] ...") o que ya no entran en
+    max_len caracteres quedan solo como reglas locales.
+
+    Retorna (query, reglas_locales): cantidad de reglas que Gmail no evalua.
+    """
+    clausulas = []
+    reglas_locales = 0
+
+    for remitente in EXCLUIR_REMITENTES:
+        if _RE_EMAIL_QUERY.match(remitente):
+            clausulas.append(f"-from:{remitente.lower()}")
+        else:
+            reglas_locales += 1
+
+    for palabra in EXCLUIR_ASUNTOS:
+        termino = palabra.strip().lower()
+        if not _RE_TERMINO_QUERY.match(termino):
+            reglas_locales += 1
+        elif " " in termino:
+            clausulas.append(f'-subject:"{termino}"')
+        else:
+            clausulas.append(f"-subject:{termino}")
+
+    query = query_base
+    for i, clausula in enumerate(clausulas):
+        if len(query) + 1 + len(clausula) > max_len:
+            reglas_locales += len(clausulas) - i
+            break
+        query += " " + clausula
+
+    return query, reglas_locales
+
+
+def es_excluido_por_remitente_o_asunto(asunto, de_email):
+    """Reglas 1 y 2 de filtrar_comparativos (solo necesitan Subject y From)."""
+    de_email_lower = (de_email or "").lower()
+    for remitente in EXCLUIR_REMITENTES:
+        if remitente.lower() == de_email_lower:
+            return True
+
+    asunto_lower = (asunto or "").lower()
+    for palabra in EXCLUIR_ASUNTOS:
+        if palabra in asunto_lower:
+            return True
+
+    return False
+
+
 def _es_req_sin_comparativo(comp):
     """Verifica si un correo de REQUERIMIENTO/REQ es solo logistica (no comparativo).
 
@@ -216,23 +280,9 @@ def filtrar_comparativos(comparativos, mi_email=""):
     excluidos = []
 
     for comp in comparativos:
-        asunto_lower = comp["asunto"].lower()
-
-        es_excluido = False
-
         # 1. Excluir por remitente
-        de_email_lower = comp.get("de_email", "").lower()
-        for remitente in EXCLUIR_REMITENTES:
-            if remitente.lower() == de_email_lower:
-                es_excluido = True
-                break
-
         # 2. Excluir por palabras clave en asunto
-        if not es_excluido:
-            for palabra in EXCLUIR_ASUNTOS:
-                if palabra in asunto_lower:
-                    es_excluido = True
-                    break
+        es_excluido = es_excluido_por_remitente_o_asunto(comp["asunto"], comp.get("de_email", ""))
 
         # 3. Excluir REQUERIMIENTO/REQ que no son comparativos (solo logistica)
         if not es_excluido and _es_req_sin_comparativo(comp):
@@ -546,6 +596,8 @@ def main():
 
     comparativos = data["comparativos"]
     print(f"Total correos en reporte: {len(comparativos)}")
+    if data.get("parcial"):
+        print(f"[WARN] Reporte parcial (plazo agotado), omitido: {data.get('omitido_por_plazo', {})}")
 
     filtrados, excluidos = filtrar_comparativos(comparativos, mi_email)
     print(f"Comparativos reales: {len(filtrados)}")
@@ -558,6 +610,9 @@ def main():
 
     print(f"\nEnviando reportes...")
     enviar_reporte(service, mi_email, filtrados)
+    transporte = resumen_transporte()
+    if transporte:
+        print(transporte)
     print("Listo!")
 
 
@@ -0,0 +1,549 @@
+"""
+Motor de extraccion de la hoja "VS" de un comparativo.
+
+Busca PPTO META HG, EXPEDIENTE y Monto CC sobre una grilla en memoria
+(GrillaHoja), sin importar de donde vienen los valores. Cada origen tiene
+su adaptador:
+- grilla_desde_openpyxl: hoja de un .xlsx (adjunto de Gmail o archivo de Drive)
+- grilla_desde_values: respuesta de spreadsheets.values (Google Sheets API)
+- grilla_desde_bloques: varios rangos de una hoja grande de Google Sheets
+- grilla_desde_csv: exportacion CSV de un Google Sheet (files.export de Drive)
+
+La unica diferencia entre origenes es como se convierte una celda a numero:
+en Excel solo cuentan celdas numericas; en Sheets/CSV tambien textos como
+"S/ 39.488,25" (parsear_numero).
+
+Estructura esperada de la hoja:
+- Fila ~6: Headers de seccion: EXPEDIENTE | PROVEEDOR1 | PROVEEDOR2 | PPTO META HG
+- Fila ~7: Sub-headers: V.U. | SUB TOTAL | OBS | ... | V.U. | SUB TOTAL | ...
+- Filas 8+: datos
+- Filas finales: COSTO DIRECTO (SIN IGV), SUB TOTAL, IGV, TOTAL (CON IGV)
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+
+# Ventana de lectura de una hoja (filas x columnas)
+MAX_FILAS = 200
+MAX_COLUMNAS = 50
+
+# Subir si cambia la logica de layouts: los guardados en disco se descartan
+LAYOUT_VERSION = 1
+
+_ETIQUETAS_SUBTOTAL_FILA = ["sub total", "subtotal", "costo directo", "costo directo (sin igv)"]
+
+
+class GrillaHoja:
+    """
+    Valores de una hoja (filas x columnas, indices desde 1) con las filas clave
+    ubicadas en una sola pasada:
+    - headers: celdas de texto de las filas 1-19 (para las secciones)
+    - filas_total_igv: filas con "total ... igv", de abajo hacia arriba
+    - filas_subtotal: filas con SUB TOTAL / COSTO DIRECTO, de abajo hacia arriba
+
+    filas_total_igv y filas_subtotal recorren toda la hoja: se calculan recien
+    cuando se piden (con un layout conocido no hace falta).
+    """
+
+    def __init__(self, filas, numero):
+        """
+        Args:
+            filas: lista de filas (listas de valores); pueden tener distinto largo.
+            numero: funcion celda -> numero o None (depende del origen).
+        """
+        self.filas = filas
+        self.max_row = len(filas)
+        self.max_col = max((len(f) for f in filas), default=0)
+        self._numero = numero
+        self._filas_total_igv = None
+        self._filas_subtotal = None
+
+        self.headers = []
+        for row_idx, fila in enumerate(filas[:19], start=1):
+            for col_idx, val in enumerate(fila, start=1):
+                if val and isinstance(val, str):
+                    self.headers.append((row_idx, col_idx, val.strip().lower()))
+
+    def _indexar_filas(self):
+        self._filas_total_igv = []
+        self._filas_subtotal = []
+        for row_idx in range(self.max_row, 0, -1):
+            if self.fila_tiene_total_igv(row_idx):
+                self._filas_total_igv.append(row_idx)
+            if any(txt in _ETIQUETAS_SUBTOTAL_FILA for txt in self._textos_fila(row_idx)):
+                self._filas_subtotal.append(row_idx)
+
+    @property
+    def filas_total_igv(self):
+        if self._filas_total_igv is None:
+            self._indexar_filas()
+        return self._filas_total_igv
+
+    @property
+    def filas_subtotal(self):
+        if self._filas_subtotal is None:
+            self._indexar_filas()
+        return self._filas_subtotal
+
+    def _textos_fila(self, row):
+        for val in self.filas[row - 1]:
+            if val and isinstance(val, str):
+                yield val.strip().lower()
+
+    def fila_tiene_total_igv(self, row):
+        return any("total" in txt and "igv" in txt for txt in self._textos_fila(row))
+
+    def huella(self):
+        """
+        Huella de la plantilla: posicion y texto de las etiquetas de seccion y
+        SUB TOTAL de la banda de headers (no depende de los datos de la hoja).
+        """
+        etiquetas = "|".join(
+            f"{r},{c},{txt}" for r, c, txt in self.headers if _es_etiqueta_layout(txt)
+        )
+        return hashlib.sha1(etiquetas.encode("utf-8")).hexdigest()
+
+    def valor(self, row, col):
+        if 1 <= row <= self.max_row and 1 <= col <= len(self.filas[row - 1]):
+            return self.filas[row - 1][col - 1]
+        return None
+
+    def monto(self, row, col):
+        """Valor numerico de la celda si puede ser un total (>= 100), si no None."""
+        num = self._numero(self.valor(row, col))
+        if num and num >= 100:
+            return num
+        return None
+
+
+def _es_seccion_ppto(txt):
+    return ("ppto" in txt and "meta" in txt) or "meta hg" in txt
+
+
+def _es_seccion_expediente(txt):
+    return "expediente" in txt
+
+
+def _es_subtotal_columna(txt):
+    return "sub total" in txt or "subtotal" in txt or txt == "sub-total"
+
+
+def _es_etiqueta_layout(txt):
+    return _es_seccion_ppto(txt) or _es_seccion_expediente(txt) or _es_subtotal_columna(txt)
+
+
+class LayoutsVS:
+    """
+    Layouts de hoja VS ya resueltos, por huella de plantilla.
+
+    Un layout guarda la fila de headers, las columnas de seccion y de SUB TOTAL,
+    el rango de proveedores y a cuantas filas del final esta TOTAL (CON IGV).
+    Si la huella coincide se leen esas celdas directamente; si la validacion
+    falla (otra cantidad de filas al final, celda vacia, etc.) se hace la
+    busqueda completa.
+
+    Se puede guardar/cargar en JSON entre ejecuciones. En procesos del pool de
+    Excel se usa una copia (exportar) y los cambios vuelven con fusionar().
+    """
+
+    def __init__(self, conocidos=None):
+        self._lock = threading.Lock()
+        self._layouts = dict(conocidos or {})
+        self._nuevos = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.no_validos = 0
+
+    def buscar(self, huella):
+        with self._lock:
+            return self._layouts.get(huella)
+
+    def aprender(self, huella, layout):
+        with self._lock:
+            self._layouts[huella] = layout
+            self._nuevos[huella] = layout
+
+    def contar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    def exportar(self):
+        """Copia de los layouts conocidos (para pasarla a otro proceso)."""
+        with self._lock:
+            return dict(self._layouts)
+
+    def cambios(self):
+        """Layouts aprendidos y contadores desde que se creo (para fusionar)."""
+        with self._lock:
+            return {
+                "nuevos": dict(self._nuevos),
+                "contadores": {"aciertos": self.aciertos, "fallos": self.fallos,
+                               "no_validos": self.no_validos},
+            }
+
+    def fusionar(self, cambios):
+        for huella, layout in cambios["nuevos"].items():
+            self.aprender(huella, layout)
+        with self._lock:
+            for contador, valor in cambios["contadores"].items():
+                setattr(self, contador, getattr(self, contador) + valor)
+
+    @classmethod
+    def cargar(cls, ruta):
+        """Lee el JSON de layouts; si no existe, es de otra version o esta dañado, empieza vacio."""
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == LAYOUT_VERSION:
+                return cls(data.get("layouts", {}))
+        except (OSError, ValueError):
+            pass
+        return cls()
+
+    def guardar(self, ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": LAYOUT_VERSION, "layouts": self.exportar()}, f)
+        os.replace(tmp, ruta)
+
+    def resumen(self):
+        total = self.aciertos + self.fallos + self.no_validos
+        tasa = f"{100 * self.aciertos / total:.0f}%" if total else "-"
+        return (f"layouts VS: {self.aciertos} aciertos, {self.fallos} sin layout, "
+                f"{self.no_validos} no validados (tasa {tasa}, {len(self._layouts)} plantillas)")
+
+
+# ============================================================================
+# ADAPTADORES
+# ============================================================================
+
+def grilla_desde_openpyxl(ws, max_filas=MAX_FILAS, max_columnas=MAX_COLUMNAS):
+    """Grilla de una hoja de openpyxl (normal o read_only), leida una sola vez."""
+    if hasattr(ws, "reset_dimensions"):
+        # Las dimensiones de una hoja read_only vienen del XML y pueden estar mal:
+        # se ignoran y la lectura se corta en la ventana de filas x columnas
+        ws.reset_dimensions()
+    max_row = min(ws.max_row or max_filas, max_filas)
+    max_col = min(ws.max_column or max_columnas, max_columnas)
+    filas = [
+        list(fila)
+        for fila in ws.iter_rows(min_row=1, max_row=max_row, max_col=max_col, values_only=True)
+    ]
+    return GrillaHoja(filas, _numero_excel)
+
+
+def grilla_desde_values(values):
+    """Grilla de la respuesta de spreadsheets.values (lista de listas, ya acotada por el rango)."""
+    return GrillaHoja([list(fila) for fila in values or []], parsear_numero)
+
+
+def grilla_desde_bloques(bloques):
+    """
+    Grilla armada con varios rangos de spreadsheets.values de la misma hoja.
+
+    Args:
+        bloques: lista de (fila_inicio, values); las filas que no vienen en
+            ningun bloque quedan vacias. Si dos bloques cubren la misma fila,
+            gana el ultimo.
+    """
+    filas = []
+    for fila_inicio, values in bloques:
+        for offset, fila in enumerate(values or []):
+            idx = fila_inicio - 1 + offset
+            if idx >= len(filas):
+                filas.extend([] for _ in range(idx + 1 - len(filas)))
+            filas[idx] = list(fila)
+    return GrillaHoja(filas, parsear_numero)
+
+
+def grilla_desde_csv(texto, max_filas=MAX_FILAS, max_columnas=MAX_COLUMNAS):
+    """Grilla de un CSV (p.ej. files.export de un Google Sheet con mimeType text/csv)."""
+    filas = []
+    for fila in csv.reader(io.StringIO(texto)):
+        if len(filas) >= max_filas:
+            break
+        filas.append([celda if celda != "" else None for celda in fila[:max_columnas]])
+    return GrillaHoja(filas, parsear_numero)
+
+
+def _numero_excel(val):
+    """En Excel solo las celdas numericas cuentan como monto."""
+    if isinstance(val, (int, float)):
+        return val
+    return None
+
+
+# ============================================================================
+# MOTOR DE EXTRACCION
+# ============================================================================
+
+def analizar_hoja_vs(grilla, layouts=None):
+    """
+    Extrae de la grilla:
+    - expediente: TOTAL (CON IGV) de la seccion EXPEDIENTE
+    - ppto_meta_hg: TOTAL (CON IGV) de la seccion PPTO META HG
+    - monto_cc: TOTAL (CON IGV) de un PROVEEDOR (columnas entre EXPEDIENTE y PPTO META HG)
+
+    Args:
+        layouts: LayoutsVS opcional; con una plantilla conocida se leen las celdas
+            directamente en lugar de buscar en toda la hoja.
+    """
+    if layouts is None:
+        return _analizar_completo(grilla)[0]
+
+    huella = grilla.huella()
+    layout = layouts.buscar(huella)
+    if layout:
+        resultado = _leer_con_layout(grilla, layout)
+        if resultado is not None:
+            layouts.contar("aciertos")
+            return resultado
+        # No se descarta: suele ser una celda vacia en esta hoja, no otra plantilla.
+        # Si la busqueda completa resuelve otro layout, lo reemplaza.
+        layouts.contar("no_validos")
+    else:
+        layouts.contar("fallos")
+
+    resultado, layout = _analizar_completo(grilla)
+    if layout:
+        layouts.aprender(huella, layout)
+    return resultado
+
+
+def ubicar_secciones(grilla):
+    """
+    Ubica los headers de seccion en la banda de headers.
+    Retorna (fila_ppto, columna_ppto, columna_expediente); None si no esta.
+    """
+    ppto_row = ppto_col = exp_col = None
+    for row_idx, col_idx, val in grilla.headers:
+        if _es_seccion_ppto(val):
+            ppto_col = col_idx
+            ppto_row = row_idx
+        elif _es_seccion_expediente(val):
+            exp_col = col_idx
+    return ppto_row, ppto_col, exp_col
+
+
+def _leer_con_layout(grilla, layout):
+    """
+    Lee los totales en las celdas de un layout conocido. Retorna None si la hoja
+    no lo cumple (la busqueda completa podria dar otro resultado).
+    """
+    fila = grilla.max_row - layout["offset_total"]
+    if fila <= layout["header_row"]:
+        return None
+    # La fila del layout debe ser la ultima con TOTAL ... IGV
+    if not grilla.fila_tiene_total_igv(fila):
+        return None
+    if any(grilla.fila_tiene_total_igv(r) for r in range(fila + 1, grilla.max_row + 1)):
+        return None
+
+    resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
+    ppto_val = grilla.monto(fila, layout["ppto_subtotal_col"])
+    if not ppto_val:
+        return None
+    resultado["ppto_meta_hg"] = f"S/ {ppto_val:,.2f}"
+    if layout["exp_subtotal_col"]:
+        exp_val = grilla.monto(fila, layout["exp_subtotal_col"])
+        if not exp_val:
+            return None
+        resultado["expediente"] = f"S/ {exp_val:,.2f}"
+    for col_idx in range(layout["prov_col_start"], layout["prov_col_end"]):
+        val = grilla.monto(fila, col_idx)
+        if val:
+            resultado["monto_cc"] = f"S/ {val:,.2f}"
+            break
+    return resultado
+
+
+def _analizar_completo(grilla):
+    """
+    Busqueda completa en la hoja. Retorna (resultado, layout): layout es None si
+    el resultado depende de los datos (fallbacks) y no se puede reutilizar.
+    """
+    resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
+    max_row, max_col = grilla.max_row, grilla.max_col
+    # Se puede guardar el layout solo si todo se resolvio por etiquetas y en la fila TOTAL (CON IGV)
+    reutilizable = True
+
+    # ================================================================
+    # PASO 1: Encontrar headers de seccion (PPTO META HG y EXPEDIENTE)
+    # ================================================================
+    ppto_row, ppto_col_start, exp_col_start = ubicar_secciones(grilla)
+    if not ppto_col_start:
+        return resultado, None
+
+    # ================================================================
+    # PASO 2: Encontrar columnas "SUB TOTAL" bajo cada seccion
+    # ================================================================
+    header_row = ppto_row  # Fila de headers de seccion
+    # Las etiquetas SUB TOTAL deben caer en la banda de la huella (filas 1-19)
+    if header_row + 4 >= 20:
+        reutilizable = False
+
+    def _encontrar_subtotal_col(section_col_start, section_col_end):
+        """Busca columna SUB TOTAL dentro de una seccion."""
+        nonlocal reutilizable
+        for r in range(header_row, min(header_row + 5, max_row + 1)):
+            for c in range(section_col_start, min(section_col_end, max_col + 1)):
+                val = grilla.valor(r, c)
+                if val and isinstance(val, str):
+                    if _es_subtotal_columna(val.strip().lower()):
+                        return c
+        # Fallback: buscar columna numerica (depende de los datos)
+        reutilizable = False
+        for c in range(section_col_start, min(section_col_end, max_col + 1)):
+            for r in range(header_row + 1, min(header_row + 10, max_row + 1)):
+                if grilla.monto(r, c):
+                    return c
+        return None
+
+    ppto_subtotal_col = _encontrar_subtotal_col(ppto_col_start, ppto_col_start + 12)
+
+    exp_subtotal_col = None
+    if exp_col_start:
+        # Limite de columnas de EXPEDIENTE: hasta la siguiente seccion o +12
+        exp_end = ppto_col_start if ppto_col_start > exp_col_start else exp_col_start + 12
+        exp_subtotal_col = _encontrar_subtotal_col(exp_col_start, exp_end)
+
+    # Fila TOTAL (CON IGV) mas abajo de la hoja (None si no hay)
+    fila_total_igv = grilla.filas_total_igv[0] if grilla.filas_total_igv else None
+
+    # ================================================================
+    # PASO 3: Buscar TOTAL (CON IGV) para cada seccion
+    # ================================================================
+    def _extraer_total_igv(subtotal_col, section_col_start, section_end):
+        """Busca el valor TOTAL (CON IGV) en la columna SUB TOTAL de una seccion."""
+        nonlocal reutilizable
+        if not subtotal_col:
+            return None
+        if fila_total_igv and fila_total_igv > header_row:
+            val = grilla.monto(fila_total_igv, subtotal_col)
+            if val:
+                return val
+            # Buscar en columnas cercanas de la seccion
+            reutilizable = False
+            for try_col in range(section_col_start, min(section_end, max_col + 1)):
+                val = grilla.monto(fila_total_igv, try_col)
+                if val:
+                    return val
+
+        # Fallback: buscar SUB TOTAL o COSTO DIRECTO
+        reutilizable = False
+        for row_idx in grilla.filas_subtotal:
+            if row_idx <= header_row:
+                break
+            val = grilla.monto(row_idx, subtotal_col)
+            if val:
+                return val
+        # Ultimo fallback: ultimo valor grande
+        last_val = None
+        for row_idx in range(header_row + 2, max_row + 1):
+            val = grilla.monto(row_idx, subtotal_col)
+            if val:
+                last_val = val
+        return last_val
+
+    # PPTO META HG
+    ppto_val = _extraer_total_igv(ppto_subtotal_col, ppto_col_start, ppto_col_start + 12)
+    if ppto_val:
+        resultado["ppto_meta_hg"] = f"S/ {ppto_val:,.2f}"
+    else:
+        reutilizable = False
+
+    # EXPEDIENTE
+    if exp_subtotal_col:
+        exp_end = ppto_col_start if ppto_col_start > exp_col_start else exp_col_start + 12
+        exp_val = _extraer_total_igv(exp_subtotal_col, exp_col_start, exp_end)
+        if exp_val:
+            resultado["expediente"] = f"S/ {exp_val:,.2f}"
+        else:
+            reutilizable = False
+
+    # ================================================================
+    # PASO 4: Buscar Monto CC (ganador/proveedor)
+    # Columnas ENTRE EXPEDIENTE y PPTO META HG (donde estan los proveedores)
+    # ================================================================
+    # Determinar rango de columnas de proveedores (excluir EXPEDIENTE y PPTO META HG)
+    if exp_col_start and exp_subtotal_col:
+        # Proveedores empiezan despues de la ultima columna de EXPEDIENTE
+        prov_col_start = exp_subtotal_col + 1
+    elif exp_col_start:
+        prov_col_start = exp_col_start + 5  # estimacion
+    else:
+        prov_col_start = 1
+
+    prov_col_end = ppto_col_start  # Proveedores terminan antes de PPTO META HG
+
+    if prov_col_start < prov_col_end and fila_total_igv:
+        # Buscar valor en columnas de PROVEEDORES (entre EXPEDIENTE y PPTO)
+        for col_idx in range(prov_col_start, prov_col_end):
+            val = grilla.monto(fila_total_igv, col_idx)
+            if val:
+                resultado["monto_cc"] = f"S/ {val:,.2f}"
+                break
+
+    if not reutilizable:
+        return resultado, None
+    layout = {
+        "header_row": header_row,
+        "ppto_subtotal_col": ppto_subtotal_col,
+        "exp_subtotal_col": exp_subtotal_col,
+        "prov_col_start": prov_col_start,
+        "prov_col_end": prov_col_end,
+        "offset_total": max_row - fila_total_igv,
+    }
+    return resultado, layout
+
+
+# ============================================================================
+# UTILIDADES
+# ============================================================================
+
+def parsear_numero(valor):
+    """
+    Parsea un valor a numero, manejando formatos:
+    - Español: 39.488,25 (punto=miles, coma=decimal)
+    - Ingles: 39,488.25 (coma=miles, punto=decimal)
+    - Sin separador: 39488.25
+    """
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    if isinstance(valor, str):
+        limpio = valor.strip()
+        # Remover simbolo de moneda
+        limpio = re.sub(r"[sS]/\.?\s*", "", limpio)
+        limpio = re.sub(r"(PEN|USD|US\$|\$)\s*", "", limpio)
+        # Remover cualquier caracter que no sea digito, punto, coma o guion
+        limpio = re.sub(r"[^\d.,\-]", "", limpio)
+
+        if not limpio or limpio in ["-", ".", ","]:
+            return None
+
+        # Detectar formato por posicion del ultimo separador
+        last_dot = limpio.rfind(".")
+        last_comma = limpio.rfind(",")
+
+        if last_dot > last_comma:
+            # Punto es decimal (formato ingles): 39,488.25
+            limpio = limpio.replace(",", "")
+        elif last_comma > last_dot:
+            # Coma es decimal (formato español): 39.488,25
+            limpio = limpio.replace(".", "").replace(",", ".")
+        else:
+            # Solo un tipo de separador o ninguno
+            limpio = limpio.replace(",", "")
+
+        try:
+            return float(limpio)
+        except ValueError:
+            return None
+    return None
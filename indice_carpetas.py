@@ -0,0 +1,380 @@
+"""
+Indice de carpetas de Drive compartido entre comparativos.
+
+Varios comparativos enlazan la misma carpeta de obra: el listado completo
+(files.list paginado) se hace una sola vez y se reutiliza. Entre ejecuciones
+se guarda en JSON junto con un page token de la Changes API; al empezar a
+usarlo se aplican solo los cambios desde ese token (changes.list), sin volver
+a listar las carpetas.
+
+Si el token ya no es valido (o falla changes.list) se descarta el indice y
+las carpetas se vuelven a listar cuando se pidan. Al guardar se desalojan
+las carpetas que no se usan hace tiempo (ver MAX_CARPETAS_GUARDADAS).
+
+Para elegir el Excel de un comparativo dentro de una carpeta grande, cada
+listado tiene un IndiceNombres (indice invertido de los nombres de archivo)
+que se arma una sola vez por listado.
+"""
+import heapq
+import json
+import os
+import re
+import threading
+import time
+
+# Campos que se guardan de cada archivo de una carpeta
+CAMPOS_ARCHIVO = "id, name, mimeType, md5Checksum, modifiedTime"
+# Segundos entre consultas a changes.list durante una misma ejecucion
+INTERVALO_CAMBIOS = 60
+# Carpetas que se guardan en disco: las usadas mas recientemente, y ninguna
+# sin usar en mas de DIAS_SIN_USO_CARPETA dias
+MAX_CARPETAS_GUARDADAS = 200
+DIAS_SIN_USO_CARPETA = 30
+# Subir si cambia el formato del JSON: el guardado en disco se descarta
+INDICE_VERSION = 1
+
+# Letras de las palabras clave del asunto (ver drive_reader._extraer_palabras_clave_asunto)
+_LETRAS = "a-záéíóúñü"
+_PALABRAS_NO_SIGNIFICATIVAS = {"rcos", "cuadro", "comparativo"}
+
+
+def listar_carpeta(drive_service, folder_id):
+    """Todos los archivos (no eliminados) de una carpeta, recorriendo todas las paginas."""
+    archivos = []
+    page_token = None
+    while True:
+        response = drive_service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields=f"nextPageToken, files({CAMPOS_ARCHIVO})",
+            pageSize=1000,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True,
+        ).execute()
+        archivos.extend(response.get("files", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return archivos
+
+
+def es_hoja_de_calculo(archivo):
+    """Google Sheet o Excel (por mimeType o extension)."""
+    mime = archivo.get("mimeType", "")
+    return (
+        mime == "application/vnd.google-apps.spreadsheet"
+        or any(mime.endswith(ext) for ext in ["spreadsheetml.sheet", "ms-excel", "openxmlformats"])
+        or archivo["name"].lower().endswith((".xlsx", ".xls", ".xlsm"))
+    )
+
+
+class IndiceNombres:
+    """
+    Indice invertido de los nombres de las hojas de calculo de una carpeta.
+
+    Los nombres se parten en tramos de letras: una palabra clave (solo letras)
+    aparece en un nombre si y solo si esta dentro de alguno de sus tramos. Asi
+    cada palabra se busca en el vocabulario de la carpeta (no en cada archivo)
+    y su frecuencia (para el peso 3 / frecuencia) queda memorizada.
+    """
+
+    def __init__(self, archivos):
+        """
+        Args:
+            archivos: listado completo de la carpeta; solo se indexan las hojas de calculo.
+        """
+        self.total_archivos = len(archivos)
+        self.archivos = [a for a in archivos if es_hoja_de_calculo(a)]
+        self._nombres = [a["name"].lower() for a in self.archivos]
+        self._vocabulario = {}
+        self._palabras_significativas = []
+        self._con_bonus = set()
+        for pos, nombre in enumerate(self._nombres):
+            for tramo in re.findall(f"[{_LETRAS}]+", nombre):
+                self._vocabulario.setdefault(tramo, set()).add(pos)
+            palabras = re.findall(f"[{_LETRAS}]{{3,}}", nombre)
+            self._palabras_significativas.append(
+                sum(1 for w in palabras if w not in _PALABRAS_NO_SIGNIFICATIVAS)
+            )
+            if "comparativo" in nombre or "cuadro" in nombre:
+                self._con_bonus.add(pos)
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    def _archivos_con(self, palabra):
+        """Posiciones de los archivos cuyo nombre contiene la palabra (memorizado)."""
+        with self._lock:
+            posiciones = self._postings.get(palabra)
+        if posiciones is None:
+            posiciones = set()
+            for tramo, archivos in self._vocabulario.items():
+                if palabra in tramo:
+                    posiciones |= archivos
+            with self._lock:
+                self._postings[palabra] = posiciones
+        return posiciones
+
+    def mejores(self, palabras_clave, n=3):
+        """
+        Los n archivos con mejor score para las palabras clave del asunto, como
+        [(score, archivo)] de mayor a menor. En empate (y con score 0) se
+        respeta el orden del listado.
+
+        Score por archivo:
+        - cada palabra clave en el nombre: 3 / frecuencia (+1 / frecuencia si tiene 6+ letras)
+        - cada bigram (palabras consecutivas con espacio, guion o juntas): +5
+        - "comparativo" o "cuadro" en el nombre: +0.5
+        - desempate: 2 * palabras clave encontradas / palabras significativas del nombre
+        """
+        postings = {p: self._archivos_con(p) for p in palabras_clave}
+
+        bigrams = []
+        for i in range(len(palabras_clave) - 1):
+            bigrams.append(f"{palabras_clave[i]} {palabras_clave[i+1]}")
+            # Tambien sin espacio (para nombres como "UPS-TRANSFORMADOR")
+            bigrams.append(f"{palabras_clave[i]}-{palabras_clave[i+1]}")
+            bigrams.append(f"{palabras_clave[i]}{palabras_clave[i+1]}")
+
+        # Solo estos archivos pueden tener score > 0; el resto queda en 0
+        candidatos = set(self._con_bonus)
+        for posiciones in postings.values():
+            candidatos |= posiciones
+
+        con_score = []
+        for pos in sorted(candidatos):
+            nombre = self._nombres[pos]
+            score = 0
+            matched_count = 0
+            for palabra in palabras_clave:
+                if pos in postings[palabra]:
+                    freq = max(len(postings[palabra]), 1)
+                    score += 3.0 / freq
+                    if len(palabra) >= 6:
+                        score += 1.0 / freq
+                    matched_count += 1
+            for bigram in bigrams:
+                if bigram in nombre:
+                    score += 5.0
+            if pos in self._con_bonus:
+                score += 0.5
+            significativas = self._palabras_significativas[pos]
+            if significativas and matched_count > 0:
+                score += matched_count / significativas * 2.0
+            con_score.append((score, pos))
+
+        # nlargest equivale a sorted(..., reverse=True)[:n]: estable en empates
+        top = heapq.nlargest(n, con_score, key=lambda x: x[0])
+        resultado = [(score, self.archivos[pos]) for score, pos in top]
+        if len(resultado) < n:
+            for pos in range(len(self.archivos)):
+                if pos not in candidatos:
+                    resultado.append((0, self.archivos[pos]))
+                    if len(resultado) == n:
+                        break
+        return resultado
+
+
+class IndiceCarpetas:
+    """
+    Listados de carpetas de Drive por folder id (seguro entre hilos).
+
+    Las llamadas a Drive (files.list, changes.list) se hacen fuera del lock
+    global; solo la aplicacion de los cambios y la insercion de listados lo
+    toman. Cada vez que se aplican cambios sube la epoca: un listado que
+    empezo en una epoca anterior puede no tener esos cambios, asi que se usa
+    para quien lo pidio pero no se guarda en el indice.
+    """
+
+    def __init__(self, carpetas=None, page_token=None, usadas=None):
+        """
+        Args:
+            carpetas: {folder_id: {file_id: archivo}} ya conocidos.
+            page_token: token de changes.list desde el que esos listados son validos.
+            usadas: {folder_id: timestamp del ultimo uso} (para desalojar al guardar).
+        """
+        self._carpetas = dict(carpetas or {}) if page_token else {}
+        self._page_token = page_token
+        ahora = time.time()
+        self._usadas = {f: (usadas or {}).get(f, ahora) for f in self._carpetas}
+        self._ultima_consulta = None
+        self._lock = threading.Lock()
+        self._locks = {}
+        # Sube con cada lote de cambios aplicado (y al pedir un token nuevo)
+        self._epoca = 0
+        # Generacion de cada listado (cambia con cada cambio aplicado) e IndiceNombres armado para ella
+        self._secuencia = 0
+        self._generaciones = {}
+        self._nombres = {}
+        self.listados = 0
+        self.reutilizados = 0
+        self.cambios = 0
+        self.descartados = 0
+
+    def listar(self, drive_service, folder_id):
+        """Archivos de la carpeta (lista de dicts con CAMPOS_ARCHIVO). No modificar."""
+        return self._listar(drive_service, folder_id)[0]
+
+    def indice_nombres(self, drive_service, folder_id):
+        """IndiceNombres de la carpeta; se arma de nuevo solo si el listado cambio."""
+        archivos, generacion = self._listar(drive_service, folder_id)
+        with self._lock:
+            guardado = self._nombres.get(folder_id)
+            if guardado is not None and guardado[0] == generacion:
+                return guardado[1]
+        indice = IndiceNombres(archivos)
+        with self._lock:
+            self._nombres[folder_id] = (generacion, indice)
+        return indice
+
+    def _listar(self, drive_service, folder_id):
+        """(archivos, generacion del listado)."""
+        self._aplicar_cambios(drive_service)
+
+        with self._lock:
+            lock_carpeta = self._locks.setdefault(folder_id, threading.Lock())
+
+        # Lock por carpeta: si dos comparativos piden la misma carpeta a la vez, se lista una vez
+        with lock_carpeta:
+            with self._lock:
+                carpeta = self._carpetas.get(folder_id)
+                if carpeta is not None:
+                    self.reutilizados += 1
+                    self._usadas[folder_id] = time.time()
+                    return list(carpeta.values()), self._generaciones.get(folder_id)
+                epoca = self._epoca
+
+            archivos = listar_carpeta(drive_service, folder_id)
+            with self._lock:
+                self.listados += 1
+                self._secuencia += 1
+                if epoca != self._epoca:
+                    # Se aplicaron cambios mientras se listaba: este listado puede no tenerlos
+                    self.descartados += 1
+                    return archivos, self._secuencia
+                # Sin token el listado no se puede mantener al dia: solo sirve en esta ejecucion
+                self._carpetas[folder_id] = {a["id"]: a for a in archivos}
+                self._usadas[folder_id] = time.time()
+                self._generaciones[folder_id] = self._secuencia
+                return archivos, self._secuencia
+
+    def _nueva_generacion(self, folder_id):
+        """Marca el listado como cambiado (llamar con lock)."""
+        self._secuencia += 1
+        self._generaciones[folder_id] = self._secuencia
+
+    def _aplicar_cambios(self, drive_service):
+        """Trae los cambios desde el ultimo token (como maximo cada INTERVALO_CAMBIOS)."""
+        with self._lock:
+            ahora = time.monotonic()
+            if self._ultima_consulta is not None and ahora - self._ultima_consulta < INTERVALO_CAMBIOS:
+                return
+            self._ultima_consulta = ahora
+            token = self._page_token
+
+        # Fuera del lock: mientras tanto los demas hilos siguen usando los listados actuales
+        try:
+            if token is None:
+                # El token se pide antes de listar: lo que cambie despues se aplica en la proxima consulta
+                cambios = []
+                nuevo_token = drive_service.changes().getStartPageToken(
+                    supportsAllDrives=True
+                ).execute()["startPageToken"]
+            else:
+                cambios, nuevo_token = self._leer_cambios(drive_service, token)
+        except Exception as e:
+            print(f"    [DRIVE] No se pudieron leer cambios de Drive ({e}). Se vuelven a listar las carpetas.")
+            with self._lock:
+                self._vaciar()
+                self._page_token = None
+            return
+
+        with self._lock:
+            if token is None:
+                self._vaciar()
+            elif cambios:
+                for cambio in cambios:
+                    self._aplicar_cambio(cambio)
+                self._epoca += 1
+            self._page_token = nuevo_token
+
+    def _vaciar(self):
+        """Descarta todos los listados (llamar con lock)."""
+        self._carpetas.clear()
+        self._nombres.clear()
+        self._usadas.clear()
+        self._epoca += 1
+
+    def _leer_cambios(self, drive_service, page_token):
+        """Todas las paginas de changes.list desde page_token. Retorna (cambios, nuevo token)."""
+        cambios = []
+        while True:
+            response = drive_service.changes().list(
+                pageToken=page_token,
+                fields=f"nextPageToken, newStartPageToken, "
+                       f"changes(fileId, removed, file({CAMPOS_ARCHIVO}, parents, trashed))",
+                pageSize=1000,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+            ).execute()
+            cambios.extend(response.get("changes", []))
+            if "newStartPageToken" in response:
+                return cambios, response["newStartPageToken"]
+            page_token = response["nextPageToken"]
+
+    def _aplicar_cambio(self, cambio):
+        """Aplica un cambio a los listados (llamar con lock)."""
+        file_id = cambio.get("fileId")
+        archivo = cambio.get("file") or {}
+        eliminado = cambio.get("removed") or archivo.get("trashed")
+
+        # La carpeta misma fue eliminada
+        if eliminado and file_id in self._carpetas:
+            del self._carpetas[file_id]
+            self._nombres.pop(file_id, None)
+            self._usadas.pop(file_id, None)
+
+        padres = set() if eliminado else set(archivo.get("parents", []))
+        for folder_id, carpeta in self._carpetas.items():
+            if folder_id in padres:
+                carpeta[file_id] = {k: v for k, v in archivo.items() if k not in ("parents", "trashed")}
+            elif carpeta.pop(file_id, None) is None:
+                continue
+            self.cambios += 1
+            self._nueva_generacion(folder_id)
+
+    @classmethod
+    def cargar(cls, ruta):
+        """Lee el JSON del indice; si no existe, es de otra version o esta dañado, empieza vacio."""
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDICE_VERSION:
+                return cls(data.get("carpetas", {}), data.get("page_token"), data.get("usadas", {}))
+        except (OSError, ValueError):
+            pass
+        return cls()
+
+    def guardar(self, ruta):
+        """
+        Guarda el indice. Solo las MAX_CARPETAS_GUARDADAS carpetas usadas mas
+        recientemente, y ninguna sin uso hace mas de DIAS_SIN_USO_CARPETA.
+        """
+        with self._lock:
+            limite = time.time() - DIAS_SIN_USO_CARPETA * 86400
+            recientes = sorted(
+                (f for f in self._carpetas if self._usadas.get(f, 0) >= limite),
+                key=lambda f: self._usadas[f], reverse=True,
+            )[:MAX_CARPETAS_GUARDADAS] if self._page_token else []
+            data = {"version": INDICE_VERSION, "page_token": self._page_token,
+                    "carpetas": {f: self._carpetas[f] for f in recientes},
+                    "usadas": {f: self._usadas[f] for f in recientes}}
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            tmp = ruta + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, ruta)
+
+    def resumen(self):
+        """Texto corto para logs."""
+        return (f"carpetas de Drive: {self.listados} listadas, {self.reutilizados} reutilizadas, "
+                f"{self.cambios} cambios aplicados, {self.descartados} listados descartados por cambios "
+                f"({len(self._carpetas)} en el indice)")
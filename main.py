@@ -10,6 +10,10 @@ Uso:
   python main.py                  # Ejecutar todo
   python main.py --solo-buscar    # Solo buscar y listar
   python main.py --solo-seguir    # Solo seguimiento
+  python main.py --batch-size 1   # Descargar mensajes uno por uno (sin batch)
+  python main.py --incremental    # Listar solo los cambios desde la ultima ejecucion (history.list)
+  python main.py --workers 1      # Extraccion de datos y seguimiento en serie
+  python main.py --deadline 660   # Terminar (con reporte parcial si hace falta) en 11 minutos
 """
 import argparse
 import json
@@ -25,12 +29,20 @@ from rich.table import Table
 from rich.panel import Panel
 from rich.text import Text
 
-from config import REPORT_DIR, REPORT_FILE, REPORT_JSON, PERSONAS_CLAVE, MODO_PRUEBA, detectar_obra, USUARIO_NOMBRE
-from auth_gmail import autenticar_gmail, autenticar_drive, autenticar_sheets, obtener_perfil
-from agente_busqueda import buscar_comparativos
-from agente_seguimiento import realizar_seguimiento
-from drive_reader import extraer_datos_comparativo
-from enviar_reporte import filtrar_comparativos
+from config import REPORT_DIR, REPORT_FILE, REPORT_JSON, PERSONAS_CLAVE, MODO_PRUEBA, detectar_obra, USUARIO_NOMBRE, GMAIL_BATCH_SIZE, EXTRACCION_WORKERS, EXCEL_PROCESOS, EXCEL_TIMEOUT, LAYOUTS_VS_FILE, CARPETAS_DRIVE_FILE
+from auth_gmail import autenticar_gmail, autenticar_drive, autenticar_sheets, obtener_perfil, servicio_del_hilo, servicios_del_hilo, resumen_transporte
+from agente_busqueda import listar_candidatos, completar_comparativos, mensajes_perdidos
+from agente_seguimiento import crear_contexto, analizar_comparativo, imprimir_resumen
+from drive_reader import extraer_datos_comparativo, configurar_procesos_excel, cerrar_procesos_excel, configurar_almacen_excel, configurar_carpetas_drive
+from almacen_local import AlmacenMensajes, AlmacenHilos, AlmacenExcel
+from repositorio_hilos import RepositorioHilos
+from planificador import Planificador
+from cuota_api import carril, control as control_cuota
+from reintentos import politica as politica_reintentos, cobertura
+from hoja_vs import LayoutsVS
+from plazo import plazo, PlazoAgotado
+from indice_carpetas import IndiceCarpetas
+from enviar_reporte import filtrar_comparativos, construir_query_busqueda, es_excluido_por_remitente_o_asunto
 
 console = Console()
 
@@ -40,7 +52,22 @@ def main():
     parser.add_argument("--solo-buscar", action="store_true", help="Solo ejecutar busqueda")
     parser.add_argument("--solo-seguir", action="store_true", help="Solo ejecutar seguimiento")
     parser.add_argument("--max", type=int, default=100, help="Numero maximo de correos a buscar (default: 100)")
+    parser.add_argument("--batch-size", type=int, default=GMAIL_BATCH_SIZE,
+                        help=f"Mensajes por peticion batch de Gmail, 1 = serial (default: {GMAIL_BATCH_SIZE})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Sincronizacion incremental (history.list) desde la ultima ejecucion; "
+                             "los mensajes completos se descargan igual si no estan en el almacen local")
+    parser.add_argument("--workers", type=int, default=EXTRACCION_WORKERS,
+                        help=f"Comparativos procesados en paralelo (extraccion y seguimiento), 1 = serial (default: {EXTRACCION_WORKERS})")
+    parser.add_argument("--procesos-excel", type=int, default=EXCEL_PROCESOS,
+                        help=f"Procesos para parsear Excel, 0 = en el proceso principal (default: {EXCEL_PROCESOS})")
+    parser.add_argument("--sin-cache", action="store_true",
+                        help="No usar el almacen local (mensajes, hilos y resultados de Excel)")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Segundos maximos de ejecucion: cerca del limite se omite trabajo opcional "
+                             "y se guarda un reporte parcial (default: sin limite)")
     args = parser.parse_args()
+    plazo.iniciar(args.deadline)
 
     console.print(Panel.fit(
         "[bold cyan]AGENTE DE COMPARATIVOS - GMAIL[/bold cyan]\n"
@@ -58,67 +85,154 @@ def main():
         console.print(f"[bold red]Error de autenticacion: {e}[/bold red]")
         sys.exit(1)
 
-    # === AGENTE 1: Busqueda ===
+    # Almacen local de mensajes ya parseados (evita repetir messages.get)
+    # y repositorio de hilos compartido entre Drive y seguimiento (un threads.get por hilo)
+    almacen = None
+    almacen_hilos = None
+    almacen_excel = None
+    if not args.sin_cache:
+        try:
+            almacen = AlmacenMensajes()
+            almacen_hilos = AlmacenHilos()
+            almacen_excel = AlmacenExcel()
+        except Exception as e:
+            console.print(f"[yellow]Almacen local no disponible: {e}[/yellow]")
+    hilos = RepositorioHilos(almacen=almacen_hilos)
+
+    # === AGENTE 1: Busqueda en dos fases ===
     console.print("\n[bold yellow]>>> AGENTE 1: BUSQUEDA DE COMPARATIVOS[/bold yellow]")
-    comparativos = buscar_comparativos(service, max_results=args.max)
+    # Exclusiones de remitente/asunto dentro de la query de Gmail (-from:/-subject:)
+    query_busqueda, reglas_locales = construir_query_busqueda()
+
+    candidatos, excluidos_metadata, comparativos = [], [], []
+    error_busqueda = None
+    with plazo.etapa("busqueda"):
+        try:
+            # Fase 1: listar + metadata (Subject/From) y filtrar por remitente/asunto.
+            # Si Gmail ya aplica todas las exclusiones, no se pide metadata solo para eso.
+            candidatos, excluidos_metadata = listar_candidatos(
+                service, max_results=args.max, batch_size=args.batch_size, almacen=almacen,
+                query=query_busqueda, excluir=es_excluido_por_remitente_o_asunto,
+                metadata=reglas_locales > 0, incremental=args.incremental, plazo=plazo,
+            )
+
+            # Fase 2: mensaje completo (cuerpo, monto, cuerpo_preview del filtro REQ) solo de los que pasaron
+            comparativos = completar_comparativos(
+                service, candidatos, batch_size=args.batch_size, almacen=almacen, plazo=plazo,
+            )
+        except Exception as e:
+            # Lo ya descargado queda en los candidatos: va al reporte parcial
+            error_busqueda = e
+            comparativos = [c["comparativo"] for c in candidatos if "comparativo" in c]
+            console.print(f"[bold red]Error en la busqueda: {e}[/bold red]")
+
+    perdidos = mensajes_perdidos()
+    if perdidos:
+        console.print(f"[yellow]Mensajes que no se pudieron descargar: {len(perdidos)}[/yellow]")
+        for message_id, error in perdidos.items():
+            console.print(f"  [dim]- {message_id}: {error}[/dim]")
+
+    if error_busqueda is not None or plazo.agotado():
+        # Sin Gmail o sin tiempo para Drive y seguimiento: reporte parcial con lo encontrado
+        comparativos_reales, _ = filtrar_comparativos(comparativos, mi_email)
+        if error_busqueda is None:
+            plazo.omitir("extracciones y seguimientos", len(comparativos_reales))
+        with plazo.etapa("guardado"):
+            _guardar_reporte(comparativos_reales, [], mi_email, error=error_busqueda)
+        _mostrar_plazo()
+        console.print(f"[yellow]Reporte parcial guardado con {len(comparativos_reales)} comparativos.[/yellow]")
+        if error_busqueda is not None:
+            raise error_busqueda
+        return
 
     if not comparativos:
         console.print("[bold red]No se encontraron correos de comparativos.[/bold red]")
         sys.exit(0)
 
-    console.print(f"[bold]Correos encontrados: {len(comparativos)}[/bold]")
+    console.print(f"[bold]Correos encontrados: {len(comparativos) + len(excluidos_metadata)}[/bold]")
 
     # === FILTRAR correos que NO son comparativos reales (ANTES de Drive) ===
     console.print("\n[bold yellow]>>> FILTRANDO CORREOS NO RELEVANTES[/bold yellow]")
+    # (remitente/asunto ya se aplicaron en la fase 1; aqui quedan REQ y deduplicacion)
     comparativos_reales, excluidos = filtrar_comparativos(comparativos, mi_email)
+    excluidos = excluidos_metadata + excluidos
     if excluidos:
         console.print(f"[dim]Excluidos (no son comparativos): {len(excluidos)}[/dim]")
         for exc in excluidos:
             console.print(f"  [dim]- {exc['asunto'][:60]}[/dim]")
     console.print(f"[bold]Comparativos reales para procesar: {len(comparativos_reales)}[/bold]")
 
-    # === Extraer datos de archivos (Monto CC y PPTO META HG) solo para reales ===
+    # === Extraccion de datos (Monto CC y PPTO META HG) y seguimiento, en paralelo ===
+    # El seguimiento no depende de los datos de Drive: ambas etapas corren a la vez
+    # por comparativo y se unen antes de guardar el reporte.
     console.print("\n[bold yellow]>>> EXTRAYENDO DATOS DE ARCHIVOS ADJUNTOS Y DRIVE[/bold yellow]")
+    drive_service = sheets_service = None
     try:
         drive_service = autenticar_drive()
         sheets_service = autenticar_sheets()
-
-        for i, comp in enumerate(comparativos_reales):
-            console.print(f"  [{i+1}/{len(comparativos_reales)}] {comp['asunto'][:50]}...", end=" ")
-            try:
-                datos = extraer_datos_comparativo(
-                    service, drive_service, sheets_service,
-                    comp["id"], comp.get("cuerpo_preview", ""),
-                    asunto=comp.get("asunto", ""),
-                    thread_id=comp.get("thread_id", "")
-                )
-                if datos:
-                    if datos.get("monto_cc") != "No especificado":
-                        comp["monto"] = datos["monto_cc"]
-                    if datos.get("ppto_meta_hg") != "No especificado":
-                        comp["ppto_meta_hg"] = datos["ppto_meta_hg"]
-                    if datos.get("expediente") != "No especificado":
-                        comp["expediente"] = datos["expediente"]
-                console.print(f"[green]OK[/green] (Monto: {comp['monto']}, PPTO: {comp.get('ppto_meta_hg', 'N/A')}, EXP: {comp.get('expediente', 'N/A')})")
-            except Exception as e:
-                console.print(f"[yellow]SKIP[/yellow] ({e})")
     except Exception as e:
         console.print(f"[yellow]Drive/Sheets no disponible: {e}. Usando datos del correo.[/yellow]")
+    if not args.solo_buscar:
+        print("\n[AGENTE 3] Realizando seguimiento de comparativos (en paralelo con la extraccion)...")
+
+    # Excel se parsea en procesos aparte para no frenar las descargas de los workers
+    configurar_procesos_excel(args.procesos_excel, EXCEL_TIMEOUT)
+    # Resultados de Excel ya procesados (por hash / version de Drive): evita descargar y parsear.
+    # Layouts de hoja VS por plantilla: evita buscar PPTO META HG / SUB TOTAL celda por celda
+    layouts_vs = None if args.sin_cache else LayoutsVS.cargar(LAYOUTS_VS_FILE)
+    configurar_almacen_excel(almacen_excel, layouts_vs)
+    # Carpetas de obra enlazadas por varios comparativos: se listan una vez y se
+    # mantienen al dia con la Changes API entre ejecuciones
+    carpetas_drive = IndiceCarpetas() if args.sin_cache else IndiceCarpetas.cargar(CARPETAS_DRIVE_FILE)
+    configurar_carpetas_drive(carpetas_drive)
+    try:
+        with plazo.etapa("extraccion y seguimiento"):
+            seguimiento = _ejecutar_etapas(
+                comparativos_reales, service, drive_service, sheets_service, mi_email,
+                almacen, hilos, args.workers, seguir=not args.solo_buscar,
+            )
+    finally:
+        cerrar_procesos_excel()
+
+    if almacen:
+        console.print(f"[dim]Almacen local: {almacen.resumen()}[/dim]")
+    if almacen_excel:
+        console.print(f"[dim]Almacen local: {almacen_excel.resumen()}[/dim]")
+    if layouts_vs:
+        console.print(f"[dim]{layouts_vs.resumen()}[/dim]")
+        try:
+            layouts_vs.guardar(LAYOUTS_VS_FILE)
+        except OSError as e:
+            console.print(f"[yellow]No se pudieron guardar los layouts VS: {e}[/yellow]")
+    console.print(f"[dim]Indice de {carpetas_drive.resumen()}[/dim]")
+    if not args.sin_cache:
+        try:
+            carpetas_drive.guardar(CARPETAS_DRIVE_FILE)
+        except OSError as e:
+            console.print(f"[yellow]No se pudo guardar el indice de carpetas de Drive: {e}[/yellow]")
+    transporte = resumen_transporte()
+    if transporte:
+        console.print(f"[dim]{transporte}[/dim]")
 
     _mostrar_tabla_comparativos(comparativos_reales)
 
     if args.solo_buscar:
-        _guardar_reporte(comparativos_reales, [], mi_email)
+        with plazo.etapa("guardado"):
+            _guardar_reporte(comparativos_reales, [], mi_email)
+        _mostrar_plazo()
         console.print("\n[green]Reporte guardado. Ejecuta sin --solo-buscar para ver mas.[/green]")
         return
 
     # === AGENTE 2: Seguimiento (solo comparativos reales) ===
     console.print("\n[bold yellow]>>> AGENTE 3: SEGUIMIENTO DE RESPUESTAS[/bold yellow]")
-    seguimiento = realizar_seguimiento(service, comparativos_reales, mi_email)
+    imprimir_resumen(seguimiento)
     _mostrar_tabla_seguimiento(seguimiento)
+    console.print(f"[dim]Repositorio de {hilos.resumen()}[/dim]")
 
     # Guardar reporte
-    _guardar_reporte(comparativos_reales, seguimiento, mi_email)
+    with plazo.etapa("guardado"):
+        _guardar_reporte(comparativos_reales, seguimiento, mi_email)
+    _mostrar_plazo()
 
     console.print(Panel.fit(
         "[bold green]PROCESO COMPLETADO[/bold green]\n"
@@ -128,6 +242,127 @@ def main():
     ))
 
 
+def _ejecutar_etapas(comparativos, service, drive_service, sheets_service, mi_email,
+                    almacen, hilos, workers, seguir=True):
+    """
+    Extraccion de datos (adjuntos/Drive) y seguimiento de cada comparativo como
+    tareas de un Planificador. Por comparativo:
+
+        extraccion:i ──┐
+                       ├──> unir:i  (actualiza el monto mostrado en el seguimiento)
+        seguimiento:i ─┘
+
+    Sin Drive/Sheets (drive_service None) no hay tareas de extraccion.
+    Con workers > 1 cada worker usa sus propios servicios (httplib2 no es thread-safe).
+    Retorna el seguimiento en el orden de los comparativos (vacio si seguir=False).
+    """
+    plan = Planificador(workers=workers)
+    contexto = crear_contexto(mi_email)
+    total = len(comparativos)
+    seguimiento = [None] * total
+
+    def _servicios():
+        if workers <= 1:
+            return service, drive_service, sheets_service
+        return servicios_del_hilo()
+
+    def _gmail():
+        return service if workers <= 1 else servicio_del_hilo("gmail", "v1")
+
+    def _extraer(comp):
+        # Cerca del plazo no se empiezan tareas: queda el monto del correo
+        if plazo.agotado():
+            plazo.omitir("extracciones")
+            raise PlazoAgotado("plazo agotado")
+        gmail, drive, sheets = _servicios()
+        # Lecturas especulativas de Drive/Sheets: ceden la cuota al seguimiento
+        with carril("extraccion"):
+            datos = extraer_datos_comparativo(
+                gmail, drive, sheets,
+                comp["id"], comp.get("cuerpo_preview", ""),
+                asunto=comp.get("asunto", ""),
+                thread_id=comp.get("thread_id", ""),
+                almacen=almacen,
+                hilos=hilos,
+            )
+        _aplicar_datos_extraidos(comp, datos)
+
+    def _seguir(comp):
+        if plazo.agotado():
+            plazo.omitir("seguimientos")
+            raise PlazoAgotado("plazo agotado")
+        with carril("seguimiento"):
+            return analizar_comparativo(_gmail(), comp, contexto, hilos)
+
+    def _unir(i, comp):
+        # El seguimiento copio el monto del correo; si Drive encontro el Monto CC, usar ese
+        seg = plan.resultado(f"seguimiento:{i}")
+        if seg is None:
+            seg = {
+                "id": comp["id"], "thread_id": comp.get("thread_id", ""), "asunto": comp["asunto"],
+                "estado_general": "ERROR", "error": str(plan.error(f"seguimiento:{i}")),
+                "respuestas": {}, "total_mensajes": 0, "cadena_completa": False,
+            }
+        if "monto" in seg:
+            seg["monto"] = comp["monto"]
+        seguimiento[i] = seg
+
+    for i, comp in enumerate(comparativos):
+        if drive_service is not None:
+            plan.agregar(f"extraccion:{i}", lambda comp=comp: _extraer(comp), "extraccion")
+        if seguir:
+            plan.agregar(f"seguimiento:{i}",
+                         lambda comp=comp: _seguir(comp),
+                         "seguimiento")
+            deps = [f"seguimiento:{i}"]
+            if drive_service is not None:
+                deps.append(f"extraccion:{i}")
+            plan.agregar(f"unir:{i}", lambda i=i, comp=comp: _unir(i, comp), "unir", depende_de=deps)
+
+    extraidos = 0
+
+    def _progreso(nombre, _resultado, error):
+        nonlocal extraidos
+        etapa, i = nombre.split(":")
+        if etapa != "extraccion":
+            return
+        extraidos += 1
+        comp = comparativos[int(i)]
+        estado = f"[yellow]SKIP[/yellow] ({error})" if error else _texto_extraccion_ok(comp)
+        console.print(f"  [{extraidos}/{total}] {comp['asunto'][:50]}... {estado}")
+
+    plan.ejecutar(al_terminar=_progreso)
+
+    for linea in plan.resumen():
+        console.print(f"[dim][PLAN] {linea}[/dim]")
+    for linea in control_cuota.resumen():
+        console.print(f"[dim][CUOTA] {linea}[/dim]")
+    console.print(f"[dim][CUOTA] {politica_reintentos.resumen()}; {cobertura.resumen()}[/dim]")
+    return seguimiento if seguir else []
+
+
+def _mostrar_plazo():
+    """Consumo del plazo por etapa y trabajo omitido."""
+    for linea in plazo.resumen():
+        console.print(f"[dim][PLAZO] {linea}[/dim]")
+
+
+def _aplicar_datos_extraidos(comp, datos):
+    """Copia al comparativo los datos encontrados en adjuntos/Drive."""
+    if not datos:
+        return
+    if datos.get("monto_cc") != "No especificado":
+        comp["monto"] = datos["monto_cc"]
+    if datos.get("ppto_meta_hg") != "No especificado":
+        comp["ppto_meta_hg"] = datos["ppto_meta_hg"]
+    if datos.get("expediente") != "No especificado":
+        comp["expediente"] = datos["expediente"]
+
+
+def _texto_extraccion_ok(comp):
+    return f"[green]OK[/green] (Monto: {comp['monto']}, PPTO: {comp.get('ppto_meta_hg', 'N/A')}, EXP: {comp.get('expediente', 'N/A')})"
+
+
 def _mostrar_tabla_comparativos(comparativos):
     """Muestra tabla resumen de comparativos encontrados."""
     table = Table(title="COMPARATIVOS ENCONTRADOS", show_lines=True)
@@ -206,20 +441,31 @@ def _mostrar_tabla_seguimiento(seguimiento):
     console.print(table)
 
 
-def _guardar_reporte(comparativos, seguimiento, mi_email):
-    """Guarda los resultados en archivos de reporte."""
+def _guardar_reporte(comparativos, seguimiento, mi_email, error=None):
+    """
+    Guarda los resultados en archivos de reporte.
+
+    Si el plazo dejo trabajo sin hacer, el reporte se marca como parcial
+    ("parcial" y "omitido_por_plazo"); tambien si la busqueda se corto por
+    un error (se anota en "error"). Los archivos se escriben en un .tmp y
+    se reemplazan al final: nunca queda un reporte a medio escribir.
+    """
     os.makedirs(REPORT_DIR, exist_ok=True)
+    omitidos = plazo.omitidos()
 
     # Reporte JSON
     data = {
         "fecha_ejecucion": datetime.now(PERU_TZ).isoformat(),
         "usuario": mi_email,
         "total_comparativos": len(comparativos),
+        "parcial": bool(omitidos) or error is not None,
+        "omitido_por_plazo": omitidos,
+        "error": str(error) if error is not None else None,
         "comparativos": [],
     }
 
     for comp in comparativos:
-        seg_item = next((s for s in seguimiento if s["id"] == comp["id"]), {}) if seguimiento else {}
+        seg_item = next((s for s in seguimiento if s and s["id"] == comp["id"]), {}) if seguimiento else {}
 
         data["comparativos"].append({
             "id": comp["id"],
@@ -244,15 +490,21 @@ def _guardar_reporte(comparativos, seguimiento, mi_email):
             },
         })
 
-    with open(REPORT_JSON, "w", encoding="utf-8") as f:
+    with open(REPORT_JSON + ".tmp", "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(REPORT_JSON + ".tmp", REPORT_JSON)
 
     # Reporte texto
-    with open(REPORT_FILE, "w", encoding="utf-8") as f:
+    with open(REPORT_FILE + ".tmp", "w", encoding="utf-8") as f:
         f.write("=" * 70 + "\n")
         f.write("REPORTE DE COMPARATIVOS - GMAIL\n")
         f.write(f"Fecha: {datetime.now(PERU_TZ).strftime('%d/%m/%Y %H:%M')}\n")
         f.write(f"Usuario: {mi_email}\n")
+        if omitidos:
+            f.write("REPORTE PARCIAL (plazo agotado), omitido: "
+                    + ", ".join(f"{n} {que}" for que, n in omitidos.items()) + "\n")
+        if error is not None:
+            f.write(f"REPORTE PARCIAL (error en la busqueda): {error}\n")
         f.write("=" * 70 + "\n\n")
 
         for i, comp in enumerate(data["comparativos"], 1):
@@ -273,6 +525,7 @@ def _guardar_reporte(comparativos, seguimiento, mi_email):
             f.write(f"    - {USUARIO_NOMBRE} respondio: {'SI' if seg['yo_respondi'] else 'NO'}\n")
             f.write(f"    - Total mensajes en hilo:   {seg['total_mensajes_hilo']}\n")
             f.write("\n")
+    os.replace(REPORT_FILE + ".tmp", REPORT_FILE)
 
     console.print(f"\n[dim]Reportes guardados en:[/dim]")
     console.print(f"  [dim]JSON: {REPORT_JSON}[/dim]")
@@ -0,0 +1,172 @@
+"""
+Planificador de etapas por dependencias (DAG) para main.py.
+
+Cada tarea tiene un nombre, una funcion sin argumentos, una etapa (para los
+tiempos) y las tareas de las que depende. Una tarea se lanza apenas terminan
+sus dependencias, asi etapas independientes (extraccion de Drive y
+seguimiento) avanzan en paralelo por comparativo.
+
+Al terminar se calcula la ruta critica: la cadena de tareas (por dependencia
+o por espera de un worker libre) que determina el tiempo total. El resumen muestra cuanto aporta cada etapa a esa
+ruta y su tiempo acumulado (suma de todas sus tareas).
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class _Tarea:
+    def __init__(self, nombre, funcion, etapa, depende_de):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.etapa = etapa
+        self.depende_de = list(depende_de)
+        self.inicio = None
+        self.fin = None
+        self.resultado = None
+        self.error = None
+
+    @property
+    def duracion(self):
+        return (self.fin or 0) - (self.inicio or 0)
+
+
+class Planificador:
+    """Ejecuta tareas respetando dependencias, con un pool de hilos acotado."""
+
+    def __init__(self, workers=1):
+        """
+        Args:
+            workers: tareas simultaneas. Con 1 se ejecutan en el hilo actual,
+                en el orden en que se agregaron.
+        """
+        self.workers = max(1, workers)
+        self._tareas = {}
+        self._t0 = None
+        self._t_fin = None
+
+    def agregar(self, nombre, funcion, etapa, depende_de=()):
+        """
+        Agrega una tarea. Las dependencias deben haberse agregado antes.
+        Una tarea se ejecuta aunque alguna dependencia haya fallado
+        (revisar el error con error(nombre) si importa).
+        """
+        if nombre in self._tareas:
+            raise ValueError(f"Tarea duplicada: {nombre}")
+        for dep in depende_de:
+            if dep not in self._tareas:
+                raise ValueError(f"Dependencia desconocida para {nombre}: {dep}")
+        self._tareas[nombre] = _Tarea(nombre, funcion, etapa, depende_de)
+
+    def resultado(self, nombre):
+        return self._tareas[nombre].resultado
+
+    def error(self, nombre):
+        return self._tareas[nombre].error
+
+    def ejecutar(self, al_terminar=None):
+        """
+        Ejecuta todas las tareas y espera a que terminen.
+
+        Args:
+            al_terminar: funcion(nombre, resultado, error) llamada en el hilo
+                actual cada vez que termina una tarea (para progreso en consola).
+        """
+        self._t0 = time.monotonic()
+        if self.workers == 1:
+            for tarea in self._tareas.values():
+                self._correr(tarea)
+                if al_terminar:
+                    al_terminar(tarea.nombre, tarea.resultado, tarea.error)
+        else:
+            self._ejecutar_pool(al_terminar)
+        self._t_fin = time.monotonic()
+
+    def _ejecutar_pool(self, al_terminar):
+        pendientes = {n: set(t.depende_de) for n, t in self._tareas.items()}
+        dependientes = {n: [] for n in self._tareas}
+        for nombre, tarea in self._tareas.items():
+            for dep in tarea.depende_de:
+                dependientes[dep].append(nombre)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            en_curso = {}
+
+            def _lanzar(nombre):
+                del pendientes[nombre]
+                en_curso[pool.submit(self._correr, self._tareas[nombre])] = nombre
+
+            for nombre in [n for n, deps in pendientes.items() if not deps]:
+                _lanzar(nombre)
+
+            while en_curso:
+                listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    nombre = en_curso.pop(futuro)
+                    tarea = self._tareas[nombre]
+                    if al_terminar:
+                        al_terminar(nombre, tarea.resultado, tarea.error)
+                    for siguiente in dependientes[nombre]:
+                        pendientes[siguiente].discard(nombre)
+                        if not pendientes[siguiente]:
+                            _lanzar(siguiente)
+
+    def _correr(self, tarea):
+        tarea.inicio = time.monotonic()
+        try:
+            tarea.resultado = tarea.funcion()
+        except Exception as e:
+            tarea.error = e
+        finally:
+            tarea.fin = time.monotonic()
+
+    def ruta_critica(self):
+        """
+        Cadena de tareas que determina el tiempo total. Desde la ultima en
+        terminar se retrocede a la tarea que la "desbloqueo": la que termino
+        mas tarde antes de que empezara (una dependencia, o la que libero el
+        worker si estuvo esperando en la cola).
+        """
+        terminadas = [t for t in self._tareas.values() if t.fin is not None]
+        if not terminadas:
+            return []
+        ruta = []
+        tarea = max(terminadas, key=lambda t: t.fin)
+        while tarea is not None:
+            ruta.append(tarea)
+            previas = [t for t in terminadas if t is not tarea and t.fin <= tarea.inicio]
+            tarea = max(previas, key=lambda t: t.fin) if previas else None
+        ruta.reverse()
+        return ruta
+
+    def resumen(self):
+        """Lineas de texto con la ruta critica y los tiempos por etapa (para logs)."""
+        if self._t0 is None or self._t_fin is None:
+            return []
+        ruta = self.ruta_critica()
+        lineas = [f"Tiempo total: {self._t_fin - self._t0:.1f}s ({len(self._tareas)} tareas, {self.workers} workers)"]
+        if ruta:
+            pasos = [f"{t.nombre} ({t.duracion:.1f}s)" for t in ruta]
+            if len(pasos) > 6:
+                pasos = pasos[:3] + [f"... {len(pasos) - 6} tareas ..."] + pasos[-3:]
+            lineas.append("Ruta critica: " + " -> ".join(pasos))
+
+        etapas = {}
+        for tarea in self._tareas.values():
+            if tarea.fin is None:
+                continue
+            e = etapas.setdefault(tarea.etapa, {"tareas": 0, "acumulado": 0.0, "critico": 0.0,
+                                                "inicio": tarea.inicio, "fin": tarea.fin})
+            e["tareas"] += 1
+            e["acumulado"] += tarea.duracion
+            e["inicio"] = min(e["inicio"], tarea.inicio)
+            e["fin"] = max(e["fin"], tarea.fin)
+        for tarea in ruta:
+            etapas[tarea.etapa]["critico"] += tarea.duracion
+
+        for etapa, e in etapas.items():
+            lineas.append(
+                f"  {etapa}: {e['tareas']} tareas, {e['critico']:.1f}s en ruta critica, "
+                f"{e['acumulado']:.1f}s acumulado, "
+                f"ventana {e['inicio'] - self._t0:.1f}s-{e['fin'] - self._t0:.1f}s"
+            )
+        return lineas
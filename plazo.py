@@ -0,0 +1,102 @@
+"""
+Plazo de ejecucion (--deadline) para no pasar la ventana del workflow.
+
+Si main.py supera timeout-minutes de GitHub Actions se corta sin guardar
+nada. Con un plazo:
+- Cada llamada HTTP usa como timeout lo que quede de plazo (si es menos
+  que el normal) y los reintentos no esperan mas alla del plazo.
+- En la reserva opcional (PLAZO_RESERVA_OPCIONAL segundos antes del fin)
+  la extraccion deja de empezar trabajo opcional: carpetas de Drive y
+  adjuntos de otros mensajes del hilo.
+- En la reserva final (PLAZO_RESERVA_GUARDAR) no se empiezan tareas
+  nuevas: se pasa a guardar caches y el reporte (marcado como parcial).
+
+Sin plazo (plazo.iniciar(None)) todo funciona como siempre.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from config import PLAZO_RESERVA_OPCIONAL, PLAZO_RESERVA_GUARDAR
+
+
+class PlazoAgotado(Exception):
+    """No queda tiempo para empezar la tarea."""
+
+
+class Plazo:
+    """Tiempo restante de la ejecucion y consumo por etapa (seguro entre hilos)."""
+
+    def __init__(self):
+        self.segundos = None
+        self._inicio = time.monotonic()
+        self._lock = threading.Lock()
+        self._etapas = {}
+        self._omitidos = {}
+
+    def iniciar(self, segundos):
+        """Empieza a contar el plazo (None = sin plazo)."""
+        self.segundos = segundos
+        self._inicio = time.monotonic()
+
+    def restante(self):
+        """Segundos que quedan (None sin plazo)."""
+        if self.segundos is None:
+            return None
+        return self.segundos - (time.monotonic() - self._inicio)
+
+    def timeout(self, normal):
+        """Timeout para una llamada: el normal, o lo que queda del plazo si es menos (minimo 1s)."""
+        restante = self.restante()
+        if restante is None:
+            return normal
+        return max(1.0, min(normal, restante))
+
+    def en_reserva(self):
+        """True si ya no conviene empezar trabajo opcional."""
+        restante = self.restante()
+        return restante is not None and restante < PLAZO_RESERVA_OPCIONAL
+
+    def agotado(self):
+        """True si solo queda tiempo para guardar (no empezar tareas nuevas)."""
+        restante = self.restante()
+        return restante is not None and restante < PLAZO_RESERVA_GUARDAR
+
+    def omitir(self, que, cantidad=1):
+        """Registra trabajo no realizado por el plazo (para el resumen y el reporte parcial)."""
+        with self._lock:
+            self._omitidos[que] = self._omitidos.get(que, 0) + cantidad
+
+    def omitidos(self):
+        with self._lock:
+            return dict(self._omitidos)
+
+    @contextmanager
+    def etapa(self, nombre):
+        """Mide el tiempo de una etapa de main.py."""
+        inicio = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._etapas[nombre] = self._etapas.get(nombre, 0.0) + time.monotonic() - inicio
+
+    def resumen(self):
+        """Lineas de texto con el consumo del plazo por etapa y lo omitido."""
+        usado = time.monotonic() - self._inicio
+        if self.segundos is None:
+            lineas = [f"Tiempo total: {usado:.0f}s (sin plazo)"]
+        else:
+            lineas = [f"Plazo: {usado:.0f}s de {self.segundos:.0f}s ({100 * usado / self.segundos:.0f}%)"]
+        for nombre, segundos in self._etapas.items():
+            if self.segundos is None:
+                lineas.append(f"  {nombre}: {segundos:.1f}s")
+            else:
+                lineas.append(f"  {nombre}: {segundos:.1f}s ({100 * segundos / self.segundos:.0f}% del plazo)")
+        omitidos = self.omitidos()
+        if omitidos:
+            lineas.append("  Omitido por plazo: " + ", ".join(f"{n} {que}" for que, n in omitidos.items()))
+        return lineas
+
+
+plazo = Plazo()
@@ -0,0 +1,201 @@
+"""
+Reintentos y peticiones duplicadas (hedging) para las llamadas a Google APIs.
+
+Se aplican en cuota_api.PeticionConCuota, alrededor del control de cuota
+(cada intento vuelve a pedir cuota):
+
+- PoliticaReintentos: reintenta errores transitorios (429, 403 por rate
+  limit, 5xx, timeouts y errores de conexion) con backoff exponencial y
+  jitter completo, respetando Retry-After. Un presupuesto global limita
+  los reintentos a una fraccion de las peticiones (si la API esta caida no
+  se multiplica la carga). Solo se reintentan peticiones idempotentes:
+  nunca messages.send. No se espera mas alla del plazo de la ejecucion.
+- CoberturaLatencia: para descargas (attachments.get, files.get_media) si
+  la peticion tarda mas que el p95 de las anteriores del mismo tipo, se
+  lanza una copia y se usa la que responda primero.
+"""
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from config import (
+    REINTENTOS_MAX, REINTENTO_BASE_SEG, REINTENTO_TOPE_SEG,
+    PRESUPUESTO_REINTENTOS, PRESUPUESTO_REINTENTOS_MINIMO,
+    COBERTURA_PERCENTIL, COBERTURA_MIN_MUESTRAS,
+)
+from plazo import plazo
+
+# Metodos que nunca se reintentan ni duplican (no son idempotentes)
+NO_REINTENTAR = {"gmail.users.messages.send"}
+# Metodos GET que se pueden duplicar si tardan mas de lo normal (descargas)
+METODOS_CUBIERTOS = {"gmail.users.messages.attachments.get", "drive.files.get", "drive.files.export"}
+
+_STATUS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+def es_limite_de_cuota(error):
+    """True si el error es 429 o 403 por rateLimitExceeded / userRateLimitExceeded."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or (status == 403 and b"ateLimitExceeded" in (error.content or b""))
+
+
+def es_reintentable(error):
+    """Errores transitorios: cuota, 5xx, timeouts y fallas de conexion."""
+    if isinstance(error, HttpError):
+        return error.resp.status in _STATUS_REINTENTABLES or es_limite_de_cuota(error)
+    # socket.timeout, ConnectionError y las excepciones de requests son OSError
+    return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+
+class PoliticaReintentos:
+    """Backoff exponencial con jitter y presupuesto global de reintentos (seguro entre hilos)."""
+
+    def __init__(self, intentos=REINTENTOS_MAX, base=REINTENTO_BASE_SEG, tope=REINTENTO_TOPE_SEG,
+                 presupuesto=PRESUPUESTO_REINTENTOS, minimo=PRESUPUESTO_REINTENTOS_MINIMO):
+        """
+        Args:
+            intentos: intentos maximos por peticion (1 = sin reintentos).
+            base, tope: la espera antes del intento n es uniforme en [0, min(tope, base * 2^n)].
+            presupuesto: reintentos permitidos como fraccion de las peticiones...
+            minimo: ...mas este minimo fijo (para las primeras peticiones).
+        """
+        self.intentos = max(1, intentos)
+        self.base = base
+        self.tope = tope
+        self.presupuesto = presupuesto
+        self.minimo = minimo
+        self._lock = threading.Lock()
+        self.peticiones = 0
+        self.reintentos = 0
+        self.sin_presupuesto = 0
+
+    def ejecutar(self, funcion, idempotente=True):
+        with self._lock:
+            self.peticiones += 1
+        intento = 0
+        while True:
+            try:
+                return funcion()
+            except Exception as e:
+                intento += 1
+                if not idempotente or not self.reintentar(intento, e):
+                    raise
+
+    def reintentar(self, intento, error, cantidad=1):
+        """
+        Decide el reintento numero `intento` (1 = el primero) despues de `error`
+        y, si corresponde, espera el backoff antes de retornar.
+
+        Args:
+            cantidad: peticiones que se reintentan juntas (p.ej. las partes
+                fallidas de un batch); se descuentan todas del presupuesto.
+
+        Retorna False si no se reintenta: error no transitorio, intentos o
+        presupuesto agotados, o la espera pasaria el plazo de la ejecucion.
+        """
+        if intento >= self.intentos or not es_reintentable(error):
+            return False
+        espera = self._espera(intento, error)
+        restante = plazo.restante()
+        if restante is not None and espera >= restante:
+            return False
+        if not self._gastar_presupuesto(cantidad):
+            return False
+        time.sleep(espera)
+        return True
+
+    def _gastar_presupuesto(self, cantidad=1):
+        with self._lock:
+            if self.reintentos + cantidad > self.minimo + self.presupuesto * self.peticiones:
+                self.sin_presupuesto += cantidad
+                return False
+            self.reintentos += cantidad
+            return True
+
+    def _espera(self, intento, error):
+        espera = random.uniform(0, min(self.tope, self.base * (2 ** intento)))
+        if isinstance(error, HttpError):
+            try:
+                espera = max(espera, min(self.tope, float(error.resp.get("retry-after", 0))))
+            except ValueError:
+                pass
+        return espera
+
+    def resumen(self):
+        return (f"reintentos: {self.reintentos} de {self.peticiones} peticiones, "
+                f"{self.sin_presupuesto} sin presupuesto")
+
+
+class CoberturaLatencia:
+    """Duplica una peticion lenta (mas que el percentil de su tipo) y usa la primera respuesta."""
+
+    def __init__(self, percentil=COBERTURA_PERCENTIL, min_muestras=COBERTURA_MIN_MUESTRAS, ventana=200):
+        self.percentil = percentil
+        self.min_muestras = min_muestras
+        self._latencias = {}
+        self._ventana = ventana
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="cobertura")
+        self.duplicadas = 0
+        self.ganadas = 0
+
+    def umbral(self, clave):
+        """Latencia del percentil para la clave, o None si aun no hay suficientes muestras."""
+        with self._lock:
+            muestras = sorted(self._latencias.get(clave, ()))
+        if len(muestras) < self.min_muestras:
+            return None
+        return muestras[int(self.percentil / 100 * (len(muestras) - 1))]
+
+    def _medir(self, clave, funcion):
+        inicio = time.monotonic()
+        resultado = funcion()
+        with self._lock:
+            self._latencias.setdefault(clave, deque(maxlen=self._ventana)).append(time.monotonic() - inicio)
+        return resultado
+
+    def ejecutar(self, clave, funcion):
+        """
+        Args:
+            clave: tipo de peticion (las latencias se comparan entre iguales).
+            funcion: hace la peticion; debe poder ejecutarse dos veces a la vez.
+        """
+        umbral = self.umbral(clave)
+        if umbral is None:
+            return self._medir(clave, funcion)
+
+        # Cada copia corre con el contexto del hilo que la pide (carril de cuota_api)
+        primera = self._pool.submit(contextvars.copy_context().run, self._medir, clave, funcion)
+        listas, _ = wait([primera], timeout=umbral)
+        if listas:
+            return primera.result()
+
+        with self._lock:
+            self.duplicadas += 1
+        segunda = self._pool.submit(contextvars.copy_context().run, self._medir, clave, funcion)
+        pendientes = {primera, segunda}
+        while pendientes:
+            listas, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listas:
+                if futuro.exception() is None:
+                    if futuro is segunda:
+                        with self._lock:
+                            self.ganadas += 1
+                    return futuro.result()
+        # Fallaron las dos: el error de la original
+        return primera.result()
+
+    def resumen(self):
+        return f"peticiones duplicadas por latencia: {self.duplicadas} ({self.ganadas} respondieron primero)"
+
+
+politica = PoliticaReintentos()
+cobertura = CoberturaLatencia()
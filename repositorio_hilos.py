@@ -0,0 +1,105 @@
+"""
+Repositorio de hilos (threads) de Gmail compartido entre etapas.
+
+drive_reader (links de Drive / adjuntos del hilo) y agente_seguimiento
+(quien respondio) necesitan el mismo hilo completo. main.py crea un solo
+RepositorioHilos y se lo pasa a ambas etapas: cada hilo se descarga una
+sola vez por ejecucion.
+
+Opcionalmente persiste los hilos en el almacen local (AlmacenHilos),
+validados por historyId: en la siguiente ejecucion solo se consulta el
+historyId actual (format=minimal) y, si no cambio, se reutiliza el hilo.
+
+Quien solo necesita headers + snippet (seguimiento) pide format="metadata":
+si el hilo completo ya esta en memoria se reutiliza; si no, se descarga
+solo la metadata (sin cuerpos ni adjuntos).
+"""
+import threading
+
+# Headers y campos que se piden en format=metadata
+HEADERS_METADATA = ["From", "Date", "Subject"]
+FIELDS_METADATA = "id,historyId,messages(id,threadId,snippet,payload/headers)"
+
+
+class RepositorioHilos:
+    """Cache de threads.get(format=full) por thread id (seguro entre hilos)."""
+
+    def __init__(self, almacen=None):
+        """
+        Args:
+            almacen: AlmacenHilos opcional para persistir hilos entre ejecuciones.
+        """
+        self._almacen = almacen
+        self._hilos = {}
+        self._metadatos = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.descargas = 0
+        self.descargas_metadata = 0
+        self.reutilizados = 0
+
+    def obtener(self, service, thread_id, formato="full"):
+        """
+        Retorna el hilo (format=full o format=metadata). No modificar el dict retornado.
+        Un hilo "metadata" solo trae headers From/Date/Subject y snippet de cada mensaje.
+        """
+        with self._lock:
+            lock_hilo = self._locks.setdefault(thread_id, threading.Lock())
+
+        # Lock por hilo: si dos etapas piden el mismo hilo a la vez, se descarga una vez
+        with lock_hilo:
+            hilo = self._hilos.get(thread_id)
+            if hilo is None and formato == "metadata":
+                hilo = self._metadatos.get(thread_id)
+            if hilo is not None:
+                self._contar("reutilizados")
+                return hilo
+
+            if formato == "metadata":
+                hilo = service.users().threads().get(
+                    userId="me", id=thread_id, format="metadata",
+                    metadataHeaders=HEADERS_METADATA, fields=FIELDS_METADATA,
+                ).execute()
+                self._contar("descargas_metadata")
+                self._metadatos[thread_id] = hilo
+                return hilo
+
+            hilo = self._leer_persistido(service, thread_id)
+            if hilo is None:
+                hilo = service.users().threads().get(
+                    userId="me", id=thread_id, format="full"
+                ).execute()
+                self._contar("descargas")
+                if self._almacen:
+                    self._almacen.guardar(thread_id, hilo)
+            else:
+                self._contar("reutilizados")
+
+            self._hilos[thread_id] = hilo
+            return hilo
+
+    def _contar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    def _leer_persistido(self, service, thread_id):
+        """Busca el hilo en el almacen; solo es valido si su historyId no cambio."""
+        if not self._almacen:
+            return None
+        registro = self._almacen.obtener(thread_id)
+        if registro is None:
+            return None
+        actual = service.users().threads().get(
+            userId="me", id=thread_id, format="minimal", fields="id,historyId"
+        ).execute()
+        if actual.get("historyId") != registro["history_id"]:
+            return None
+        return registro["hilo"]
+
+    def resumen(self):
+        """Texto corto para logs."""
+        texto = (f"hilos: {self.descargas} descargados, {self.descargas_metadata} solo metadata, "
+                 f"{self.reutilizados} reutilizados")
+        if self._almacen:
+            texto += f" ({self._almacen.resumen()})"
+        return texto
@@ -0,0 +1,189 @@
+"""
+Descarga en batch de agente_busqueda contra un endpoint batch de Gmail falso.
+
+FakeGmailBatch implementa la interfaz http de googleapiclient (request())
+y responde el formato multipart/mixed real del endpoint /batch de Gmail:
+asi se prueba el BatchHttpRequest de verdad, sin red ni credenciales.
+"""
+import email
+import json
+import re
+
+import httplib2
+import pytest
+from googleapiclient.discovery import build
+
+import agente_busqueda
+from reintentos import PoliticaReintentos
+
+
+class FakeGmailBatch:
+    """Endpoint batch de Gmail en memoria: un mensaje por id, errores por id configurables."""
+
+    def __init__(self, errores=None):
+        """
+        Args:
+            errores: {message_id: [status, ...]} respuestas de error (en orden)
+                antes de responder el mensaje; 404 = el mensaje no existe.
+        """
+        self.errores = {k: list(v) for k, v in (errores or {}).items()}
+        self.batches = []
+        self.gets = []
+
+    def _mensaje(self, message_id):
+        return {"id": message_id, "threadId": "t" + message_id, "internalDate": "1700000000000",
+                "payload": {"headers": [{"name": "Subject", "value": f"Comparativo {message_id}"},
+                                        {"name": "From", "value": "Proveedor <p@x.com>"}]}}
+
+    def _responder(self, message_id):
+        pendientes = self.errores.get(message_id)
+        if pendientes:
+            status = pendientes.pop(0)
+            return status, {"error": {"code": status, "message": "fake"}}
+        return 200, self._mensaje(message_id)
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if not uri.endswith("/batch"):
+            message_id = re.search(r"/messages/([^?/]+)", uri).group(1)
+            self.gets.append(message_id)
+            status, datos = self._responder(message_id)
+            return httplib2.Response({"status": str(status), "content-type": "application/json"}), \
+                json.dumps(datos).encode()
+
+        peticion = email.message_from_string(f"content-type: {headers['content-type']}\r\n\r\n{body}")
+        partes = []
+        for parte in peticion.get_payload():
+            message_id = re.search(r"/messages/([^?/ ]+)", parte.get_payload()).group(1)
+            status, datos = self._responder(message_id)
+            contenido = json.dumps(datos)
+            partes.append(
+                "--frontera\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{parte['Content-ID'][1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(contenido)}\r\n\r\n{contenido}\r\n"
+            )
+        self.batches.append(len(partes))
+        cuerpo = "".join(partes) + "--frontera--\r\n"
+        return httplib2.Response({"status": "200", "content-type": "multipart/mixed; boundary=frontera"}), \
+            cuerpo.encode()
+
+
+def _servicio(fake):
+    return build("gmail", "v1", http=fake, static_discovery=True)
+
+
+def test_batch_devuelve_mensajes_en_orden():
+    fake = FakeGmailBatch()
+    ids = [f"m{i}" for i in range(7)]
+    mensajes = agente_busqueda._obtener_mensajes_batch(_servicio(fake), ids, batch_size=10)
+    assert [m["id"] for m in mensajes] == ids
+    assert fake.batches == [7]
+    assert fake.gets == []
+
+
+def test_batch_se_divide_en_gmail_batch_size():
+    fake = FakeGmailBatch()
+    ids = [f"m{i}" for i in range(agente_busqueda.GMAIL_BATCH_SIZE * 2 + 3)]
+    mensajes = agente_busqueda._obtener_mensajes_batch(_servicio(fake), ids)
+    assert len(mensajes) == len(ids)
+    assert fake.batches == [agente_busqueda.GMAIL_BATCH_SIZE, agente_busqueda.GMAIL_BATCH_SIZE, 3]
+
+
+def test_error_de_una_parte_no_afecta_al_resto(capsys):
+    fake = FakeGmailBatch(errores={"m2": [404]})
+    mensajes = agente_busqueda._obtener_mensajes_batch(_servicio(fake), ["m1", "m2", "m3"], batch_size=10)
+    assert [m["id"] for m in mensajes] == ["m1", "m3"]
+    assert "m2" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("batch_size", [1, 50])
+def test_modo_serial_y_batch_dan_lo_mismo(batch_size):
+    fake = FakeGmailBatch()
+    ids = ["a", "b", "c"]
+    mensajes = agente_busqueda._descargar_mensajes(_servicio(fake), ids, batch_size, formato="metadata")
+    assert [agente_busqueda._metadata_de_mensaje(m)["asunto"] for m in mensajes] == \
+        ["Comparativo a", "Comparativo b", "Comparativo c"]
+
+
+class _ControlFalso:
+    def __init__(self):
+        self.limites = []
+
+    def registrar_limite(self, method_id):
+        self.limites.append(method_id)
+
+
+@pytest.fixture
+def sin_espera(monkeypatch):
+    """Politica de reintentos sin backoff y registro de limites/perdidos aislado."""
+    control = _ControlFalso()
+    monkeypatch.setattr(agente_busqueda, "politica", PoliticaReintentos(intentos=3, base=0, tope=0))
+    monkeypatch.setattr(agente_busqueda, "control", control)
+    monkeypatch.setattr(agente_busqueda, "_perdidos", {})
+    return control
+
+
+def test_parte_con_error_transitorio_se_reintenta_en_otro_batch(sin_espera):
+    fake = FakeGmailBatch(errores={"m2": [503], "m3": [429]})
+    mensajes = agente_busqueda._obtener_mensajes_batch(_servicio(fake), ["m1", "m2", "m3"], batch_size=10)
+    assert [m["id"] for m in mensajes] == ["m1", "m2", "m3"]
+    assert fake.batches == [3, 2]
+    assert sin_espera.limites == ["gmail.users.messages.get"]
+    assert agente_busqueda.mensajes_perdidos() == {}
+
+
+def test_parte_que_sigue_fallando_queda_como_perdida(sin_espera):
+    fake = FakeGmailBatch(errores={"m1": [503] * 5, "m2": [404]})
+    mensajes = agente_busqueda._obtener_mensajes_batch(_servicio(fake), ["m1", "m2", "m3"], batch_size=10)
+    assert [m["id"] for m in mensajes] == ["m3"]
+    # 3 intentos para m1; el 404 no se reintenta
+    assert fake.batches == [3, 1, 1]
+    assert sorted(agente_busqueda.mensajes_perdidos()) == ["m1", "m2"]
+
+
+class _PlazoFalso:
+    """Se agota despues de `llamadas` consultas a agotado()."""
+
+    def __init__(self, llamadas):
+        self.llamadas = llamadas
+        self.omitido = {}
+
+    def agotado(self):
+        self.llamadas -= 1
+        return self.llamadas < 0
+
+    def omitir(self, que, cantidad=1):
+        self.omitido[que] = self.omitido.get(que, 0) + cantidad
+
+
+def test_completar_no_pide_mas_batches_con_el_plazo_agotado():
+    fake = FakeGmailBatch()
+    candidatos = [{"id": f"m{i}"} for i in range(5)]
+    plazo = _PlazoFalso(llamadas=1)
+    comparativos = agente_busqueda.completar_comparativos(_servicio(fake), candidatos, batch_size=2, plazo=plazo)
+    assert [c["id"] for c in comparativos] == ["m0", "m1"]
+    assert fake.batches == [2]
+    assert plazo.omitido == {"mensajes de Gmail": 3}
+
+
+def test_error_a_mitad_de_la_descarga_conserva_lo_recibido():
+    class FakeQueFalla(FakeGmailBatch):
+        def request(self, uri, **kwargs):
+            if len(self.batches) == 1:
+                raise ValueError("sin conexion")
+            return super().request(uri, **kwargs)
+
+    candidatos = [{"id": f"m{i}"} for i in range(4)]
+    with pytest.raises(ValueError):
+        agente_busqueda.completar_comparativos(_servicio(FakeQueFalla()), candidatos, batch_size=2)
+    assert [c["id"] for c in candidatos if "comparativo" in c] == ["m0", "m1"]
+
+
+def test_modo_serial_reintenta_y_registra_los_perdidos(sin_espera):
+    fake = FakeGmailBatch(errores={"m1": [503], "m2": [404], "m3": [403]})
+    servicio = _servicio(fake)
+    mensajes = list(agente_busqueda._descargar_mensajes(servicio, ["m0", "m1", "m2", "m3"], batch_size=1))
+    assert [m["id"] for m in mensajes] == ["m0", "m1"]
+    # m1: 503 y luego OK; el 404 y el 403 (sin rateLimitExceeded) no se reintentan
+    assert fake.gets == ["m0", "m1", "m1", "m2", "m3"]
+    assert sorted(agente_busqueda.mensajes_perdidos()) == ["m2", "m3"]
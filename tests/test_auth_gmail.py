@@ -0,0 +1,114 @@
+"""
+Arranque de los servicios de Google (auth_gmail._build_service): tiempo
+hasta la primera peticion por cada origen del documento discovery
+(incluido en google-api-python-client, cache en disco, red), con
+credenciales y transporte falsos. Con -s se imprimen los tiempos.
+"""
+import json
+import time
+
+import httplib2
+import pytest
+from googleapiclient import discovery_cache
+
+import auth_gmail
+import cuota_api
+
+APIS = [("gmail", "v1"), ("drive", "v3"), ("sheets", "v4")]
+
+
+def _primera_peticion(service, api):
+    """La primera llamada que hace main.py con cada servicio."""
+    if api == "gmail":
+        return service.users().getProfile(userId="me")
+    if api == "drive":
+        return service.files().get(fileId="x", fields="id")
+    return service.spreadsheets().get(spreadsheetId="x", fields="sheets.properties.title")
+
+
+class FakeHttp:
+    """Transporte falso: sirve el documento discovery (si se pide) y {} para el resto."""
+
+    def __init__(self, documentos):
+        self.documentos = documentos
+        self.discovery = []
+        self.peticiones = []
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if "$discovery" in uri:
+            self.discovery.append(uri)
+            api = uri.split("//")[1].split(".")[0]
+            return httplib2.Response({"status": "200"}), self.documentos[api].encode("utf-8")
+        self.peticiones.append(uri)
+        return httplib2.Response({"status": "200", "content-type": "application/json"}), b"{}"
+
+
+@pytest.fixture
+def arranque(monkeypatch, tmp_path):
+    """_build_service con credenciales/transporte falsos, cache de discovery en tmp y memo vacio."""
+    documentos = {api: discovery_cache.get_static_doc(api, version) for api, version in APIS}
+    http = FakeHttp(documentos)
+    monkeypatch.setattr(auth_gmail, "_obtener_credenciales", lambda: object())
+    monkeypatch.setattr(auth_gmail, "HTTP_POOL_SIZE", 1)
+    monkeypatch.setattr(auth_gmail, "_obtener_http_compartido", lambda creds: http)
+    monkeypatch.setattr(auth_gmail, "DISCOVERY_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(auth_gmail, "_documentos", {})
+    # La primera peticion no espera al control de cuota del proceso
+    monkeypatch.setattr(cuota_api, "control", _SinCuota())
+    return http
+
+
+class _SinCuota:
+    def ejecutar(self, method_id, funcion, unidades=None):
+        return funcion()
+
+
+def _medir(http, api, version):
+    """(construccion, hasta la respuesta de la primera peticion) en segundos."""
+    inicio = time.perf_counter()
+    service = auth_gmail._build_service(api, version)
+    construido = time.perf_counter() - inicio
+    _primera_peticion(service, api).execute()
+    return construido, time.perf_counter() - inicio
+
+
+def test_documentos_de_gmail_drive_y_sheets_vienen_con_la_libreria(arranque, monkeypatch):
+    # Con los tres documentos incluidos, la cache en disco y la red nunca se usan
+    leidos_en_disco = []
+    monkeypatch.setattr(auth_gmail, "_leer_discovery_en_disco",
+                        lambda api, version: leidos_en_disco.append(api))
+    for api, version in APIS:
+        assert discovery_cache.get_static_doc(api, version) is not None
+        _medir(arranque, api, version)
+    assert leidos_en_disco == []
+    assert arranque.discovery == []
+    assert len(arranque.peticiones) == len(APIS)
+
+
+def test_benchmark_arranque_por_origen_del_discovery(arranque, monkeypatch, tmp_path):
+    tiempos = {}
+    for api, version in APIS:
+        # 1. Documento incluido en la libreria (lo que pasa hoy con estas tres APIs)
+        tiempos[(api, "incluido")] = _medir(arranque, api, version)
+        # 2. Mismo proceso, documento ya memorizado (servicios por hilo de los workers)
+        tiempos[(api, "memorizado")] = _medir(arranque, api, version)
+
+    monkeypatch.setattr(discovery_cache, "get_static_doc", lambda api, version: None)
+    for api, version in APIS:
+        # 3. Sin documento incluido ni en disco: red (y se guarda en DISCOVERY_CACHE_DIR)
+        auth_gmail._documentos.clear()
+        tiempos[(api, "red")] = _medir(arranque, api, version)
+        # 4. Proceso nuevo con el documento en disco
+        auth_gmail._documentos.clear()
+        tiempos[(api, "disco")] = _medir(arranque, api, version)
+
+    for api, _version in APIS:
+        print(f"\n[BENCH] {api} (build / primera respuesta): " + ", ".join(
+            f"{origen} {tiempos[(api, origen)][0] * 1000:.1f}/{tiempos[(api, origen)][1] * 1000:.1f} ms"
+            for origen in ("incluido", "memorizado", "disco", "red")))
+
+    assert len(arranque.discovery) == len(APIS)
+    for api, version in APIS:
+        with open(tmp_path / f"{api}.{version}.json", encoding="utf-8") as f:
+            assert json.load(f)["libreria"] == auth_gmail.VERSION_GOOGLEAPICLIENT
+    assert len(arranque.peticiones) == 4 * len(APIS)
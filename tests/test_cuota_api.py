@@ -0,0 +1,157 @@
+"""
+ControlCuota con reloj falso: token bucket, concurrencia AIMD ante 429 /
+403 rateLimitExceeded y carriles de prioridad.
+"""
+import threading
+import time
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from cuota_api import ControlCuota, carril
+
+
+class RelojFalso:
+    """Reloj que solo avanza cuando alguien espera (ver CondicionFalsa)."""
+
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self):
+        return self.ahora
+
+
+class CondicionFalsa:
+    """Condition cuyo wait(t) avanza el reloj falso t segundos en lugar de dormir."""
+
+    def __init__(self, reloj):
+        self._cond = threading.Condition()
+        self._reloj = reloj
+        self.esperado = 0.0
+
+    def __enter__(self):
+        return self._cond.__enter__()
+
+    def __exit__(self, *exc):
+        return self._cond.__exit__(*exc)
+
+    def notify_all(self):
+        self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        assert timeout is not None, "esperaria para siempre (sin otro hilo que libere)"
+        self._reloj.ahora += timeout
+        self.esperado += timeout
+
+
+def _control(cuotas):
+    # Tasas potencia de 2 en las pruebas: las esperas (1 / tasa) son exactas en float
+    reloj = RelojFalso()
+    control = ControlCuota(cuotas, reloj=reloj)
+    control._cond = CondicionFalsa(reloj)
+    return control, reloj
+
+
+def _limitado(status=429, contenido=b""):
+    def _funcion():
+        raise HttpError(httplib2.Response({"status": status}), contenido)
+    return _funcion
+
+
+def test_token_bucket_cobra_por_metodo_y_espera_la_recarga():
+    control, reloj = _control({"gmail": (10, 10, 5)})
+    estado = control._apis["gmail"]
+    # messages.get = 5 unidades: la rafaga de 10 alcanza para dos
+    control.ejecutar("gmail.users.messages.get", lambda: None)
+    control.ejecutar("gmail.users.messages.get", lambda: None)
+    assert estado.tokens == 0
+    assert reloj.ahora == 0
+
+    # threads.get = 10 unidades: espera 1 s de recarga (10 unidades/s)
+    control.ejecutar("gmail.users.threads.get", lambda: None)
+    assert reloj.ahora == pytest.approx(1.0)
+    assert estado.segundos_espera == pytest.approx(1.0)
+
+    # Sin uso, la recarga no pasa de la rafaga
+    reloj.ahora += 100
+    control.ejecutar("gmail.users.messages.get", lambda: None)
+    assert estado.tokens == pytest.approx(5.0)
+
+
+def test_apis_sin_cuota_pasan_sin_control():
+    control, reloj = _control({"gmail": (1, 1, 1)})
+    assert control.ejecutar("sheets.spreadsheets.get", lambda: "ok") == "ok"
+    assert control.resumen() == []
+
+
+def test_aimd_baja_con_429_y_se_recupera():
+    control, reloj = _control({"drive": (1024, 1024, 8)})
+    estado = control._apis["drive"]
+
+    for esperado in (4, 2, 1, 1):
+        with pytest.raises(HttpError):
+            control.ejecutar("drive.files.get", _limitado(429))
+        assert int(estado.limite) == esperado
+    assert estado.limitadas == 4
+    assert estado.limite_minimo == 1
+    # El bucket se vacia con cada 429: la siguiente peticion espera la recarga
+    esperado_antes = control._cond.esperado
+    control.ejecutar("drive.files.get", lambda: None)
+    assert control._cond.esperado > esperado_antes
+
+    # Incremento aditivo: ~limite respuestas correctas por cada +1
+    correctas = 1
+    while estado.limite < 8:
+        control.ejecutar("drive.files.get", lambda: None)
+        correctas += 1
+    assert 20 <= correctas <= 40
+    assert "concurrencia 8/8 (minima 1)" in control.resumen()[0]
+
+
+def test_403_rate_limit_cuenta_como_limite_pero_otros_403_no():
+    control, _reloj = _control({"drive": (1024, 1024, 8)})
+    estado = control._apis["drive"]
+    with pytest.raises(HttpError):
+        control.ejecutar("drive.files.get", _limitado(403, b'{"reason": "userRateLimitExceeded"}'))
+    assert int(estado.limite) == 4
+    with pytest.raises(HttpError):
+        control.ejecutar("drive.files.get", _limitado(403, b'{"reason": "insufficientPermissions"}'))
+    assert estado.limitadas == 1
+
+
+def test_concurrencia_limitada_y_seguimiento_pasa_antes_que_extraccion():
+    # Reloj real: hilos que esperan de verdad (con limite 1 solo pasa uno a la vez)
+    control = ControlCuota({"gmail": (1000, 1000, 1)})
+    estado = control._apis["gmail"]
+    liberar = threading.Event()
+    orden = []
+
+    def _ocupar():
+        control.ejecutar("gmail.users.messages.get", liberar.wait)
+
+    def _pedir(nombre):
+        with carril(nombre):
+            control.ejecutar("gmail.users.messages.get", lambda: orden.append(nombre))
+
+    ocupante = threading.Thread(target=_ocupar)
+    ocupante.start()
+    _esperar(lambda: estado.en_curso == 1)
+    hilos = []
+    for nombre in ("extraccion", "normal", "seguimiento"):
+        hilo = threading.Thread(target=_pedir, args=(nombre,))
+        hilo.start()
+        hilos.append(hilo)
+        _esperar(lambda n=len(hilos): len(estado.espera) == n)
+
+    liberar.set()
+    for hilo in [ocupante] + hilos:
+        hilo.join(5)
+    assert orden == ["seguimiento", "normal", "extraccion"]
+
+
+def _esperar(condicion, limite=5.0):
+    fin = time.monotonic() + limite
+    while not condicion():
+        assert time.monotonic() < fin
+        time.sleep(0.005)
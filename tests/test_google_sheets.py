@@ -0,0 +1,146 @@
+"""
+Lectura de Google Sheets (drive_reader._leer_google_sheet) contra un servicio
+Sheets falso: llamadas por hoja, igualdad con la lectura completa y benchmark
+de bytes en una hoja de 2000 filas (con -s se imprimen).
+"""
+import json
+import random
+import re
+
+import pytest
+
+import drive_reader
+from hoja_vs import analizar_hoja_vs, grilla_desde_values
+
+
+def _columna(letras):
+    numero = 0
+    for letra in letras:
+        numero = numero * 26 + ord(letra) - 64
+    return numero
+
+
+class FakeSheets:
+    """spreadsheets().get / values().get / values().batchGet sobre pestañas en memoria."""
+
+    def __init__(self, pestanas, filas_grilla=None):
+        """
+        Args:
+            pestanas: {titulo: filas (listas de valores)}.
+            filas_grilla: rowCount que se informa (por defecto, las filas reales).
+        """
+        self.pestanas = pestanas
+        self.filas_grilla = filas_grilla
+        self.llamadas = 0
+        self.bytes = 0
+
+    def _rango(self, rango):
+        m = re.match(r"'(.*)'!([A-Z]+)(\d+):([A-Z]+)(\d+)$", rango)
+        filas = self.pestanas[m.group(1).replace("''", "'")][int(m.group(3)) - 1:int(m.group(5))]
+        filas = [list(f[_columna(m.group(2)) - 1:_columna(m.group(4))]) for f in filas]
+        # Como la API: sin celdas vacias al final de cada fila ni filas vacias al final
+        for fila in filas:
+            while fila and fila[-1] in ("", None):
+                fila.pop()
+        while filas and not filas[-1]:
+            filas.pop()
+        return {"values": filas} if filas else {}
+
+    def _responder(self, datos):
+        self.llamadas += 1
+        self.bytes += len(json.dumps(datos))
+        return _Peticion(datos)
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range=None, **_kwargs):
+        if range:
+            return self._responder(self._rango(range))
+        return self._responder({"sheets": [
+            {"properties": {"title": t, "gridProperties": {"rowCount": self.filas_grilla or len(v)}}}
+            for t, v in self.pestanas.items()
+        ]})
+
+    def batchGet(self, spreadsheetId, ranges, **_kwargs):
+        return self._responder({"valueRanges": [self._rango(r) for r in ranges]})
+
+
+class _Peticion:
+    def __init__(self, datos):
+        self.datos = datos
+
+    def execute(self):
+        return self.datos
+
+
+def _hoja_vs(filas, semilla):
+    """Pestaña VS con headers, partidas y COSTO DIRECTO / SUB TOTAL / IGV / TOTAL (CON IGV) al final."""
+    rnd = random.Random(semilla)
+    fila_header = rnd.randint(3, 9)
+    columnas = rnd.randint(15, 52)
+    ppto = rnd.randint(8, columnas - 4)
+    exp = rnd.choice([1, 2, 3])
+    v = [["" for _ in range(columnas)] for _ in range(filas)]
+    v[0][0] = "COMPARATIVO"
+    v[fila_header - 1][exp - 1] = "EXPEDIENTE"
+    v[fila_header - 1][ppto - 1] = "PPTO META HG"
+    v[fila_header][exp + 1] = "SUB TOTAL"
+    v[fila_header][ppto + 1] = "SUB TOTAL"
+    for r in range(fila_header + 1, filas - 6):
+        v[r][0] = f"item {r}"
+        for c in range(1, columnas):
+            if rnd.random() < 0.6:
+                v[r][c] = rnd.randint(0, 3000)
+    for k, etiqueta in enumerate(["COSTO DIRECTO", "SUB TOTAL", "IGV", "TOTAL (CON IGV)"]):
+        v[filas - 6 + k][0] = etiqueta
+        for c in range(1, columnas):
+            v[filas - 6 + k][c] = rnd.randint(100, 99999)
+    v[filas - 1][0] = "Nota: precios sin flete"
+    return v
+
+
+def _lectura_completa(filas):
+    """Referencia: toda la pestaña en un solo values.get (A1:AZ<ultima fila>)."""
+    fake = FakeSheets({"VS": filas})
+    respuesta = fake.get("id", range=f"'VS'!A1:AZ{len(filas)}").execute()
+    return analizar_hoja_vs(grilla_desde_values(respuesta.get("values", []))), fake.bytes
+
+
+@pytest.fixture(autouse=True)
+def _sin_layouts(monkeypatch):
+    monkeypatch.setattr(drive_reader, "_layouts_vs", None)
+
+
+def test_hoja_chica_con_rowcount_por_defecto_usa_dos_llamadas():
+    filas = _hoja_vs(120, 1)
+    fake = FakeSheets({"VS": filas}, filas_grilla=1000)
+    resultado = drive_reader._leer_google_sheet(fake, "id")
+    assert fake.llamadas == 2
+    assert resultado == _lectura_completa(filas)[0]
+    assert resultado["ppto_meta_hg"] != "No especificado"
+
+
+def test_benchmark_bytes_hoja_de_2000_filas():
+    filas = _hoja_vs(2000, 7)
+    fake = FakeSheets({"VS": filas})
+    resultado = drive_reader._leer_google_sheet(fake, "id")
+    completo, bytes_completo = _lectura_completa(filas)
+    print(f"\n[BENCH] hoja de 2000 filas: por partes {fake.bytes / 1024:.1f} KB en {fake.llamadas} llamadas, "
+          f"lectura completa {bytes_completo / 1024:.1f} KB")
+    assert resultado == completo
+    assert fake.llamadas == 4
+    assert fake.bytes * 3 < bytes_completo
+
+
+@pytest.mark.parametrize("semilla", range(60))
+def test_igual_a_la_lectura_completa(semilla):
+    rnd = random.Random(semilla)
+    filas = _hoja_vs(rnd.choice([40, 150, 199, 230, 800, 1500]), semilla)
+    # Filas vacias al final de la grilla (rowCount mayor que los datos)
+    filas += [[""] * len(filas[0]) for _ in range(rnd.choice([0, 300]))]
+    fake = FakeSheets({"VS": filas})
+    assert drive_reader._leer_google_sheet(fake, "id") == _lectura_completa(filas)[0]
@@ -0,0 +1,381 @@
+"""
+Motor de la hoja VS (hoja_vs) sobre libros de openpyxl generados.
+
+Benchmark de lectura en una hoja de 200x50: celdas leidas por el motor
+(una pasada con iter_rows) contra el escaneo anterior con ws.cell(), para
+TOTAL (CON IGV) al final, en la fila 30 y sin fila de total. Con -s se
+imprimen los conteos.
+
+Corpus dorado (tests/datos/hoja_vs): la misma hoja VS como .xlsx, como
+respuesta de spreadsheets.values y como CSV de files.export; los tres
+adaptadores deben dar el dict de esperado.json (y se mide el motor con cada uno).
+
+Layouts por huella (LayoutsVS): el atajo de una plantilla conocida debe dar
+lo mismo que la busqueda completa, y volver a ella si la hoja no lo cumple.
+"""
+import io
+import json
+import os
+import random
+import time
+
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet import _read_only
+
+import drive_reader
+from hoja_vs import (
+    LayoutsVS, analizar_hoja_vs, grilla_desde_openpyxl, grilla_desde_values, grilla_desde_csv,
+    ubicar_secciones, _analizar_completo,
+)
+
+FILAS = 200
+COLUMNAS = 50
+
+# Secciones de la plantilla: (columna del header, texto)
+SECCIONES = [(2, "EXPEDIENTE"), (8, "PROVEEDOR 1"), (14, "PROVEEDOR 2"), (20, "PROVEEDOR 3"), (40, "PPTO META HG")]
+FILA_HEADERS = 6
+ETIQUETAS_TOTAL = ["COSTO DIRECTO (SIN IGV)", "SUB TOTAL", "IGV", "TOTAL (CON IGV)"]
+
+
+def _libro_vs(fila_total, filas=FILAS, columnas=COLUMNAS, semilla=0):
+    """
+    Libro con una hoja VS de filas x columnas llena de partidas.
+
+    Args:
+        fila_total: fila de TOTAL (CON IGV) (el bloque de totales ocupa las 3
+            filas anteriores); None = hoja sin bloque de totales.
+    """
+    rnd = random.Random(semilla)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "VS"
+    ws.cell(row=1, column=1, value="CUADRO COMPARATIVO")
+    for col, texto in SECCIONES:
+        ws.cell(row=FILA_HEADERS, column=col, value=texto)
+        for offset, sub in enumerate(["V.U.", "SUB TOTAL", "OBS"]):
+            ws.cell(row=FILA_HEADERS + 1, column=col + offset, value=sub)
+
+    bloque = range(fila_total - 3, fila_total + 1) if fila_total else range(0)
+    for row in range(FILA_HEADERS + 2, filas + 1):
+        if row in bloque:
+            ws.cell(row=row, column=1, value=ETIQUETAS_TOTAL[row - bloque.start])
+        else:
+            ws.cell(row=row, column=1, value=f"Partida {row}")
+        for col in range(2, columnas + 1):
+            ws.cell(row=row, column=col, value=rnd.randint(100, 99999))
+    return wb
+
+
+def _xlsx(wb):
+    datos = io.BytesIO()
+    wb.save(datos)
+    return datos.getvalue()
+
+
+class HojaContada:
+    """Envuelve una hoja de openpyxl y cuenta celdas leidas y filas que recorreria en streaming."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.celdas = 0
+        # En modo read_only cada ws.cell(row=r) vuelve a parsear el XML de la fila 1 a la r
+        self.filas_streaming = 0
+
+    @property
+    def max_row(self):
+        return self.ws.max_row
+
+    @property
+    def max_column(self):
+        return self.ws.max_column
+
+    def cell(self, row, column):
+        self.celdas += 1
+        self.filas_streaming += row
+        return self.ws.cell(row=row, column=column)
+
+    def iter_rows(self, **kwargs):
+        for fila in self.ws.iter_rows(**kwargs):
+            self.celdas += len(fila)
+            self.filas_streaming += 1
+            yield fila
+
+
+def _escaneo_anterior(ws):
+    """
+    Lectura de la hoja VS anterior al motor (celda por celda con ws.cell y un
+    recorrido de abajo hacia arriba por seccion). Referencia del benchmark.
+    """
+    resultado = {"monto_cc": "No especificado", "ppto_meta_hg": "No especificado", "expediente": "No especificado"}
+    max_row = min(ws.max_row or 200, 200)
+    max_col = min(ws.max_column or 50, 50)
+
+    def _monto(val):
+        return val if val and isinstance(val, (int, float)) and val >= 100 else None
+
+    def _texto(row, col):
+        val = ws.cell(row=row, column=col).value
+        return val.strip().lower() if val and isinstance(val, str) else None
+
+    def _fila_total_igv(row):
+        for col in range(1, max_col + 1):
+            txt = _texto(row, col)
+            if txt and "total" in txt and "igv" in txt:
+                return True
+        return False
+
+    ppto_col = ppto_row = exp_col = None
+    for row in range(1, min(20, max_row + 1)):
+        for col in range(1, max_col + 1):
+            txt = _texto(row, col)
+            if txt and (("ppto" in txt and "meta" in txt) or "meta hg" in txt):
+                ppto_col, ppto_row = col, row
+            elif txt and "expediente" in txt:
+                exp_col = col
+    if not ppto_col:
+        return resultado
+    header_row = ppto_row
+
+    def _subtotal_col(inicio, fin):
+        for row in range(header_row, min(header_row + 5, max_row + 1)):
+            for col in range(inicio, min(fin, max_col + 1)):
+                txt = _texto(row, col)
+                if txt and ("sub total" in txt or "subtotal" in txt or txt == "sub-total"):
+                    return col
+        for col in range(inicio, min(fin, max_col + 1)):
+            for row in range(header_row + 1, min(header_row + 10, max_row + 1)):
+                if _monto(ws.cell(row=row, column=col).value):
+                    return col
+        return None
+
+    def _total_igv(subtotal_col, inicio, fin):
+        if not subtotal_col:
+            return None
+        for row in range(max_row, header_row, -1):
+            if _fila_total_igv(row):
+                val = _monto(ws.cell(row=row, column=subtotal_col).value)
+                if val:
+                    return val
+                for col in range(inicio, min(fin, max_col + 1)):
+                    val = _monto(ws.cell(row=row, column=col).value)
+                    if val:
+                        return val
+                break
+        for row in range(max_row, header_row, -1):
+            for col in range(1, max_col + 1):
+                if _texto(row, col) in ["sub total", "subtotal", "costo directo", "costo directo (sin igv)"]:
+                    val = _monto(ws.cell(row=row, column=subtotal_col).value)
+                    if val:
+                        return val
+        ultimo = None
+        for row in range(header_row + 2, max_row + 1):
+            ultimo = _monto(ws.cell(row=row, column=subtotal_col).value) or ultimo
+        return ultimo
+
+    ppto_subtotal = _subtotal_col(ppto_col, ppto_col + 12)
+    exp_subtotal = None
+    exp_end = None
+    if exp_col:
+        exp_end = ppto_col if ppto_col > exp_col else exp_col + 12
+        exp_subtotal = _subtotal_col(exp_col, exp_end)
+
+    ppto_val = _total_igv(ppto_subtotal, ppto_col, ppto_col + 12)
+    if ppto_val:
+        resultado["ppto_meta_hg"] = f"S/ {ppto_val:,.2f}"
+    if exp_subtotal:
+        exp_val = _total_igv(exp_subtotal, exp_col, exp_end)
+        if exp_val:
+            resultado["expediente"] = f"S/ {exp_val:,.2f}"
+
+    if exp_col and exp_subtotal:
+        prov_inicio = exp_subtotal + 1
+    elif exp_col:
+        prov_inicio = exp_col + 5
+    else:
+        prov_inicio = 1
+    if prov_inicio < ppto_col:
+        for row in range(max_row, 0, -1):
+            if _fila_total_igv(row):
+                for col in range(prov_inicio, ppto_col):
+                    val = _monto(ws.cell(row=row, column=col).value)
+                    if val:
+                        resultado["monto_cc"] = f"S/ {val:,.2f}"
+                        break
+                break
+    return resultado
+
+
+POSICIONES_TOTAL = {"al final": FILAS - 4, "fila 30": 30, "sin total": None}
+
+
+@pytest.mark.parametrize("posicion", list(POSICIONES_TOTAL))
+def test_benchmark_celdas_leidas_hoja_vs(posicion):
+    wb = _libro_vs(POSICIONES_TOTAL[posicion])
+
+    anterior = HojaContada(wb.active)
+    esperado = _escaneo_anterior(anterior)
+    motor = HojaContada(wb.active)
+    resultado = analizar_hoja_vs(grilla_desde_openpyxl(motor))
+
+    print(f"\n[BENCH] hoja {FILAS}x{COLUMNAS}, TOTAL (CON IGV) {posicion}: "
+          f"celdas {anterior.celdas} -> {motor.celdas}, "
+          f"filas en streaming (read_only) {anterior.filas_streaming} -> {motor.filas_streaming}")
+    assert resultado == esperado
+    assert resultado["ppto_meta_hg"] != "No especificado"
+    # El motor lee la ventana una sola vez, este donde este el total
+    assert motor.celdas == FILAS * COLUMNAS
+    assert motor.filas_streaming == FILAS
+    if posicion == "al final":
+        # Caso comun: el escaneo celda por celda en memoria leia menos celdas,
+        # pero en read_only (user-012) cada ws.cell re-parsea la hoja desde arriba
+        assert anterior.celdas < motor.celdas
+        assert anterior.filas_streaming > 100 * motor.filas_streaming
+    else:
+        assert anterior.celdas > 2 * motor.celdas
+
+
+def test_ws_cell_en_read_only_reparsea_desde_la_primera_fila(monkeypatch):
+    """Valida el modelo de HojaContada.filas_streaming contra el parser de openpyxl."""
+    parseadas = []
+    parse_original = _read_only.WorkSheetParser.parse
+
+    def _parse(self):
+        for fila in parse_original(self):
+            parseadas.append(fila[0])
+            yield fila
+
+    monkeypatch.setattr(_read_only.WorkSheetParser, "parse", _parse)
+    ws = load_workbook(io.BytesIO(_xlsx(_libro_vs(FILAS - 4))), read_only=True, data_only=True)["VS"]
+
+    ws.cell(row=150, column=3)
+    # (las filas 2-5 estan vacias y no existen en el XML)
+    assert parseadas[0] == 1 and parseadas[-1] == 150
+    del parseadas[:]
+    grilla = grilla_desde_openpyxl(ws)
+    assert parseadas[0] == 1 and parseadas[-1] == FILAS
+    assert len(parseadas) == len(set(parseadas))
+    assert grilla.max_row == FILAS and grilla.max_col == COLUMNAS
+
+
+# ============================================================================
+# CORPUS DORADO: la misma hoja VS como .xlsx, values (Sheets API) y CSV (Drive)
+# ============================================================================
+
+CORPUS = os.path.join(os.path.dirname(__file__), "datos", "hoja_vs")
+
+with open(os.path.join(CORPUS, "esperado.json"), encoding="utf-8") as _f:
+    ESPERADO = json.load(_f)
+
+
+def _grillas(caso):
+    """Grilla del caso desde cada origen, con su adaptador."""
+    ruta = os.path.join(CORPUS, caso)
+    wb = load_workbook(ruta + ".xlsx", read_only=True, data_only=True)
+    with open(ruta + ".values.json", encoding="utf-8") as f:
+        values = json.load(f)["values"]
+    with open(ruta + ".csv", encoding="utf-8") as f:
+        texto = f.read()
+    return {
+        "xlsx": grilla_desde_openpyxl(wb["VS"]),
+        "values": grilla_desde_values(values),
+        "csv": grilla_desde_csv(texto),
+    }
+
+
+@pytest.mark.parametrize("caso", sorted(ESPERADO))
+def test_corpus_mismo_resultado_en_los_tres_origenes(caso):
+    resultados = {origen: analizar_hoja_vs(grilla) for origen, grilla in _grillas(caso).items()}
+    assert resultados == {origen: ESPERADO[caso] for origen in resultados}
+
+
+def test_benchmark_motor_por_origen():
+    # Mismo motor para los tres origenes: solo cambia la conversion de celda a numero
+    repeticiones = 200
+    tiempos = {}
+    for origen, grilla in _grillas("estandar").items():
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            resultado = analizar_hoja_vs(grilla)
+        tiempos[origen] = (time.perf_counter() - inicio) / repeticiones
+        assert resultado == ESPERADO["estandar"]
+    print("\n[BENCH] hoja VS del corpus, por analisis: "
+          + ", ".join(f"{origen} {t * 1e6:.0f} us" for origen, t in tiempos.items()))
+
+
+def test_headers_de_seccion_solo_en_las_filas_1_a_19():
+    # El lector anterior de Sheets buscaba hasta la fila 20; ahora igual que Excel (1-19)
+    for grilla in _grillas("ppto_en_fila_20").values():
+        assert ubicar_secciones(grilla) == (None, None, None)
+
+
+def test_total_con_igv_en_la_fila_1_cuenta_para_monto_cc():
+    # El lector anterior de Sheets no miraba la fila 1 al buscar TOTAL (CON IGV)
+    for grilla in _grillas("total_en_fila_1").values():
+        assert grilla.filas_total_igv == [1]
+        assert analizar_hoja_vs(grilla)["monto_cc"] == "S/ 56,640.00"
+
+
+def test_google_sheet_usa_el_csv_de_drive_si_falla_la_sheets_api():
+    class SheetsCaida:
+        def spreadsheets(self):
+            raise OSError("Sheets API no disponible")
+
+    class DriveExport:
+        def files(self):
+            return self
+
+        def export(self, fileId, mimeType):
+            assert mimeType == "text/csv"
+            with open(os.path.join(CORPUS, "estandar.csv"), "rb") as f:
+                datos = f.read()
+            return type("Peticion", (), {"execute": lambda _self: b"\xef\xbb\xbf" + datos})()
+
+    resultado = drive_reader._leer_google_sheet(SheetsCaida(), "id", drive_service=DriveExport())
+    assert resultado == ESPERADO["estandar"]
+
+
+# ============================================================================
+# LAYOUTS POR HUELLA: el atajo debe dar lo mismo que la busqueda completa
+# ============================================================================
+
+def _grilla_plantilla(fila_total, filas, semilla=0):
+    """Hoja VS de la plantilla de SECCIONES (misma huella), con otros datos segun la semilla."""
+    return grilla_desde_openpyxl(_libro_vs(fila_total, filas=filas, columnas=42, semilla=semilla).active)
+
+
+def test_layout_aprendido_da_el_mismo_resultado_que_la_busqueda_completa():
+    layouts = LayoutsVS()
+    for semilla in range(15):
+        filas = 40 + 9 * semilla
+        grilla = _grilla_plantilla(filas - 3, filas, semilla)
+        esperado = _analizar_completo(grilla)[0]
+        # Primera hoja: busqueda completa y aprende; el resto (y la segunda pasada): atajo
+        assert analizar_hoja_vs(grilla, layouts) == esperado
+        assert analizar_hoja_vs(grilla, layouts) == esperado
+    assert (layouts.fallos, layouts.aciertos, layouts.no_validos) == (1, 29, 0)
+
+    # Lo aprendido sobrevive a guardar/cargar (cache/layouts_vs.json)
+    cargados = LayoutsVS(layouts.exportar())
+    grilla = _grilla_plantilla(117, 120, semilla=99)
+    assert analizar_hoja_vs(grilla, cargados) == _analizar_completo(grilla)[0]
+    assert cargados.aciertos == 1
+
+
+@pytest.mark.parametrize("caso", ["mas filas al final", "otro total debajo"])
+def test_hoja_que_no_cumple_el_layout_vuelve_a_la_busqueda_completa(caso):
+    layouts = LayoutsVS()
+    analizar_hoja_vs(_grilla_plantilla(57, 60), layouts)
+
+    if caso == "mas filas al final":
+        # Misma plantilla, pero TOTAL (CON IGV) a 10 filas del final (el layout dice 3)
+        wb = _libro_vs(50, filas=60, columnas=42, semilla=1)
+    else:
+        # La fila del layout tiene TOTAL (CON IGV), pero hay otro mas abajo
+        wb = _libro_vs(57, filas=60, columnas=42, semilla=1)
+        wb.active.cell(row=59, column=1, value="TOTAL (CON IGV)")
+    grilla = grilla_desde_openpyxl(wb.active)
+
+    assert analizar_hoja_vs(grilla, layouts) == _analizar_completo(grilla)[0]
+    assert layouts.no_validos == 1
+    assert layouts.aciertos == 0
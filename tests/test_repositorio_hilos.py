@@ -0,0 +1,170 @@
+"""
+Bytes por hilo del seguimiento: threads.get(format=full) contra
+format=metadata con metadataHeaders y la mascara FIELDS_METADATA, sobre un
+servicio de hilos falso que arma las respuestas como Gmail (cuerpos en
+base64, headers de transporte, adjunto). Con -s se imprimen los tamaños.
+"""
+import base64
+import json
+
+from agente_seguimiento import analizar_comparativo, crear_contexto
+from repositorio_hilos import RepositorioHilos, FIELDS_METADATA
+
+MENSAJES_POR_HILO = 6
+
+
+def _b64(texto):
+    return base64.urlsafe_b64encode(texto.encode("utf-8")).decode("ascii")
+
+
+def _mensaje(thread_id, idx, de, texto, citado):
+    """Mensaje format=full: texto + HTML (con la cadena citada), headers de transporte y adjunto en el primero."""
+    headers = [
+        {"name": "From", "value": de},
+        {"name": "To", "value": "Yo <yo@empresa.com>"},
+        {"name": "Cc", "value": "Gerencia <gerencia@empresa.com>, Logistica <logistica@empresa.com>"},
+        {"name": "Subject", "value": "RE: Cuadro comparativo - Obra Los Pinos"},
+        {"name": "Date", "value": f"Mon, {idx + 1} Sep 2026 10:00:00 -0500"},
+        {"name": "Message-ID", "value": f"<{thread_id}.{idx}@mail.empresa.com>"},
+        {"name": "References", "value": " ".join(f"<{thread_id}.{i}@mail.empresa.com>" for i in range(idx))},
+        {"name": "DKIM-Signature", "value": "v=1; a=rsa-sha256; c=relaxed/relaxed; d=empresa.com; b=" + "A" * 344},
+        {"name": "ARC-Seal", "value": "i=1; a=rsa-sha256; t=1756738800; cv=none; b=" + "B" * 344},
+        {"name": "Content-Type", "value": 'multipart/mixed; boundary="000000000000abcdef"'},
+    ] + [{"name": "Received", "value": f"by 2002:a05:6000:{salto}::1 with SMTP id x; Mon, 1 Sep 2026"}
+         for salto in range(5)]
+    cuerpo = texto + "\n\n" + citado
+    partes = [{"partId": "0", "mimeType": "multipart/alternative", "filename": "", "headers": [],
+               "body": {"size": 0}, "parts": [
+                   {"partId": "0.0", "mimeType": "text/plain", "filename": "", "headers": [],
+                    "body": {"size": len(cuerpo), "data": _b64(cuerpo)}},
+                   {"partId": "0.1", "mimeType": "text/html", "filename": "", "headers": [],
+                    "body": {"size": 3 * len(cuerpo), "data": _b64(f"<div dir=\"ltr\"><p>{cuerpo}</p></div>" * 3)}},
+               ]}]
+    if idx == 0:
+        partes.append({"partId": "1", "mimeType": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                       "filename": "Comparativo VS.xlsx", "headers": [],
+                       "body": {"attachmentId": "ANGjdJ" + "x" * 300, "size": 48213}})
+    return {
+        "id": f"{thread_id}.{idx}", "threadId": thread_id, "labelIds": ["INBOX"], "historyId": "900",
+        "internalDate": "1756738800000", "sizeEstimate": 60000, "snippet": texto[:120],
+        "payload": {"partId": "", "mimeType": "multipart/mixed", "filename": "", "headers": headers,
+                    "body": {"size": 0}, "parts": partes},
+    }
+
+
+def _hilo_completo(thread_id):
+    remitentes = ["Proveedor <p@proveedor.com>", "Yo <yo@empresa.com>"]
+    mensajes = []
+    citado = ""
+    for idx in range(MENSAJES_POR_HILO):
+        texto = ("Adjunto cuadro comparativo para revision de la partida de acero. " if idx % 2 == 0
+                 else "Revisado, conforme con el proveedor ganador. ") * 6
+        mensajes.append(_mensaje(thread_id, idx, remitentes[idx % 2], texto, citado))
+        citado = "> " + texto + "\n" + citado
+    return {"id": thread_id, "historyId": "900", "messages": mensajes}
+
+
+def _parsear_campos(texto):
+    """Mascara fields de Google ("a,b(c,d/e)") -> arbol {campo: subarbol o None}."""
+    def _lista(i):
+        arbol = {}
+        while i < len(texto):
+            j = i
+            while j < len(texto) and texto[j] not in ",()":
+                j += 1
+            ruta = texto[i:j].split("/")
+            i = j
+            sub = None
+            if i < len(texto) and texto[i] == "(":
+                sub, i = _lista(i + 1)
+            nodo = arbol
+            for parte in ruta[:-1]:
+                nodo = nodo.setdefault(parte, {})
+            nodo[ruta[-1]] = sub
+            if i < len(texto) and texto[i] == ")":
+                return arbol, i + 1
+            i += 1
+        return arbol, i
+    return _lista(0)[0]
+
+
+def _filtrar(datos, arbol):
+    if arbol is None:
+        return datos
+    if isinstance(datos, list):
+        return [_filtrar(d, arbol) for d in datos]
+    return {k: _filtrar(datos[k], sub) for k, sub in arbol.items() if k in datos}
+
+
+class FakeHilos:
+    """service.users().threads().get(...) con format full/metadata y mascara fields; registra bytes por respuesta."""
+
+    def __init__(self):
+        self.respuestas = []
+
+    def users(self):
+        return self
+
+    def threads(self):
+        return self
+
+    def get(self, userId, id, format="full", metadataHeaders=None, fields=None):
+        hilo = _hilo_completo(id)
+        if format == "metadata":
+            nombres = {h.lower() for h in metadataHeaders or []}
+            for msg in hilo["messages"]:
+                payload = msg["payload"]
+                msg["payload"] = {
+                    "partId": "", "mimeType": payload["mimeType"], "filename": "",
+                    "headers": [h for h in payload["headers"] if h["name"].lower() in nombres],
+                }
+        if fields:
+            hilo = _filtrar(hilo, _parsear_campos(fields))
+        self.respuestas.append((format, len(json.dumps(hilo).encode("utf-8"))))
+        return _Peticion(hilo)
+
+
+class _Peticion:
+    def __init__(self, datos):
+        self.datos = datos
+
+    def execute(self):
+        return self.datos
+
+
+def _comparativo(i):
+    return {"id": f"m{i}", "thread_id": f"t{i}", "asunto": "Cuadro comparativo", "de": "Proveedor",
+            "fecha": "01/09/2026", "monto": "S/ 1,000"}
+
+
+def test_parsear_campos_de_fields_metadata():
+    assert _parsear_campos(FIELDS_METADATA) == {
+        "id": None, "historyId": None,
+        "messages": {"id": None, "threadId": None, "snippet": None, "payload": {"headers": None}},
+    }
+
+
+def test_benchmark_bytes_por_hilo_full_vs_metadata():
+    hilos = 10
+    fake = FakeHilos()
+    contexto = crear_contexto("yo@empresa.com")
+
+    # Antes: seguimiento sobre el hilo completo (format=full, sin mascara)
+    completo = RepositorioHilos()
+    antes = []
+    for i in range(hilos):
+        completo.obtener(fake, f"t{i}", formato="full")
+        antes.append(analizar_comparativo(fake, _comparativo(i), contexto, completo))
+    # Ahora: format=metadata + metadataHeaders + FIELDS_METADATA
+    ahora = [analizar_comparativo(fake, _comparativo(i), contexto) for i in range(hilos)]
+
+    bytes_full = sum(n for formato, n in fake.respuestas if formato == "full") / hilos
+    bytes_metadata = sum(n for formato, n in fake.respuestas if formato == "metadata") / hilos
+    print(f"\n[BENCH] {MENSAJES_POR_HILO} mensajes por hilo: format=full {bytes_full / 1024:.1f} KB, "
+          f"metadata+fields {bytes_metadata / 1024:.1f} KB por hilo ({bytes_full / bytes_metadata:.0f}x menos)")
+
+    assert len(fake.respuestas) == 2 * hilos
+    # El seguimiento solo usa From/Date/Subject + snippet: mismo resultado con la metadata
+    assert ahora == antes
+    assert {s["estado_general"] for s in ahora} == {"RESPONDIDO"}
+    assert bytes_metadata * 10 < bytes_full
@@ -0,0 +1,119 @@
+"""
+Benchmark del seguimiento: serie (realizar_seguimiento) vs tareas en paralelo
+del Planificador (como en main.py) contra un servicio de hilos falso con
+latencia artificial; cada worker usa su propio servicio falso. Con -s se
+imprimen los tiempos.
+"""
+import threading
+import time
+
+from agente_seguimiento import realizar_seguimiento, analizar_comparativo, crear_contexto
+from planificador import Planificador
+
+LATENCIA = 0.03
+HILOS = 40
+WORKERS = 8
+
+
+class FakeThreads:
+    """service.users().threads().get(...).execute() con LATENCIA segundos por llamada."""
+
+    def __init__(self):
+        self.llamadas = 0
+        self._lock = threading.Lock()
+
+    def users(self):
+        return self
+
+    def threads(self):
+        return self
+
+    def get(self, userId, id, **_kwargs):
+        return _Peticion(self, id)
+
+
+class _Peticion:
+    def __init__(self, fake, thread_id):
+        self.fake = fake
+        self.thread_id = thread_id
+
+    def execute(self):
+        time.sleep(LATENCIA)
+        with self.fake._lock:
+            self.fake.llamadas += 1
+        numero = int(self.thread_id[1:])
+        mensajes = [_mensaje("Proveedor <p@proveedor.com>", "Adjunto cuadro comparativo para revision")]
+        if numero % 2:
+            mensajes.append(_mensaje("Yo <yo@empresa.com>", "Revisado, conforme"))
+        return {"id": self.thread_id, "messages": mensajes}
+
+
+def _mensaje(de, snippet):
+    return {"snippet": snippet, "payload": {"headers": [
+        {"name": "From", "value": de}, {"name": "Date", "value": "Mon, 1 Jan 2026 10:00:00 -0500"},
+        {"name": "Subject", "value": "Comparativo"},
+    ]}}
+
+
+def _comparativos():
+    return [{"id": f"m{i}", "thread_id": f"t{i}", "asunto": "Comparativo", "de": "Proveedor",
+             "fecha": "01/01/2026", "monto": "S/ 1,000"} for i in range(HILOS)]
+
+
+class ServicioPorHilo:
+    """Un FakeThreads por hilo del worker, como servicio_del_hilo en main.py."""
+
+    def __init__(self):
+        self.creados = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        fake = getattr(self._local, "fake", None)
+        if fake is None:
+            fake = self._local.fake = FakeThreads()
+            fake.hilo = threading.get_ident()
+            with self._lock:
+                self.creados.append(fake)
+        # Un servicio nunca se usa desde otro hilo (httplib2 no es thread-safe)
+        assert fake.hilo == threading.get_ident()
+        return fake
+
+
+def _en_paralelo(servicio, comparativos, workers):
+    """servicio: funcion sin argumentos que retorna el servicio del hilo actual."""
+    plan = Planificador(workers=workers)
+    contexto = crear_contexto("yo@empresa.com")
+    for i, comp in enumerate(comparativos):
+        plan.agregar(f"seguimiento:{i}", lambda comp=comp: analizar_comparativo(servicio(), comp, contexto), "seguimiento")
+    plan.ejecutar()
+    return [plan.resultado(f"seguimiento:{i}") for i in range(len(comparativos))]
+
+
+def test_benchmark_seguimiento_paralelo():
+    comparativos = _comparativos()
+
+    fake = FakeThreads()
+    inicio = time.perf_counter()
+    serie = realizar_seguimiento(fake, comparativos, "yo@empresa.com")
+    t_serie = time.perf_counter() - inicio
+
+    por_hilo = ServicioPorHilo()
+    inicio = time.perf_counter()
+    paralelo = _en_paralelo(por_hilo, comparativos, WORKERS)
+    t_paralelo = time.perf_counter() - inicio
+
+    print(f"\n[BENCH] {HILOS} hilos, {LATENCIA * 1000:.0f} ms por threads.get: "
+          f"serie {t_serie:.2f}s, {WORKERS} workers {t_paralelo:.2f}s ({t_serie / t_paralelo:.1f}x)")
+    assert paralelo == serie
+    assert fake.llamadas == sum(f.llamadas for f in por_hilo.creados) == HILOS
+    assert 1 < len(por_hilo.creados) <= WORKERS
+    assert [s["estado_general"] for s in serie[:2]] == ["PENDIENTE", "RESPONDIDO"]
+    assert t_paralelo * 3 < t_serie
+
+
+def test_contexto_es_inmutable_entre_ejecuciones():
+    contexto = crear_contexto("Yo@Empresa.com")
+    assert contexto.mi_email == "yo@empresa.com"
+    assert crear_contexto("otro@empresa.com").mi_email == "otro@empresa.com"
+    assert contexto.mi_email == "yo@empresa.com"
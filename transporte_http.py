@@ -0,0 +1,77 @@
+"""
+Transporte HTTP compartido por Gmail, Drive y Sheets.
+
+googleapiclient usa por defecto un httplib2.Http por servicio: sin pool, no
+es thread-safe y cada servicio (y cada hilo) abre sus propias conexiones TLS.
+Aqui todos los servicios del proceso usan una sola AuthorizedSession
+(requests + urllib3) con un pool de conexiones keep-alive, envuelta en un
+adaptador con la interfaz de httplib2 que espera googleapiclient
+(request() -> (httplib2.Response, bytes)).
+"""
+import threading
+
+import httplib2
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+
+from plazo import plazo
+
+
+class HttpCompartido:
+    """
+    Adaptador httplib2 -> AuthorizedSession (seguro entre hilos).
+
+    Una instancia por proceso; se pasa como http= a googleapiclient.discovery.build.
+    """
+
+    def __init__(self, credentials, pool_size, timeout):
+        """
+        Args:
+            credentials: credenciales OAuth2 (google.oauth2.credentials.Credentials).
+            pool_size: conexiones keep-alive por host.
+            timeout: segundos por peticion (menos si queda menos plazo, ver plazo.py).
+        """
+        self.credentials = credentials
+        self.timeout = timeout
+        self._sesion = AuthorizedSession(credentials)
+        self._adapter = HTTPAdapter(pool_connections=20, pool_maxsize=pool_size)
+        self._sesion.mount("https://", self._adapter)
+        self._lock = threading.Lock()
+        self.peticiones = 0
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=5, connection_type=None):
+        """Misma firma que httplib2.Http.request."""
+        respuesta = self._sesion.request(
+            method, uri, data=body, headers=headers, timeout=plazo.timeout(self.timeout),
+        )
+        with self._lock:
+            self.peticiones += 1
+
+        cabeceras = {"status": str(respuesta.status_code)}
+        for clave, valor in respuesta.headers.items():
+            # requests ya descomprimio el cuerpo
+            if clave.lower() != "content-encoding":
+                cabeceras[clave.lower()] = valor
+        resp = httplib2.Response(cabeceras)
+        resp.reason = respuesta.reason
+        return resp, respuesta.content
+
+    def close(self):
+        """No-op: la sesion es compartida por todos los servicios (ver cerrar())."""
+
+    def cerrar(self):
+        self._sesion.close()
+
+    def conexiones_nuevas(self):
+        """Conexiones TCP/TLS abiertas por el pool (todas las que hubo desde el inicio)."""
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[clave].num_connections for clave in pools.keys())
+
+    def resumen(self):
+        """Texto corto para logs: cuantas peticiones reutilizaron una conexion abierta."""
+        conexiones = self.conexiones_nuevas()
+        reutilizadas = max(self.peticiones - conexiones, 0)
+        tasa = f"{100 * reutilizadas / self.peticiones:.0f}%" if self.peticiones else "-"
+        return (f"HTTP: {self.peticiones} peticiones, {conexiones} conexiones nuevas "
+                f"({tasa} reutilizadas)")